@@ -1,11 +1,17 @@
 from flask import Flask, request, abort
+import hashlib
 import json
+import logging
+import threading
+import time
+from collections import OrderedDict
 from functools import wraps
 from jose import jwt
 from urllib.request import urlopen
 
 
 app = Flask(__name__)
+logger = logging.getLogger(__name__)
 
 AUTH0_DOMAIN = @TODO_REPLACE_WITH_YOUR_DOMAIN
 ALGORITHMS = ['RS256']
@@ -105,12 +111,111 @@ def verify_decode_jwt(token):
             }, 400)
 
 
+class VerifiedTokenCache:
+    """A bounded LRU of verified payloads, keyed by a hash of the token
+
+    get() returns a cached payload until the token's exp, verify() runs the
+    full verification and caches the result. Hits, misses and time spent
+    verifying are counted for stats() and logged every log_every lookups.
+
+    This sample runs on its own, so it keeps its own copy of the coffee
+    shop's src/auth/token_cache.py; the tests live with that one
+    (test_token_cache.py). Change both together.
+    """
+
+    def __init__(self, max_tokens=1024, clock=time.time, log_every=1000):
+        self.max_tokens = max_tokens
+        self.clock = clock
+        self.log_every = log_every
+        self._payloads = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.verifications = 0
+        self.verification_seconds = 0.0
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def get(self, token):
+        key = self._key(token)
+        payload = None
+        with self._lock:
+            entry = self._payloads.get(key)
+            if entry is not None:
+                if self.clock() < entry[1]:
+                    self._payloads.move_to_end(key)
+                    payload = entry[0]
+                else:
+                    del self._payloads[key]
+            if payload is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            report = self.log_every and (self.hits + self.misses) % self.log_every == 0
+        if report:
+            self.log_stats()
+        return payload
+
+    def verify(self, token, verify_decode_jwt):
+        started = time.perf_counter()
+        try:
+            payload = verify_decode_jwt(token)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.verifications += 1
+                self.verification_seconds += elapsed
+
+        expires_at = payload.get('exp')
+        if isinstance(expires_at, (int, float)):
+            key = self._key(token)
+            with self._lock:
+                self._payloads[key] = (payload, expires_at)
+                self._payloads.move_to_end(key)
+                while len(self._payloads) > self.max_tokens:
+                    self._payloads.popitem(last=False)
+        return payload
+
+    def clear(self):
+        with self._lock:
+            self._payloads.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._payloads),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'verifications': self.verifications,
+                'average_verification_ms': (
+                    1000 * self.verification_seconds / self.verifications
+                    if self.verifications else 0.0
+                )
+            }
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(
+            'Verified token cache: %d tokens, %d hits, %d misses, hit rate %.1f%%, %d verifications averaging %.1f ms',
+            stats['size'], stats['hits'], stats['misses'], 100 * stats['hit_rate'],
+            stats['verifications'], stats['average_verification_ms'])
+
+
+token_cache = VerifiedTokenCache()
+
+
 def requires_auth(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
         token = get_token_auth_header()
         try:
-            payload = verify_decode_jwt(token)
+            payload = token_cache.get(token)
+            if payload is None:
+                payload = token_cache.verify(token, verify_decode_jwt)
         except:
             abort(401)
         return f(payload, *args, **kwargs)
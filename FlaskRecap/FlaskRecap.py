@@ -1,33 +1,85 @@
-from flask import Flask, request, jsonify, abort
+import os
+from flask import Flask, request, jsonify, abort, Response
+
+from greeting_store import MemoryGreetingStore, SQLiteGreetingStore
 
 app = Flask(__name__)
 
-greetings = {
-            'en': 'hello', 
-            'es': 'Hola', 
-            'ar': 'مرحبا',
-            'ru': 'Привет',
-            'fi': 'Hei',
-            'he': 'שלום',
-            'ja': 'こんにちは'
-            }
+# set GREETINGS_DB to a file path to share greetings between worker
+# processes and keep them across restarts
+if os.environ.get('GREETINGS_DB'):
+    store = SQLiteGreetingStore(os.environ['GREETINGS_DB'])
+else:
+    store = MemoryGreetingStore()
+
+
+def conditional(response, snapshot):
+    # every GET is derived from one snapshot, so its etag changes exactly
+    # when any greeting does; clients revalidate and usually get a 304
+    response.set_etag(snapshot.etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def greetings_response(snapshot):
+    return Response(snapshot.body, mimetype='application/json')
+
+def requested_langs():
+    langs = request.args.get('lang')
+    if langs is None:
+        return None
+    return [lang for lang in (part.strip() for part in langs.split(',')) if lang]
+
+def posted_greetings(info):
+    # one greeting: {"lang": "fr", "greeting": "bonjour"}
+    # many: {"greetings": {"fr": "bonjour", "de": "hallo"}}
+    #   or  {"greetings": [{"lang": "fr", "greeting": "bonjour"}, ...]}
+    if not isinstance(info, dict):
+        abort(422)
+    if 'greetings' in info:
+        greetings = info['greetings']
+        if isinstance(greetings, list):
+            if not all(isinstance(item, dict) and 'lang' in item and 'greeting' in item for item in greetings):
+                abort(422)
+            greetings = {item['lang']: item['greeting'] for item in greetings}
+    elif 'lang' in info and 'greeting' in info:
+        greetings = {info['lang']: info['greeting']}
+    else:
+        abort(422)
+    if (not isinstance(greetings, dict) or not greetings or
+            not all(isinstance(lang, str) and lang and isinstance(greeting, str)
+                    for lang, greeting in greetings.items())):
+        abort(422)
+    return greetings
 
 @app.route('/greeting', methods=['GET'])
 def greeting_all():
-    return jsonify({'greetings': greetings})
+    snapshot = store.snapshot()
+    langs = requested_langs()
+    if langs is None:
+        return conditional(greetings_response(snapshot), snapshot)
+
+    greetings = {lang: snapshot.greetings[lang] for lang in langs if lang in snapshot.greetings}
+    if not greetings:
+        abort(404)
+    return conditional(jsonify({
+        'greetings': greetings,
+        'missing': [lang for lang in langs if lang not in greetings]
+    }), snapshot)
 
 @app.route('/greeting/<lang>', methods=['GET'])
 def greeting_one(lang):
     print(lang)
+    snapshot = store.snapshot()
+    greetings = snapshot.greetings
     if(lang not in greetings):
         abort(404)
-    return jsonify({'greeting': greetings[lang
-    ]})
+    return conditional(jsonify({'greeting': greetings[lang
+    ]}), snapshot)
 
 @app.route('/greeting', methods=['POST'])
 def greeting_add():
     info = request.get_json()
-    if('lang' not in info or 'greeting' not in info):
-        abort(422)
-    greetings[info['lang']] = info['greeting']
-    return jsonify({'greetings':greetings})
+    snapshot = store.update(posted_greetings(info))
+    response = greetings_response(snapshot)
+    response.set_etag(snapshot.etag)
+    return response
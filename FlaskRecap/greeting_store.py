@@ -0,0 +1,121 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import namedtuple
+
+DEFAULT_GREETINGS = {
+            'en': 'hello',
+            'es': 'Hola',
+            'ar': 'مرحبا',
+            'ru': 'Привет',
+            'fi': 'Hei',
+            'he': 'שלום',
+            'ja': 'こんにちは'
+            }
+
+
+class Snapshot(namedtuple('Snapshot', ['greetings', 'body', 'etag'])):
+    """An immutable view of every greeting
+
+    body is the GET /greeting response, already serialized, and etag is
+    a hash of it. A snapshot is built once per write and then shared by
+    every read until the next write replaces it.
+    """
+
+    @classmethod
+    def build(cls, greetings):
+        body = json.dumps({'greetings': greetings}, sort_keys=True).encode('utf-8')
+        return cls(greetings, body, hashlib.sha1(body).hexdigest())
+
+
+class MemoryGreetingStore:
+    """Greetings held in this process, updated read-copy-update style
+
+    Readers take the current snapshot without locking. Writers copy the
+    greetings under a lock, apply their change, build a new snapshot and
+    swap it in with a single assignment, so a reader sees either the old
+    or the new greetings, never a half-applied write.
+    """
+
+    def __init__(self, greetings=DEFAULT_GREETINGS):
+        self._snapshot = Snapshot.build(dict(greetings))
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        return self._snapshot
+
+    def update(self, greetings):
+        with self._lock:
+            merged = dict(self._snapshot.greetings)
+            merged.update(greetings)
+            self._snapshot = Snapshot.build(merged)
+            return self._snapshot
+
+
+class SQLiteGreetingStore:
+    """Greetings kept in a SQLite file shared by every worker process
+
+    Every write bumps a version number in the same transaction. Each
+    process keeps its last snapshot and only rebuilds it when a read finds
+    the version has moved, so a read normally costs one indexed lookup.
+    Greetings survive restarts; DEFAULT_GREETINGS are loaded into a new
+    database.
+    """
+
+    def __init__(self, path, greetings=DEFAULT_GREETINGS):
+        self.path = path
+        self._local = threading.local()
+        # (version, snapshot), swapped as one value
+        self._current = (None, None)
+        self._lock = threading.Lock()
+
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS greetings (lang TEXT PRIMARY KEY, greeting TEXT NOT NULL)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS greetings_version (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)')
+            created = connection.execute(
+                'INSERT OR IGNORE INTO greetings_version (id, version) VALUES (1, 0)').rowcount
+            if created:
+                connection.executemany(
+                    'INSERT OR IGNORE INTO greetings (lang, greeting) VALUES (?, ?)', greetings.items())
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def _load(self, connection):
+        version = connection.execute('SELECT version FROM greetings_version WHERE id = 1').fetchone()[0]
+        cached_version, snapshot = self._current
+        if cached_version is not None and version <= cached_version:
+            return snapshot
+
+        snapshot = Snapshot.build(dict(connection.execute('SELECT lang, greeting FROM greetings')))
+        with self._lock:
+            # another thread may have installed something newer meanwhile
+            if self._current[0] is None or version > self._current[0]:
+                self._current = (version, snapshot)
+        return snapshot
+
+    def snapshot(self):
+        connection = self._connection()
+        # one read transaction, so the version and the rows agree
+        with connection:
+            connection.execute('BEGIN')
+            return self._load(connection)
+
+    def update(self, greetings):
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany(
+                'INSERT OR REPLACE INTO greetings (lang, greeting) VALUES (?, ?)', greetings.items())
+            connection.execute('UPDATE greetings_version SET version = version + 1 WHERE id = 1')
+            return self._load(connection)
@@ -0,0 +1,176 @@
+import math
+import threading
+import time
+from collections import Counter
+
+from flask import g, request
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+# ----------------------------------------------------------------------------#
+# Admission control.
+#
+# Each worker lets ADMISSION_CAPACITY requests run at a time. When the
+# database slows down, the rest wait up to ADMISSION_QUEUE_TIMEOUT for a
+# slot, ADMISSION_QUEUE_SIZE of them per priority; past that they get an
+# immediate 503 with Retry-After instead of piling up until everything times
+# out. Keep gunicorn's threads above the capacity so those extra threads are
+# free to queue and refuse requests.
+#
+# Views are HIGH, NORMAL (the default) or LOW priority, set with @admit. LOW
+# requests, the expensive searches and listings, may only fill part of the
+# capacity and give way to waiting requests of higher priority, so detail
+# pages keep working under load. @admit(concurrency=n) also caps how many
+# requests to one view run at a time.
+#
+# Each client IP gets a token bucket of ADMISSION_BURST requests, refilled
+# at ADMISSION_RATE a second; when it is empty the answer is 429 with
+# Retry-After. Buckets belong to one worker, so a client can make up to
+# that rate to each worker. Behind PROXY_COUNT proxies, the client IP is the
+# one the outermost proxy added to X-Forwarded-For; the entries before it
+# come from the client and can't be trusted.
+# ----------------------------------------------------------------------------#
+
+HIGH, NORMAL, LOW = "high", "normal", "low"
+# how much of the capacity each priority may fill
+SHARES = {HIGH: 1.0, NORMAL: 0.75, LOW: 0.5}
+AHEAD_OF = {HIGH: (), NORMAL: (HIGH,), LOW: (HIGH, NORMAL)}
+EXEMPT_ENDPOINTS = {"static"}
+# past this many client buckets, full ones are forgotten
+MAX_CLIENTS = 10000
+
+
+class Limiter:
+    def __init__(self, capacity, queue_size, timeout):
+        self.capacity = capacity
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.running = 0
+        self.running_by_view = Counter()
+        self.waiting = Counter()
+        self._changed = threading.Condition()
+
+    def admissible(self, view, priority, concurrency):
+        if self.running >= math.ceil(self.capacity * SHARES[priority]):
+            return False
+        if concurrency is not None and self.running_by_view[view] >= concurrency:
+            return False
+        return not any(self.waiting[ahead] for ahead in AHEAD_OF[priority])
+
+    def acquire(self, view, priority=NORMAL, concurrency=None):
+        # True once the request may run; False when it should be refused
+        with self._changed:
+            if not self.admissible(view, priority, concurrency):
+                if self.waiting[priority] >= self.queue_size:
+                    return False
+                self.waiting[priority] += 1
+                try:
+                    admitted = self._changed.wait_for(
+                        lambda: self.admissible(view, priority, concurrency), self.timeout
+                    )
+                finally:
+                    self.waiting[priority] -= 1
+                    # those queued behind may go now
+                    self._changed.notify_all()
+                if not admitted:
+                    return False
+            self.running += 1
+            self.running_by_view[view] += 1
+            return True
+
+    def release(self, view):
+        with self._changed:
+            self.running -= 1
+            self.running_by_view[view] -= 1
+            self._changed.notify_all()
+
+
+class TokenBuckets:
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        # client: (tokens, when last counted)
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, client):
+        # 0 if the request may go ahead, else seconds until it could
+        with self._lock:
+            now = self.clock()
+            tokens, counted = self.buckets.get(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - counted) * self.rate)
+            if len(self.buckets) >= MAX_CLIENTS and client not in self.buckets:
+                self.forget_full(now)
+            if tokens >= 1:
+                self.buckets[client] = (tokens - 1, now)
+                return 0
+            self.buckets[client] = (tokens, now)
+            return (1 - tokens) / self.rate
+
+    def forget_full(self, now):
+        refill = self.burst / self.rate
+        for client, (tokens, counted) in list(self.buckets.items()):
+            if now - counted >= refill:
+                del self.buckets[client]
+
+
+def busy(retry_after, status=503):
+    return (
+        "Fyyur is busy, please try again shortly.\n",
+        status,
+        {"Retry-After": str(max(1, math.ceil(retry_after))), "Content-Type": "text/plain"},
+    )
+
+
+class AdmissionControl:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.limiter = Limiter(
+            app.config.get("ADMISSION_CAPACITY", 4),
+            app.config.get("ADMISSION_QUEUE_SIZE", 8),
+            app.config.get("ADMISSION_QUEUE_TIMEOUT", 0.5),
+        )
+        rate = app.config.get("ADMISSION_RATE", 20)
+        self.buckets = TokenBuckets(rate, app.config.get("ADMISSION_BURST", 40)) if rate else None
+        self.retry_after = app.config.get("ADMISSION_RETRY_AFTER", 1)
+        proxies = app.config.get("PROXY_COUNT", 0)
+        if proxies:
+            # otherwise every client behind the proxy would share its bucket
+            app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies)
+        # registered first, so a refused request costs as little as possible
+        app.before_request_funcs.setdefault(None, []).insert(0, self.admit_request)
+        app.teardown_request(self.release_request)
+        app.extensions["admission"] = self
+
+    def admit_request(self):
+        if request.endpoint is None or request.endpoint in EXEMPT_ENDPOINTS:
+            return None
+        if self.buckets is not None:
+            wait = self.buckets.take(request.remote_addr)
+            if wait:
+                return busy(wait, 429)
+        view = self.app.view_functions[request.endpoint]
+        priority = getattr(view, "admission_priority", NORMAL)
+        if not self.limiter.acquire(request.endpoint, priority, getattr(view, "admission_concurrency", None)):
+            return busy(self.retry_after)
+        g.admitted = request.endpoint
+        return None
+
+    def release_request(self, exception=None):
+        view = g.pop("admitted", None)
+        if view is not None:
+            self.limiter.release(view)
+
+
+def admit(priority=NORMAL, concurrency=None):
+    # e.g. @admit(LOW, concurrency=2) under @app.route
+    def decorator(view):
+        view.admission_priority = priority
+        view.admission_concurrency = concurrency
+        return view
+
+    return decorator
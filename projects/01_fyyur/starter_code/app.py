@@ -4,17 +4,26 @@
 
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, flash, redirect, url_for, jsonify
+from flask import Flask, render_template, request, flash, redirect, url_for, jsonify, abort, session
 from flask_moment import Moment
 from flask_migrate import Migrate
-import logging
-from logging import Formatter, FileHandler
 from flask_wtf.csrf import CSRFProtect
 from forms import ArtistForm, VenueForm, ShowForm
 from sqlalchemy.exc import IntegrityError
 import datetime
-from models import db, Artist, Venue, Show
+from models import db, Artist, Venue, Show, DEFAULT_SHOW_MINUTES
+from admission import AdmissionControl, admit, HIGH, LOW
+from assets import Assets
+from facets import parse_filters, browse, facet_cache, facet_links
+from invalidation import bus
+from logs import QueuedLogging
+from matchmaking import match_index, matches_cli
+from nearby import Nearby, DEFAULT_MILES
+from partitions import shows_cli
+from replicas import ReplicaRouter, use_primary
+from typeahead import typeahead, DEFAULT_LIMIT, MAX_LIMIT
 from sqlalchemy import or_
+import uuid
 
 # ----------------------------------------------------------------------------#
 # App Config.
@@ -23,9 +32,16 @@ from sqlalchemy import or_
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object("config")
+admission = AdmissionControl(app)
 db.init_app(app)
+replicas = ReplicaRouter(app, db)
+bus.init_app(app)
 csrf = CSRFProtect(app)
 migrate = Migrate(app, db)
+assets = Assets(app)
+nearby = Nearby(app)
+app.cli.add_command(matches_cli)
+app.cli.add_command(shows_cli)
 # ----------------------------------------------------------------------------#
 # Models.
 # ----------------------------------------------------------------------------#
@@ -55,22 +71,94 @@ def format_datetime(value, format="medium"):
 
 app.jinja_env.filters["datetime"] = format_datetime
 
+
+# ----------------------------------------------------------------------------#
+# Scheduling.
+# ----------------------------------------------------------------------------#
+
+# raised by the double-booking trigger on Show, see models.Show
+BOOKING_CONFLICTS = {
+    "ex_show_venue_slot": "The venue already has a show booked at that time.",
+    "ex_show_artist_slot": "The artist is already playing another show at that time.",
+}
+
+
+def parse_window(args):
+    # ?start=...&end=... as ISO 8601 or similar; times without a zone are taken as UTC,
+    # like Show.start_time
+    try:
+        start = dateutil.parser.parse(args["start"])
+        end = dateutil.parser.parse(args["end"])
+    except (KeyError, ValueError, OverflowError):
+        abort(400)
+    start, end = [t if t.tzinfo else t.replace(tzinfo=datetime.timezone.utc) for t in (start, end)]
+    if end <= start:
+        abort(400)
+    return start, end
+
+
+def parse_location(args):
+    # ?lat=...&lng=... or a city to geocode, ?city=...&state=...
+    if "lat" in args or "lng" in args:
+        try:
+            lat, lng = float(args["lat"]), float(args["lng"])
+        except (KeyError, ValueError):
+            abort(400)
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            abort(400)
+        return lat, lng
+    if not args.get("city") or not args.get("state"):
+        abort(400)
+    location = nearby.geocode(None, args["city"], args["state"])
+    if location is None:
+        abort(404)
+    return location
+
+
+def parse_bbox(value):
+    # south,west,north,east in degrees; west > east crosses the antimeridian
+    try:
+        south, west, north, east = (float(part) for part in value.split(","))
+    except ValueError:
+        abort(400)
+    if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+        abort(400)
+    return south, west, north, east
+
+
 # ----------------------------------------------------------------------------#
 # Controllers.
 # ----------------------------------------------------------------------------#
 
 
 @app.route("/")
+@admit(HIGH)
 def index():
     return render_template("pages/home.html")
 
 
+def render_browse(kind, endpoint):
+    # /venues/browse?genre=Jazz&genre=Swing&state=CA&seeking=1
+    filters = parse_filters(request.args)
+    counts = facet_cache.get(kind, filters)
+    return render_template(
+        "pages/browse.html",
+        kind=kind,
+        results=browse(kind, filters),
+        total=counts["total"],
+        facets=facet_links(lambda **args: url_for(endpoint, **args), filters, counts),
+        clear_url=url_for(endpoint),
+        filtered=any(filters),
+    )
+
+
 #  ----------------------------------------------------------------
 #  Venues
 #  ----------------------------------------------------------------
 
 
 @app.route("/venues")
+@admit(LOW, concurrency=2)
 def venues():
     areas = [
         unique_citystate for unique_citystate in Venue.query.distinct(Venue.city, Venue.state).all()
@@ -90,6 +178,7 @@ def venues():
 
 @csrf.exempt
 @app.route("/venues/search", methods=["POST"])
+@admit(LOW, concurrency=2)
 def search_venues():
     # seach for Hop should return "The Musical Hop".
     # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
@@ -122,12 +211,73 @@ def search_venues():
     )
 
 
+@app.route("/venues/browse")
+@admit(LOW, concurrency=2)
+def browse_venues():
+    return render_browse("venues", "browse_venues")
+
+
+@app.route("/venues/availability")
+def venue_availability():
+    # venues in a city with nothing booked between start and end, e.g.
+    # /venues/availability?city=San Francisco&state=CA&start=2035-04-01T19:00&end=2035-04-01T23:00
+    city = request.args.get("city")
+    state = request.args.get("state")
+    if not city or not state:
+        abort(400)
+    start, end = parse_window(request.args)
+    venues = Venue.free_between(city, state, start, end)
+    return jsonify(
+        {
+            "city": city,
+            "state": state,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "venues": [{"id": venue.id, "name": venue.name} for venue in venues],
+        }
+    )
+
+
+@app.route("/venues/nearby")
+def nearby_venues():
+    # venues within ?miles= (default 10) of a point or a city, e.g.
+    # /venues/nearby?city=San Francisco&state=CA&miles=25, or inside a box,
+    # /venues/nearby?bbox=37.6,-122.6,37.9,-122.3
+    if "bbox" in request.args:
+        bbox = parse_bbox(request.args["bbox"])
+        found = [(venue_id, None) for venue_id in nearby.in_box(*bbox)]
+        query = {"bbox": list(bbox)}
+    else:
+        lat, lng = parse_location(request.args)
+        miles = request.args.get("miles", DEFAULT_MILES, type=float)
+        if not 0 < miles <= 12500:
+            abort(400)
+        found = nearby.within(lat, lng, miles)
+        query = {"lat": lat, "lng": lng, "miles": miles}
+
+    venues = Venue.query.options(db.lazyload(Venue.shows)).filter(Venue.id.in_([venue_id for venue_id, _ in found]))
+    by_id = {venue.id: venue for venue in venues}
+    query["venues"] = [
+        {
+            "id": venue_id,
+            "name": by_id[venue_id].name,
+            "city": by_id[venue_id].city,
+            "state": by_id[venue_id].state,
+            "miles": None if distance is None else round(distance, 1),
+        }
+        for venue_id, distance in found
+        if venue_id in by_id
+    ]
+    return jsonify(query)
+
+
 @app.route("/venues/<int:venue_id>")
+@admit(HIGH)
 def show_venue(venue_id):
     # shows the venue page with the given venue_id
     venue = Venue.query.filter_by(id=venue_id).first_or_404()
     data = {key: value for key, value in venue.__dict__.items()}
-    shows = venue.shows
+    upcoming_shows, past_shows = Show.upcoming_and_past(Show.query.filter(Show.venue_id == venue.id))
     data["upcoming_shows"] = [
         {
             "start_time": show.start_time,
@@ -135,8 +285,7 @@ def show_venue(venue_id):
             "artist_id": show.artist.id,
             "artist_name": show.artist.name,
         }
-        for show in shows
-        if show.start_time > datetime.datetime.now()
+        for show in upcoming_shows
     ]
     data["upcoming_shows_count"] = len(data["upcoming_shows"])
     data["past_shows"] = [
@@ -146,10 +295,10 @@ def show_venue(venue_id):
             "artist_id": show.artist.id,
             "artist_name": show.artist.name,
         }
-        for show in shows
-        if show.start_time < datetime.datetime.now()
+        for show in past_shows
     ]
     data["past_shows_count"] = len(data["past_shows"])
+    data["matches"] = match_index.for_venue(venue.id) if venue.seeking_talent else []
     return render_template("pages/show_venue.html", venue=data)
 
 
@@ -160,6 +309,7 @@ def create_venue_form():
 
 
 @app.route("/venues/create", methods=["POST"])
+@admit(HIGH)
 def create_venue_submission():
     venueForm = VenueForm(request.form)
     newVenueId = None
@@ -209,6 +359,7 @@ def create_venue_submission():
 
 
 @app.route("/venues/<venue_id>", methods=["DELETE"])
+@admit(HIGH)
 def delete_venue(venue_id):
     try:
         venue = Venue.query.filter_by(id=venue_id).first_or_404()
@@ -225,6 +376,7 @@ def delete_venue(venue_id):
 
 
 @app.route("/venues/<int:venue_id>/edit", methods=["GET"])
+@use_primary
 def edit_venue(venue_id):
     venue = Venue.query.filter_by(id=venue_id).first_or_404()
     form = VenueForm(obj=venue)
@@ -232,6 +384,7 @@ def edit_venue(venue_id):
 
 
 @app.route("/venues/<int:venue_id>/edit", methods=["POST"])
+@admit(HIGH)
 def edit_venue_submission(venue_id):
     venue = Venue.query.filter_by(id=venue_id).first_or_404()
     venueForm = VenueForm(request.form)
@@ -270,12 +423,20 @@ def edit_venue_submission(venue_id):
 
 
 @app.route("/artists")
+@admit(LOW, concurrency=2)
 def artists():
     data = Artist.query.order_by("id").all()
     return render_template("pages/artists.html", artists=data)
 
 
+@app.route("/artists/browse")
+@admit(LOW, concurrency=2)
+def browse_artists():
+    return render_browse("artists", "browse_artists")
+
+
 @app.route("/artists/<int:artist_id>", methods=["DELETE"])
+@admit(HIGH)
 def delete_artist(artist_id):
     try:
         artist = Artist.query.filter_by(id=artist_id).first_or_404()
@@ -294,6 +455,7 @@ def delete_artist(artist_id):
 
 @csrf.exempt
 @app.route("/artists/search", methods=["POST"])
+@admit(LOW, concurrency=2)
 def search_artists():
     # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
     # search for "band" should return "The Wild Sax Band".
@@ -327,10 +489,11 @@ def search_artists():
 
 
 @app.route("/artists/<int:artist_id>", methods=["GET"])
+@admit(HIGH)
 def show_artist(artist_id):
     artist = Artist.query.filter_by(id=artist_id).first_or_404()
     data = {key: value for key, value in artist.__dict__.items()}
-    shows = artist.shows
+    upcoming_shows, past_shows = Show.upcoming_and_past(Show.query.filter(Show.artist_id == artist.id))
     data["upcoming_shows"] = [
         {
             "start_time": show.start_time,
@@ -338,8 +501,7 @@ def show_artist(artist_id):
             "venue_id": show.venue.id,
             "venue_name": show.venue.name,
         }
-        for show in shows
-        if show.start_time > datetime.datetime.now()
+        for show in upcoming_shows
     ]
     data["upcoming_shows_count"] = len(data["upcoming_shows"])
     data["past_shows"] = [
@@ -349,14 +511,32 @@ def show_artist(artist_id):
             "venue_id": show.venue.id,
             "venue_name": show.venue.name,
         }
-        for show in shows
-        if show.start_time < datetime.datetime.now()
+        for show in past_shows
     ]
     data["past_shows_count"] = len(data["past_shows"])
+    data["matches"] = match_index.for_artist(artist.id) if artist.seeking_venue else []
     return render_template("pages/show_artist.html", artist=data)
 
 
+@app.route("/artists/<int:artist_id>/availability")
+def artist_availability(artist_id):
+    # the periods between start and end when the artist has no show
+    artist = Artist.query.get_or_404(artist_id)
+    start, end = parse_window(request.args)
+    return jsonify(
+        {
+            "artist_id": artist.id,
+            "artist_name": artist.name,
+            "free": [
+                {"start": free_start.isoformat(), "end": free_end.isoformat()}
+                for free_start, free_end in artist.free_periods(start, end)
+            ],
+        }
+    )
+
+
 @app.route("/artists/<int:artist_id>/edit", methods=["GET"])
+@use_primary
 def edit_artist(artist_id):
     artist = Artist.query.filter_by(id=artist_id).first_or_404()
     form = ArtistForm(obj=artist)
@@ -364,6 +544,7 @@ def edit_artist(artist_id):
 
 
 @app.route("/artists/<int:artist_id>/edit", methods=["POST"])
+@admit(HIGH)
 def edit_artist_submission(artist_id):
     artist = Artist.query.filter_by(id=artist_id).first_or_404()
     artistForm = ArtistForm(request.form)
@@ -402,6 +583,7 @@ def create_artist_form():
 
 
 @app.route("/artists/create", methods=["POST"])
+@admit(HIGH)
 def create_artist_submission():
     artistForm = ArtistForm(request.form)
     newArtistId = None
@@ -454,6 +636,7 @@ def create_artist_submission():
 
 
 @app.route("/shows")
+@admit(LOW, concurrency=2)
 def shows():
     # displays list of shows at /shows
     shows = Show.query.order_by("id").all()
@@ -479,6 +662,7 @@ def create_shows():
 
 
 @app.route("/shows/create", methods=["POST"])
+@admit(HIGH)
 def create_show_submission():
     # called to create new shows in the db, upon submitting new show listing form
     showForm = ShowForm(request.form)
@@ -488,13 +672,17 @@ def create_show_submission():
             newShow.artist_id = showForm.artist_id.data
             newShow.venue_id = showForm.venue_id.data
             newShow.start_time = showForm.start_time.data
+            newShow.duration_minutes = showForm.duration_minutes.data or DEFAULT_SHOW_MINUTES
             db.session.add(newShow)
             db.session.commit()
 
             flash("Show was successfully listed.")
         except IntegrityError as ie:
             db.session.rollback()
-            error_message = f"Unexpected error occurred: {str(ie.orig)}"
+            error_message = BOOKING_CONFLICTS.get(
+                getattr(getattr(ie.orig, "diag", None), "constraint_name", None),
+                f"Unexpected error occurred: {str(ie.orig)}",
+            )
             flash(
                 f"Error: {error_message}",
                 "error",
@@ -517,6 +705,7 @@ def create_show_submission():
 
 @csrf.exempt
 @app.route("/shows/search", methods=["POST"])
+@admit(LOW, concurrency=2)
 def search_shows():
     # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
     # search for "band" should return "The Wild Sax Band".
@@ -526,11 +715,10 @@ def search_shows():
     # We'll convert to the internal percent sign - this will allow
     # Users to search for multiple substrings at once . . .
     search_for = search_term.replace("*", "%")
-    shows = (
+    upcoming_shows, past_shows = Show.upcoming_and_past(
         Show.query.join(Artist, Show.artist_id == Artist.id)
         .join(Venue, Show.venue_id == Venue.id)
         .filter(Venue.name.ilike(f"%{search_for}%") | Artist.name.ilike(f"%{search_for}%"))
-        .all()
     )
 
     data = {}
@@ -544,8 +732,7 @@ def search_shows():
             "artist_name": show.artist.name,
             "artist_image_link": show.artist.image_link,
         }
-        for show in shows
-        if show.start_time > datetime.datetime.now()
+        for show in upcoming_shows
     ]
     data["upcoming_shows_count"] = len(data["upcoming_shows"])
     data["past_shows"] = [
@@ -558,8 +745,7 @@ def search_shows():
             "artist_name": show.artist.name,
             "artist_image_link": show.artist.image_link,
         }
-        for show in shows
-        if show.start_time < datetime.datetime.now()
+        for show in past_shows
     ]
     data["past_shows_count"] = len(data["past_shows"])
 
@@ -570,6 +756,28 @@ def search_shows():
     )
 
 
+@app.route("/typeahead")
+def suggest_names():
+    # names starting with ?q=, or with a word that does, e.g.
+    # /typeahead?q=mus&kind=venue; without kind=, venues and artists
+    kinds = [request.args["kind"]] if "kind" in request.args else ["venue", "artist"]
+    limit = request.args.get("limit", DEFAULT_LIMIT, type=int)
+    if not set(kinds) <= {"venue", "artist"} or not 0 < limit <= MAX_LIMIT:
+        abort(400)
+    # a client that keeps typing has its last results narrowed; the id is
+    # only assigned once, so later keystrokes don't re-sign the cookie
+    client = session.get("typeahead")
+    if client is None:
+        client = session["typeahead"] = uuid.uuid4().hex
+    query = request.args.get("q", "")
+    response = {"q": query}
+    for kind in kinds:
+        response[kind + "s"] = [
+            {"id": id, "name": name} for id, name in typeahead.suggest(kind, query, client, limit)
+        ]
+    return jsonify(response)
+
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template("errors/404.html"), 404
@@ -758,13 +966,7 @@ def load_seed_data_if_needed():
 
 
 if not app.debug:
-    file_handler = FileHandler("error.log")
-    file_handler.setFormatter(
-        Formatter("%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]")
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
+    logs = QueuedLogging(app)
     app.logger.info("errors")
 
 # ----------------------------------------------------------------------------#
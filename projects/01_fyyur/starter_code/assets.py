@@ -0,0 +1,298 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+import tempfile
+from collections import namedtuple
+
+import click
+from flask import Response, current_app, request, send_file
+from flask.cli import AppGroup
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it only gzip is offered
+    brotli = None
+
+# ----------------------------------------------------------------------------#
+# Static asset pipeline.
+#
+# At startup every file under static/ is hashed and given a fingerprinted
+# name (css/main.css -> css/main.0a1b2c3d4e5f.css). url_for("static", ...)
+# hands out the fingerprinted URL, which is cached for a year: when a file
+# changes so does its URL. url() references inside CSS are rewritten the
+# same way, so fonts and images loaded from stylesheets are covered too.
+#
+# Compressible assets are served gzip or brotli encoded when the client
+# accepts it. `flask assets build` precompresses everything at the highest
+# levels into instance/assets/; without it gzip variants are made on the
+# first request that needs them.
+# ----------------------------------------------------------------------------#
+
+ONE_YEAR = 365 * 24 * 60 * 60
+IMMUTABLE = "public, max-age={}, immutable".format(ONE_YEAR)
+
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".map", ".svg", ".eot", ".ttf", ".otf", ".json", ".txt", ".html"}
+# dynamic responses smaller than this go out uncompressed
+MIN_COMPRESS_SIZE = 1024
+COMPRESSIBLE_TYPES = {
+    "text/html",
+    "text/plain",
+    "text/css",
+    "application/json",
+    "application/javascript",
+    "text/javascript",
+}
+
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+?)\1\s*\)""")
+
+Asset = namedtuple("Asset", ["name", "url", "path", "body", "digest", "size", "mimetype", "compressible"])
+
+
+def fingerprint(name, digest):
+    base, extension = posixpath.splitext(name)
+    return "{}.{}{}".format(base, digest, extension)
+
+
+def gzip_compress(data):
+    return gzip.compress(data, compresslevel=9)
+
+
+def brotli_compress(data):
+    return brotli.compress(data, quality=11)
+
+
+def write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(descriptor, "wb") as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+class Assets:
+    def __init__(self, app=None):
+        self.assets = {}
+        self.by_url = {}
+        self.variants = {}
+        self.mtimes = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        self.output_folder = os.path.join(app.instance_path, "assets")
+        self.scan()
+
+        app.url_defaults(self.fingerprint_url)
+        app.view_functions["static"] = self.send_static
+        app.after_request(compress_response)
+        if app.debug:
+            app.before_request(self.rescan_if_changed)
+        app.cli.add_command(assets_cli)
+        app.extensions["assets"] = self
+
+    # ------------------------------------------------------------------------#
+    # Manifest.
+    # ------------------------------------------------------------------------#
+
+    def static_files(self):
+        for root, directories, files in os.walk(self.static_folder):
+            directories[:] = sorted(d for d in directories if not d.startswith("."))
+            for filename in sorted(files):
+                if not filename.startswith("."):
+                    path = os.path.join(root, filename)
+                    yield os.path.relpath(path, self.static_folder).replace(os.sep, "/"), path
+
+    def scan(self):
+        files = list(self.static_files())
+        assets = {}
+        # stylesheets go last: their hash covers the fingerprinted urls they
+        # reference, so those must be known first
+        for name, path in sorted(files, key=lambda item: item[0].endswith(".css")):
+            with open(path, "rb") as f:
+                body = f.read()
+            if name.endswith(".css"):
+                rewritten = self.rewrite_css(name, body.decode("utf-8"), assets).encode("utf-8")
+                body = rewritten if rewritten != body else None
+                data = rewritten
+            else:
+                data, body = body, None
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            assets[name] = Asset(
+                name=name,
+                url=fingerprint(name, digest),
+                path=path,
+                body=body,
+                digest=digest,
+                size=len(data),
+                mimetype=mimetypes.guess_type(name)[0] or "application/octet-stream",
+                compressible=posixpath.splitext(name)[1] in COMPRESSIBLE_EXTENSIONS,
+            )
+
+        variants = {}
+        for asset in assets.values():
+            for encoding in ENCODINGS:
+                path = self.variant_path(asset, encoding)
+                if os.path.exists(path):
+                    # a variant that saves nothing is remembered but not served
+                    variants[asset.url, encoding] = path if os.path.getsize(path) < asset.size else None
+
+        # swap in the new manifest in one go
+        self.assets, self.by_url, self.variants = assets, {a.url: a for a in assets.values()}, variants
+        self.mtimes = {path: os.path.getmtime(path) for _, path in files}
+
+    def rescan_if_changed(self):
+        current = {path: os.path.getmtime(path) for _, path in self.static_files()}
+        if current != self.mtimes:
+            self.scan()
+
+    @staticmethod
+    def rewrite_css(name, css, assets):
+        directory = posixpath.dirname(name)
+
+        def replace(match):
+            quote, reference = match.groups()
+            if reference.startswith(("data:", "http:", "https:", "//", "/", "#")):
+                return match.group(0)
+            # keep query strings and fragments such as ?#iefix
+            path = re.split(r"[?#]", reference, 1)[0]
+            suffix = reference[len(path) :]
+            asset = assets.get(posixpath.normpath(posixpath.join(directory, path)))
+            if asset is None:
+                return match.group(0)
+            return "url({0}{1}{2}{0})".format(quote, posixpath.relpath(asset.url, directory or "."), suffix)
+
+        return CSS_URL.sub(replace, css)
+
+    def fingerprint_url(self, endpoint, values):
+        if endpoint == "static" and "filename" in values:
+            asset = self.assets.get(values["filename"])
+            if asset is not None:
+                values["filename"] = asset.url
+
+    # ------------------------------------------------------------------------#
+    # Compressed variants.
+    # ------------------------------------------------------------------------#
+
+    def variant_path(self, asset, encoding):
+        return os.path.join(self.output_folder, *(asset.url + ENCODINGS[encoding]).split("/"))
+
+    def read(self, asset):
+        if asset.body is not None:
+            return asset.body
+        with open(asset.path, "rb") as f:
+            return f.read()
+
+    def build_variant(self, asset, encoding, compress):
+        data = compress(self.read(asset))
+        path = self.variant_path(asset, encoding)
+        write_atomic(path, data)
+        self.variants[asset.url, encoding] = path if len(data) < asset.size else None
+        return len(data)
+
+    def choose_encoding(self, asset):
+        if not asset.compressible:
+            return None
+        accepted = request.accept_encodings
+        if accepted.quality("br") and self.variants.get((asset.url, "br")):
+            return "br"
+        if accepted.quality("gzip"):
+            if (asset.url, "gzip") not in self.variants:
+                self.build_variant(asset, "gzip", gzip_compress)
+            if self.variants[asset.url, "gzip"]:
+                return "gzip"
+        return None
+
+    # ------------------------------------------------------------------------#
+    # Serving.
+    # ------------------------------------------------------------------------#
+
+    def send_static(self, filename):
+        asset = self.by_url.get(filename)
+        if asset is None:
+            # plain /static/... urls keep working, with Flask's usual caching
+            return current_app.send_static_file(filename)
+
+        encoding = self.choose_encoding(asset)
+        if encoding is not None:
+            response = send_file(
+                self.variants[asset.url, encoding],
+                mimetype=asset.mimetype,
+                add_etags=False,
+                conditional=False,
+                cache_timeout=ONE_YEAR,
+            )
+            response.headers["Content-Encoding"] = encoding
+        elif asset.body is not None:
+            response = Response(asset.body, mimetype=asset.mimetype)
+        else:
+            response = send_file(
+                asset.path, mimetype=asset.mimetype, add_etags=False, conditional=False, cache_timeout=ONE_YEAR
+            )
+
+        response.set_etag(asset.digest + ("-" + encoding if encoding else ""))
+        response.headers["Cache-Control"] = IMMUTABLE
+        if asset.compressible:
+            response.vary.add("Accept-Encoding")
+        return response.make_conditional(request)
+
+
+def compress_response(response):
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code in (204, 304)
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_TYPES
+    ):
+        return response
+
+    data = response.get_data()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return response
+
+    response.vary.add("Accept-Encoding")
+    accepted = request.accept_encodings
+    # fast settings: this runs on every page view
+    if brotli is not None and accepted.quality("br"):
+        response.set_data(brotli.compress(data, quality=4))
+        response.headers["Content-Encoding"] = "br"
+    elif accepted.quality("gzip"):
+        response.set_data(gzip.compress(data, compresslevel=6))
+        response.headers["Content-Encoding"] = "gzip"
+    return response
+
+
+# ----------------------------------------------------------------------------#
+# Commands.
+# ----------------------------------------------------------------------------#
+
+assets_cli = AppGroup("assets", help="Static asset pipeline.")
+
+
+@assets_cli.command("build")
+def build_command():
+    """Precompress static assets with gzip and brotli."""
+    assets = current_app.extensions["assets"]
+    assets.scan()
+    compressors = [("gzip", gzip_compress)]
+    if brotli is not None:
+        compressors.append(("br", brotli_compress))
+    else:
+        click.echo("brotli is not installed, building gzip variants only")
+
+    totals = {"identity": 0}
+    for asset in assets.assets.values():
+        if not asset.compressible:
+            continue
+        totals["identity"] += asset.size
+        for encoding, compress in compressors:
+            totals[encoding] = totals.get(encoding, 0) + assets.build_variant(asset, encoding, compress)
+
+    for encoding, size in totals.items():
+        click.echo("{:>10} {:>10,} bytes".format(encoding, size))
@@ -0,0 +1,166 @@
+"""
+Load test for admission control: goodput (answers within --deadline) at
+rising request rates, with and without admission.py in front of the views.
+
+The server is a small Flask app on werkzeug's threaded server (a thread per
+request, nothing in the way) whose "database" has --connections
+connections and takes --query-ms per query. Detail pages (HIGH) make one
+query, /shows (LOW) makes four; --low-share of the requests go to /shows.
+Requests are sent open loop: on schedule, whether or not earlier ones have
+been answered, and timed from when they were due. Each rate gets a fresh
+server, so a backlog left by one doesn't spill into the next.
+
+    python -m benchmarks.bench_admission                (from starter_code)
+    python -m benchmarks.bench_admission --rates 50,100,200 --seconds 10
+"""
+import argparse
+import http.client
+import logging
+import multiprocessing
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask
+from werkzeug.serving import make_server
+
+from admission import AdmissionControl, admit, HIGH, LOW
+
+
+def build_app(connections, query_seconds, admission):
+    app = Flask("bench_admission")
+    database = threading.BoundedSemaphore(connections)
+
+    def query():
+        with database:
+            time.sleep(query_seconds)
+
+    @app.route("/venues/<int:venue_id>")
+    @admit(HIGH)
+    def show_venue(venue_id):
+        query()
+        return "venue {}".format(venue_id)
+
+    @app.route("/shows")
+    @admit(LOW, concurrency=2)
+    def shows():
+        for _ in range(4):
+            query()
+        return "shows"
+
+    if admission:
+        # every client is 127.0.0.1: leave the per-IP rate limit out
+        app.config.update(ADMISSION_CAPACITY=connections, ADMISSION_RATE=0)
+        AdmissionControl(app)
+    return app
+
+
+def serve(port, connections, query_seconds, admission):
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    make_server("127.0.0.1", port, build_app(connections, query_seconds, admission), threaded=True).serve_forever()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(port, deadline=30):
+    started = time.monotonic()
+    while time.monotonic() - started < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server on port {} did not start".format(port))
+
+
+def fetch(port, path, due, deadline):
+    # (kind of path, outcome, seconds since the request was due)
+    kind = "shows" if path == "/shows" else "detail"
+    try:
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=max(0.01, due + deadline - time.monotonic()))
+        connection.request("GET", path)
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+        outcome = {200: "ok", 503: "shed"}.get(response.status, "error")
+    except OSError:
+        outcome = "timeout"
+    elapsed = time.monotonic() - due
+    if outcome == "ok" and elapsed > deadline:
+        outcome = "timeout"
+    return kind, outcome, elapsed
+
+
+def load(port, rate, seconds, low_share, deadline):
+    shuffle = random.Random(0)
+    with ThreadPoolExecutor(max_workers=int(rate * deadline * 2) + 8) as pool:
+        started = time.monotonic()
+        futures = []
+        for number in range(int(rate * seconds)):
+            due = started + number / rate
+            time.sleep(max(0, due - time.monotonic()))
+            path = "/shows" if shuffle.random() < low_share else "/venues/{}".format(number % 100)
+            futures.append(pool.submit(fetch, port, path, due, deadline))
+        return [future.result() for future in futures]
+
+
+def report(label, rate, seconds, results):
+    counts = {}
+    for kind, outcome, _ in results:
+        counts[kind, outcome] = counts.get((kind, outcome), 0) + 1
+    ok = [elapsed for _, outcome, elapsed in results if outcome == "ok"]
+    p50 = sorted(ok)[len(ok) // 2] * 1000 if ok else float("nan")
+    print(
+        "{:<10} {:>5} req/s offered  goodput {:>6.1f}/s (detail {:>5.1f}, shows {:>5.1f})  "
+        "shed {:>5}  timed out {:>5}  ok p50 {:>6.0f} ms".format(
+            label,
+            rate,
+            len(ok) / seconds,
+            counts.get(("detail", "ok"), 0) / seconds,
+            counts.get(("shows", "ok"), 0) / seconds,
+            sum(n for (_, outcome), n in counts.items() if outcome == "shed"),
+            sum(n for (_, outcome), n in counts.items() if outcome in ("timeout", "error")),
+            p50,
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rates", default="30,60,90,120,180", help="requests per second to offer, comma separated")
+    parser.add_argument("--seconds", type=float, default=8)
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--query-ms", type=float, default=40)
+    parser.add_argument("--low-share", type=float, default=0.2)
+    parser.add_argument("--deadline", type=float, default=1.0, help="seconds a client waits for an answer")
+    args = parser.parse_args()
+
+    queries_per_request = 1 + 3 * args.low_share
+    print(
+        "database saturates at about {:.0f} req/s".format(
+            args.connections / (args.query_ms / 1000) / queries_per_request
+        )
+    )
+    for rate in [float(rate) for rate in args.rates.split(",")]:
+        for label, admission in (("unguarded", False), ("admission", True)):
+            port = free_port()
+            server = multiprocessing.Process(
+                target=serve, args=(port, args.connections, args.query_ms / 1000, admission), daemon=True
+            )
+            server.start()
+            try:
+                wait_until_up(port)
+                report(label, rate, args.seconds, load(port, rate, args.seconds, args.low_share, args.deadline))
+            finally:
+                server.terminate()
+                server.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Compares request latency under heavy logging with the old setup (a
+FileHandler written to by the request thread) and the queued one in
+logs.py (the request thread only enqueues; a background thread writes).
+
+--threads threads each run requests that log --lines records, then wait
+--work-ms as if on the database, for --seconds; only the logging is timed.
+Every --stall-every'th write to the file sleeps --stall-ms, as a busy disk
+or a full page cache flush would; set it to 0 for no stalls.
+
+The queue takes the disk off the request thread, not the CPU: formatting
+still happens under the GIL. With enough lines per request and little
+--work-ms the writer falls LOG_QUEUE_SIZE behind and the queued run slows
+down to its pace (see "drained in").
+
+    python -m benchmarks.bench_logging                  (from starter_code)
+    python -m benchmarks.bench_logging --lines 20 --stall-every 0
+"""
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+from logging import FileHandler, Formatter
+
+from flask import Flask
+from flask.logging import default_handler
+
+from logs import QueuedLogging, assign_request_id
+
+
+def stalling(emit, every, seconds):
+    writes = [0]
+
+    def wrapper(record):
+        writes[0] += 1
+        if every and writes[0] % every == 0:
+            time.sleep(seconds)
+        emit(record)
+
+    return wrapper
+
+
+def file_handler_app(path, stall_every, stall_seconds):
+    app = Flask("bench_file_handler")
+    handler = FileHandler(path)
+    handler.setFormatter(Formatter("%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]"))
+    handler.emit = stalling(handler.emit, stall_every, stall_seconds)
+    app.logger.setLevel(logging.INFO)
+    app.logger.removeHandler(default_handler)
+    app.logger.addHandler(handler)
+    return app, handler.close
+
+
+def queued_app(path, stall_every, stall_seconds):
+    app = Flask("bench_queued")
+    app.config["LOG_FILE"] = path
+    logs = QueuedLogging(app)
+    logs.file_handler.emit = stalling(logs.file_handler.emit, stall_every, stall_seconds)
+    return app, logs.stop
+
+
+def run(app, threads, lines, work_seconds, seconds):
+    latencies = []
+    lock = threading.Lock()
+    stop_at = time.monotonic() + seconds
+
+    def worker():
+        mine = []
+        while time.monotonic() < stop_at:
+            with app.test_request_context("/venues"):
+                assign_request_id()
+                started = time.perf_counter()
+                for line in range(lines):
+                    app.logger.info("looked up venue %s", line)
+                mine.append(time.perf_counter() - started)
+            time.sleep(work_seconds)
+        with lock:
+            latencies.extend(mine)
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return latencies
+
+
+def report(name, latencies, seconds, drained):
+    ordered = sorted(latencies)
+    print(
+        "{:<13} {:>7.0f} req/s  logging p50 {:>8.3f} ms  p99 {:>8.3f} ms  max {:>8.3f} ms  drained in {:.2f} s".format(
+            name,
+            len(ordered) / seconds,
+            statistics.median(ordered) * 1000,
+            ordered[int(len(ordered) * 0.99)] * 1000,
+            ordered[-1] * 1000,
+            drained,
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--lines", type=int, default=5, help="records logged per request")
+    parser.add_argument("--work-ms", type=float, default=5, help="time each request waits on the database")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--stall-every", type=int, default=2000)
+    parser.add_argument("--stall-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, build in (("FileHandler", file_handler_app), ("queued", queued_app)):
+            path = os.path.join(directory, name + ".log")
+            app, close = build(path, args.stall_every, args.stall_ms / 1000)
+            latencies = run(app, args.threads, args.lines, args.work_ms / 1000, args.seconds)
+            # the queued writer may still be behind; stopping waits for it
+            started = time.monotonic()
+            close()
+            report(name, latencies, args.seconds, time.monotonic() - started)
+
+
+if __name__ == "__main__":
+    main()
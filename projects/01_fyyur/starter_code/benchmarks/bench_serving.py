@@ -0,0 +1,140 @@
+"""
+Compares throughput of the Flask development server (what `python app.py`
+runs) and gunicorn with gunicorn.conf.py, for the same app and page.
+
+Each server is started in turn, warmed up, then hit by --clients client
+threads (spread over one process per core) that each keep one HTTP
+connection open and request --path for --seconds.
+
+    python -m benchmarks.bench_serving                  (from starter_code)
+    python -m benchmarks.bench_serving --path /venues --clients 32
+
+--app accepts any module:variable, so the same script can be run from
+another project's directory, e.g. the capstone with --app app:APP.
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+
+DEV_SERVER = """
+import importlib, sys
+module, name = sys.argv[1].split(":")
+app = getattr(importlib.import_module(module), name)
+# no reloader or debugger, so only the server itself is measured
+app.run(host="127.0.0.1", port=int(sys.argv[2]), debug=False)
+"""
+
+
+def wait_until_up(port, path, deadline=30):
+    started = time.monotonic()
+    while time.monotonic() - started < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            connection.request("GET", path)
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("server on port {} did not start".format(port))
+
+
+def get(connection, path):
+    connection.request("GET", path)
+    response = connection.getresponse()
+    response.read()
+    return response.status
+
+
+def client_threads(port, path, threads, stop_at, results):
+    counts = [0, 0]
+
+    def client():
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        while time.monotonic() < stop_at:
+            try:
+                status = get(connection, path)
+            except (OSError, http.client.HTTPException):
+                # the server may close a kept-alive connection (a worker
+                # being recycled); retry once on a new one, as browsers do
+                connection.close()
+                try:
+                    status = get(connection, path)
+                except (OSError, http.client.HTTPException):
+                    connection.close()
+                    status = None
+            counts[0 if status is not None and status < 400 else 1] += 1
+        connection.close()
+
+    workers = [threading.Thread(target=client) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    results.put(counts)
+
+
+def hammer(port, path, clients, seconds):
+    # the clients are spread over processes so the load generator itself
+    # isn't held to one core by the GIL
+    processes = max(1, min(clients, multiprocessing.cpu_count()))
+    results = multiprocessing.Queue()
+    stop_at = time.monotonic() + seconds
+    started = time.monotonic()
+    workers = [
+        multiprocessing.Process(
+            target=client_threads,
+            args=(port, path, clients // processes + (i < clients % processes), stop_at, results),
+        )
+        for i in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    totals = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - started
+    return sum(ok for ok, _ in totals) / elapsed, sum(errors for _, errors in totals)
+
+
+def run(name, command, port, args):
+    server = subprocess.Popen(
+        command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=dict(os.environ, PORT=str(port))
+    )
+    try:
+        wait_until_up(port, args.path)
+        hammer(port, args.path, args.clients, 1)
+        rate, errors = hammer(port, args.path, args.clients, args.seconds)
+    finally:
+        server.terminate()
+        server.wait()
+    print("{:>10} {:>10.1f} req/s {:>6} errors".format(name, rate, errors))
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--app", default="app:app")
+    parser.add_argument("--path", default="/")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--port", type=int, default=5099)
+    args = parser.parse_args()
+
+    print("GET {} with {} clients for {}s".format(args.path, args.clients, args.seconds))
+    dev = run("dev server", [sys.executable, "-c", DEV_SERVER, args.app, str(args.port)], args.port, args)
+    production = run(
+        "gunicorn",
+        [sys.executable, "-m", "gunicorn", args.app, "--bind", "127.0.0.1:{}".format(args.port)],
+        args.port,
+        args,
+    )
+    print("{:>10} {:>10.2f}x".format("speedup", production / dev if dev else float("inf")))
+
+
+if __name__ == "__main__":
+    main()
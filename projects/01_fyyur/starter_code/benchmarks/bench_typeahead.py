@@ -0,0 +1,122 @@
+"""
+Checks the typeahead index against its latency target: --names generated
+venue names (1M by default) are loaded into typeahead.NameIndex, then
+--sessions clients each type a name one key at a time, as the search box
+sends it. Every keystroke is timed, once with the client's previous prefix
+narrowing the search and once searching the whole index.
+
+It also times committed renames going into the delta, and keystrokes while
+the background thread merges the delta into the main keys. Exits non-zero
+when the p99 keystroke is slower than --slo-ms.
+
+    python -m benchmarks.bench_typeahead                (from starter_code)
+    python -m benchmarks.bench_typeahead --names 200000 --slo-ms 2
+"""
+import argparse
+import random
+import resource
+import sys
+import time
+
+from typeahead import MERGE_AT, NameIndex, Typeahead
+
+SYLLABLES = [
+    "ba", "ce", "di", "fo", "gu", "ha", "je", "ki", "lo", "mu", "na", "pe", "qui", "ro", "sa", "te", "vi", "wo",
+    "xa", "ze", "bri", "cla", "dro", "fle", "gro", "pla", "stu", "tra",
+]
+KINDS = ["Hall", "Lounge", "Club", "Bar", "Theatre", "Room", "Cafe", "Stage", "Garden", "Arena", "Tavern"]
+LEADS = ["The", "Old", "Little", "Blue", "Red", "Golden", "Silver", "Velvet", "North", "South"]
+
+
+def word(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+
+
+def venue_name(rng):
+    parts = [word(rng)] if rng.random() < 0.5 else [rng.choice(LEADS), word(rng)]
+    if rng.random() < 0.4:
+        parts.append(word(rng))
+    parts.append(rng.choice(KINDS))
+    return " ".join(parts)
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summary(label, timings):
+    ordered = sorted(timings)
+    print(
+        "{:<22} {:>7} calls  p50 {:>7.3f} ms  p99 {:>7.3f} ms  max {:>7.3f} ms".format(
+            label, len(ordered), percentile(ordered, 0.5) * 1000, percentile(ordered, 0.99) * 1000, ordered[-1] * 1000
+        )
+    )
+    return percentile(ordered, 0.99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--names", type=int, default=1000000)
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--slo-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    names = {id: venue_name(rng) for id in range(1, args.names + 1)}
+    index = NameIndex(model=None)
+    typeahead = Typeahead()
+    typeahead.indexes["venue"] = index
+    started = time.perf_counter()
+    index.load(names)
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(
+        "loaded {} names ({} word keys) in {:.1f} s, peak RSS {:.0f} MB".format(
+            len(index.starts.keys), len(index.words.keys), time.perf_counter() - started, peak_mb
+        )
+    )
+
+    typed = [names[rng.randint(1, args.names)] for _ in range(args.sessions)]
+    # later words as well as whole names: "mus" for "Live Music Hall"
+    typed = [name if rng.random() < 0.7 else name.split(" ", 1)[-1] for name in typed]
+    worst = 0
+    for label, narrowing in (("keystroke, narrowed", True), ("keystroke, whole index", False)):
+        timings = []
+        for session, text in enumerate(typed):
+            client = "client-{}".format(session) if narrowing else None
+            for end in range(1, len(text) + 1):
+                began = time.perf_counter()
+                typeahead.suggest("venue", text[:end], client, args.limit)
+                timings.append(time.perf_counter() - began)
+        worst = max(worst, summary(label, timings))
+
+    # committed renames, as after_commit applies them; past MERGE_AT the
+    # delta is merged by a background thread while typing carries on
+    timings = []
+    for change in range(MERGE_AT // 2):
+        id = rng.randint(1, args.names)
+        began = time.perf_counter()
+        index.apply([(id, venue_name(rng))])
+        timings.append(time.perf_counter() - began)
+    summary("write", timings)
+    timings = []
+    while index._changed is not None:
+        for text in typed[:50]:
+            for end in range(1, len(text) + 1):
+                began = time.perf_counter()
+                typeahead.suggest("venue", text[:end], None, args.limit)
+                timings.append(time.perf_counter() - began)
+    if timings:
+        worst = max(worst, summary("keystroke, merging", timings))
+    began = time.perf_counter()
+    index.merge()
+    print("a merge takes {:.2f} s, off the request threads".format(time.perf_counter() - began))
+
+    met = worst * 1000 <= args.slo_ms
+    print("p99 keystroke {:.3f} ms, target {} ms: {}".format(worst * 1000, args.slo_ms, "met" if met else "MISSED"))
+    if not met:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -13,4 +13,42 @@ DEBUG = True
 # TODO IMPLEMENT DATABASE URL
 SQLALCHEMY_DATABASE_URI = "postgres://@localhost:5432/fyyur_db"
 
+# Read replicas for GET requests, e.g.
+# DATABASE_REPLICA_URLS="postgres://@replica-1/fyyur_db,postgres://@replica-2/fyyur_db".
+# A replica further behind than SQLALCHEMY_REPLICA_MAX_LAG seconds isn't used.
+SQLALCHEMY_REPLICA_URIS = [uri for uri in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if uri]
+SQLALCHEMY_REPLICA_MAX_LAG = int(os.environ.get("DATABASE_REPLICA_MAX_LAG", 10))
+
 WTF_CSRF_ENABLED = True
+
+# Processes the periodic matchmaking rebuild scores blocks of artists in.
+MATCHES_WORKERS = int(os.environ.get("MATCHES_WORKERS", 1))
+
+# Nearby venue search. GEOCODER is an import path to a geocoder, or to a
+# class making one; NEARBY_BACKEND is "grid" (in memory) or "postgis".
+GEOCODER = "nearby:CityTableGeocoder"
+NEARBY_BACKEND = os.environ.get("NEARBY_BACKEND", "grid")
+
+# How workers tell each other to drop cached data: "postgres" (LISTEN/NOTIFY)
+# or "memory" (within one process only).
+INVALIDATION_BACKEND = os.environ.get("INVALIDATION_BACKEND", "postgres")
+
+# Logs are written as JSON lines by a background thread. The file rotates
+# at LOG_MAX_BYTES, or on LOG_ROTATE_WHEN ("midnight", "H", ...) if set.
+LOG_FILE = os.environ.get("LOG_FILE", os.path.join(basedir, "error.log"))
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_ROTATE_WHEN = os.environ.get("LOG_ROTATE_WHEN")
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", 5))
+
+# Admission control: requests running at once per worker, how many may wait
+# (per priority) and for how long, and each client IP's request rate and
+# burst. ADMISSION_RATE = 0 turns the rate limit off.
+ADMISSION_CAPACITY = int(os.environ.get("ADMISSION_CAPACITY", 4))
+ADMISSION_QUEUE_SIZE = int(os.environ.get("ADMISSION_QUEUE_SIZE", 8))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 0.5))
+ADMISSION_RATE = float(os.environ.get("ADMISSION_RATE", 20))
+ADMISSION_BURST = int(os.environ.get("ADMISSION_BURST", 40))
+# Proxies in front of gunicorn that append to X-Forwarded-For, e.g. 1 on
+# Heroku. Rate limits key on the address the last of them saw; with 0 they
+# key on the connecting address, since the header could be made up.
+PROXY_COUNT = int(os.environ.get("PROXY_COUNT", 0))
@@ -0,0 +1,276 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from itertools import chain
+
+from flask import current_app, has_app_context
+from sqlalchemy import String, cast, event, func, select, true, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY, array
+from sqlalchemy.orm import Session
+
+from forms import VALID_GENRES
+from invalidation import bus
+from models import db, Artist, Venue
+from replicas import LAG_CHECK_SECONDS, primary_reads
+
+# ----------------------------------------------------------------------------#
+# Faceted browsing.
+#
+# Venues and artists can be filtered by genre, state, city and their
+# seeking flag. Genre filters use the GIN indexes on the genres arrays
+# (genres @> ARRAY[...]). The counts next to each facet value come from a
+# single GROUPING SETS query over the filtered rows and are cached until a
+# venue or artist is committed, by this worker or, through the invalidation
+# bus, another one. Entries also expire after CACHE_SECONDS in case a
+# notification was missed. Until any replica in use must have replayed the
+# change, counts are recomputed on the primary, so old counts aren't cached.
+# ----------------------------------------------------------------------------#
+
+CACHE_SECONDS = 60
+CACHE_ENTRIES = 256
+TOP_CITIES = 20
+
+Facet = namedtuple("Facet", ["model", "seeking"])
+FACETS = {
+    "venues": Facet(Venue, Venue.seeking_talent),
+    "artists": Facet(Artist, Artist.seeking_venue),
+}
+KIND_BY_MODEL = {facet.model: kind for kind, facet in FACETS.items()}
+
+Filters = namedtuple("Filters", ["genres", "state", "city", "seeking"])
+
+SEEKING_VALUES = {"1": True, "true": True, "yes": True, "0": False, "false": False, "no": False}
+
+# grouping(genre, state, city, seeking) for each grouping set: a 1 bit
+# marks a column that is aggregated away in that set
+GROUPED_BY_GENRE = 0b0111
+GROUPED_BY_STATE = 0b1011
+GROUPED_BY_CITY = 0b1001
+GROUPED_BY_SEEKING = 0b1110
+GROUPED_BY_NOTHING = 0b1111
+
+
+def parse_filters(args):
+    # unknown genres are dropped; several genres must all match
+    genres = tuple(genre for genre in VALID_GENRES if genre in args.getlist("genre"))
+    return Filters(
+        genres=genres,
+        state=args.get("state") or None,
+        city=args.get("city") or None,
+        seeking=SEEKING_VALUES.get(args.get("seeking", "").lower()),
+    )
+
+
+def filter_args(filters):
+    # the inverse of parse_filters, for building links
+    args = {}
+    if filters.genres:
+        args["genre"] = list(filters.genres)
+    if filters.state:
+        args["state"] = filters.state
+    if filters.city:
+        args["city"] = filters.city
+    if filters.seeking is not None:
+        args["seeking"] = "1" if filters.seeking else "0"
+    return args
+
+
+def apply_filters(query, kind, filters):
+    model, seeking = FACETS[kind]
+    if filters.genres:
+        query = query.filter(model.genres.op("@>")(cast(array(filters.genres), ARRAY(String(120)))))
+    if filters.state:
+        query = query.filter(model.state == filters.state)
+    if filters.city:
+        query = query.filter(model.city == filters.city)
+    if filters.seeking is not None:
+        query = query.filter(seeking.is_(filters.seeking))
+    return query
+
+
+def browse(kind, filters):
+    model = FACETS[kind].model
+    query = apply_filters(model.query, kind, filters)
+    if model is Venue:
+        # the joined shows aren't needed for a listing
+        query = query.options(db.lazyload(Venue.shows))
+    return query.order_by(model.name).all()
+
+
+def count_facets(kind, filters):
+    model, seeking = FACETS[kind]
+    filtered = apply_filters(
+        db.session.query(
+            model.id.label("id"),
+            model.state.label("state"),
+            model.city.label("city"),
+            seeking.label("seeking"),
+            model.genres.label("genres"),
+        ),
+        kind,
+        filters,
+    ).subquery("filtered")
+    genres = select([func.unnest(filtered.c.genres).label("genre")]).correlate(filtered).lateral("genres")
+    query = (
+        select(
+            [
+                func.grouping(genres.c.genre, filtered.c.state, filtered.c.city, filtered.c.seeking).label("facet"),
+                genres.c.genre,
+                filtered.c.state,
+                filtered.c.city,
+                filtered.c.seeking,
+                func.count(filtered.c.id.distinct()).label("total"),
+            ]
+        )
+        .select_from(filtered.outerjoin(genres, true()))
+        .group_by(
+            func.grouping_sets(
+                genres.c.genre,
+                filtered.c.state,
+                tuple_(filtered.c.state, filtered.c.city),
+                filtered.c.seeking,
+                tuple_(),
+            )
+        )
+    )
+
+    counts = {"genre": {}, "state": {}, "city": {}, "seeking": {}, "total": 0}
+    for row in db.session.execute(query):
+        if row.facet == GROUPED_BY_GENRE and row.genre is not None:
+            counts["genre"][row.genre] = row.total
+        elif row.facet == GROUPED_BY_STATE:
+            counts["state"][row.state] = row.total
+        elif row.facet == GROUPED_BY_CITY:
+            counts["city"][row.state, row.city] = row.total
+        elif row.facet == GROUPED_BY_SEEKING and row.seeking is not None:
+            counts["seeking"][row.seeking] = row.total
+        elif row.facet == GROUPED_BY_NOTHING:
+            counts["total"] = row.total
+    return counts
+
+
+class FacetCache:
+    def __init__(self, max_entries=CACHE_ENTRIES, seconds=CACHE_SECONDS, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.seconds = seconds
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._generations = {kind: 0 for kind in FACETS}
+        self._invalidated_at = {kind: None for kind in FACETS}
+        self._lock = threading.Lock()
+
+    def get(self, kind, filters):
+        key = (kind, filters)
+        now = self.clock()
+        with self._lock:
+            generation = self._generations[kind]
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generation and entry[1] > now:
+                self._entries.move_to_end(key)
+                return entry[2]
+
+        if self._replicas_may_lag(kind, now):
+            with primary_reads():
+                counts = count_facets(kind, filters)
+        else:
+            counts = count_facets(kind, filters)
+        with self._lock:
+            # don't cache counts that a commit may have overtaken meanwhile
+            if self._generations[kind] == generation:
+                self._entries[key] = (generation, now + self.seconds, counts)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return counts
+
+    def invalidate(self, kind):
+        with self._lock:
+            self._generations[kind] += 1
+            self._invalidated_at[kind] = self.clock()
+
+    def _replicas_may_lag(self, kind, now):
+        # replicas further behind than max_lag aren't read from, and lag is
+        # measured every LAG_CHECK_SECONDS
+        invalidated_at = self._invalidated_at[kind]
+        router = current_app.extensions.get("replicas") if has_app_context() else None
+        if invalidated_at is None or router is None or not router.replicas:
+            return False
+        return now - invalidated_at < router.max_lag + LAG_CHECK_SECONDS
+
+
+facet_cache = FacetCache()
+bus.subscribe("venue", lambda ids: facet_cache.invalidate("venues"))
+bus.subscribe("artist", lambda ids: facet_cache.invalidate("artists"))
+
+
+@event.listens_for(Session, "after_flush")
+def note_faceted_changes(session, flush_context):
+    kinds = {
+        KIND_BY_MODEL[type(instance)]
+        for instance in chain(session.new, session.dirty, session.deleted)
+        if type(instance) in KIND_BY_MODEL
+    }
+    if kinds:
+        session.info.setdefault("faceted_changes", set()).update(kinds)
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_facets(session):
+    for kind in session.info.pop("faceted_changes", ()):
+        facet_cache.invalidate(kind)
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_faceted_changes(session):
+    session.info.pop("faceted_changes", None)
+
+
+def facet_links(endpoint_url, filters, counts):
+    # every facet value with its count and the url that toggles it
+    def link(**changes):
+        return endpoint_url(**filter_args(filters._replace(**changes)))
+
+    genres = [
+        {
+            "label": genre,
+            "count": counts["genre"][genre],
+            "selected": genre in filters.genres,
+            "url": link(
+                genres=tuple(g for g in filters.genres if g != genre)
+                if genre in filters.genres
+                else tuple(g for g in VALID_GENRES if g in filters.genres or g == genre)
+            ),
+        }
+        for genre in VALID_GENRES
+        if genre in counts["genre"]
+    ]
+    states = [
+        {
+            "label": state,
+            "count": count,
+            "selected": state == filters.state,
+            "url": link(state=None, city=None) if state == filters.state else link(state=state, city=None),
+        }
+        for state, count in sorted(counts["state"].items())
+    ]
+    top_cities = sorted(counts["city"].items(), key=lambda item: (-item[1], item[0]))[:TOP_CITIES]
+    cities = [
+        {
+            "label": f"{city}, {state}",
+            "count": count,
+            "selected": city == filters.city,
+            "url": link(city=None) if city == filters.city else link(state=state, city=city),
+        }
+        for (state, city), count in top_cities
+    ]
+    seeking = [
+        {
+            "label": "Seeking" if value else "Not seeking",
+            "count": counts["seeking"][value],
+            "selected": filters.seeking is value,
+            "url": link(seeking=None if filters.seeking is value else value),
+        }
+        for value in (True, False)
+        if value in counts["seeking"]
+    ]
+    return {"Genres": genres, "States": states, "Cities": cities, "Seeking": seeking}
@@ -1,8 +1,8 @@
 from datetime import datetime
 from flask_wtf import Form
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField
-from wtforms.validators import DataRequired, AnyOf, URL, Optional, ValidationError, Regexp
-from models import Artist, Venue
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, IntegerField
+from wtforms.validators import DataRequired, AnyOf, URL, Optional, ValidationError, Regexp, NumberRange
+from models import Artist, Venue, DEFAULT_SHOW_MINUTES
 
 # The following Regular Expression should allow for MOST valid phone numbers:
 # Note: Area code cannot start with a 0 or 1
@@ -129,6 +129,11 @@ class ShowForm(Form):
     artist_id = StringField("artist_id", validators=[DataRequired(), artist_id_validator])
     venue_id = StringField("venue_id", validators=[DataRequired(), venue_id_validator])
     start_time = StringField("start_time", validators=[DataRequired()])
+    duration_minutes = IntegerField(
+        "duration_minutes",
+        default=DEFAULT_SHOW_MINUTES,
+        validators=[Optional(), NumberRange(min=1, max=24 * 60)],
+    )
 
 
 class VenueForm(Form):
@@ -0,0 +1,54 @@
+# ----------------------------------------------------------------------------#
+# Production serving with gunicorn.
+#
+#   gunicorn app:app
+#
+# gunicorn reads this file from the working directory. Every setting can be
+# overridden with an environment variable, e.g. WEB_CONCURRENCY=4.
+# ----------------------------------------------------------------------------#
+
+import multiprocessing
+import os
+
+bind = "0.0.0.0:{}".format(os.environ.get("PORT", "5000"))
+
+# One process per core plus one, so a worker blocked on Postgres doesn't
+# leave a core idle; each worker also runs a few threads for requests
+# that are waiting on I/O. Admission control lets ADMISSION_CAPACITY (4) of
+# them run at a time; the others wait their turn or answer 503 quickly.
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() + 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+worker_class = "gthread"
+
+# Import the app once in the master and fork the workers from it, so the
+# imported code and templates are shared copy-on-write. Code changes then
+# need a new master: send USR2 to start one alongside the old, then TERM
+# the old master once the new workers are up. HUP restarts the workers
+# and reloads this config, but it doesn't reload application code.
+preload_app = True
+
+# Keep idle client connections open briefly so browsers and proxies can
+# reuse them. Keep this below the idle timeout of any load balancer in
+# front of gunicorn.
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+
+# Recycle workers now and then so slow leaks can't build up, with jitter
+# so they don't all restart at once.
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = 100
+
+accesslog = "-"
+
+
+def post_fork(server, worker):
+    # The database pool must not be shared across a fork. Drop whatever the
+    # master opened while preloading; each worker connects on first use.
+    state = server.app.wsgi().extensions.get("sqlalchemy")
+    if state is None:
+        return
+    for connector in state.connectors.values():
+        engine = getattr(connector, "_engine", None)
+        if engine is not None:
+            engine.dispose()
@@ -0,0 +1,213 @@
+import json
+import logging
+import os
+import select
+import socket
+import threading
+from collections import defaultdict
+from itertools import chain, count
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from models import db, Artist, Show, Venue
+
+# ----------------------------------------------------------------------------#
+# Cross-worker invalidation.
+#
+# Each worker keeps caches of its own (facet counts, matches, the venue
+# grid). Its session events keep them current for its own commits; this bus
+# tells the other workers. Every flush that touches a venue, artist or show
+# publishes the changed entity keys, such as ("venue", 3), and every worker
+# but the one that wrote passes them to the callbacks subscribed to that
+# entity, which evict what they hold for those ids.
+#
+# With the postgres backend the keys go out through NOTIFY inside the
+# writing transaction, so they are delivered on commit and dropped on
+# rollback. Each worker LISTENs on a connection of its own from a
+# background thread. Notifications sent while that connection is down are
+# lost, so after (re)connecting subscribers are told to drop everything.
+# The memory backend delivers within the process: buses sharing one stand
+# in for workers, each with an origin of its own, for tests. With a single
+# bus, as in a single process setup, there is no one else to tell.
+# ----------------------------------------------------------------------------#
+
+CHANNEL = "fyyur_invalidate"
+ENTITIES = {Venue: "venue", Artist: "artist", Show: "show"}
+# NOTIFY payloads must stay under 8000 bytes; past this an entity's ids
+# are replaced by "all of them"
+MAX_PAYLOAD = 7000
+RECONNECT_SECONDS = 5
+# tells buses in one process apart
+BUS_NUMBERS = count()
+
+log = logging.getLogger(__name__)
+
+
+def encode(origin, changes):
+    # changes: {entity: set of ids}
+    payload = {"origin": origin, "changes": {entity: sorted(ids) for entity, ids in changes.items()}}
+    body = json.dumps(payload)
+    if len(body) > MAX_PAYLOAD:
+        payload["changes"] = {entity: None for entity in changes}
+        body = json.dumps(payload)
+    return body
+
+
+class MemoryBackend:
+    transactional = False
+
+    def __init__(self):
+        self.buses = []
+
+    def start(self, bus):
+        if bus not in self.buses:
+            self.buses.append(bus)
+
+    def publish(self, payload, connection=None):
+        for bus in list(self.buses):
+            bus.receive(payload)
+
+
+class PostgresBackend:
+    transactional = True
+
+    def __init__(self, engine_factory):
+        self.engine_factory = engine_factory
+        self._stopped = threading.Event()
+
+    def publish(self, payload, connection):
+        connection.execute(text("SELECT pg_notify(:channel, :payload)"), channel=CHANNEL, payload=payload)
+
+    def start(self, bus):
+        thread = threading.Thread(target=self.listen, args=(bus,), name="invalidation-listener", daemon=True)
+        thread.start()
+
+    def listen(self, bus):
+        while not self._stopped.is_set():
+            connection = None
+            try:
+                # a connection of our own, taken out of the pool for good
+                proxy = self.engine_factory().raw_connection()
+                proxy.detach()
+                connection = proxy.connection
+                connection.autocommit = True
+                connection.cursor().execute("LISTEN " + CHANNEL)
+                bus.receive_everything()
+                while not self._stopped.is_set():
+                    if select.select([connection], [], [], RECONNECT_SECONDS) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        bus.receive(connection.notifies.pop(0).payload)
+            except Exception:
+                log.exception("invalidation listener lost its connection, reconnecting")
+                self._stopped.wait(RECONNECT_SECONDS)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+    def stop(self):
+        self._stopped.set()
+
+
+class InvalidationBus:
+    def __init__(self, backend=None, origin=None):
+        self.backend = backend
+        self.origin = origin
+        self.number = next(BUS_NUMBERS)
+        self.subscribers = defaultdict(list)
+        self._started_in = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        if app.config.get("INVALIDATION_BACKEND", "postgres") == "postgres":
+            self.backend = PostgresBackend(lambda: db.get_engine(app))
+        else:
+            self.backend = MemoryBackend()
+        # the listener starts in each worker on its first request: a thread
+        # started in a preloading master doesn't survive the fork
+        app.before_request(self.start)
+        app.extensions["invalidation"] = self
+
+    def subscribe(self, entity, callback):
+        # callback(ids): a set of changed ids, or None when any may have
+        # changed
+        self.subscribers[entity].append(callback)
+
+    def current_origin(self):
+        # the pid changes in each forked worker; the number tells apart
+        # buses sharing a MemoryBackend
+        return self.origin or "{}:{}:{}".format(socket.gethostname(), os.getpid(), self.number)
+
+    def start(self):
+        if self.backend is None or self._started_in == os.getpid():
+            return
+        with self._lock:
+            if self._started_in != os.getpid():
+                self._started_in = os.getpid()
+                self.backend.start(self)
+
+    # ------------------------------------------------------------------------#
+    # Delivery.
+    # ------------------------------------------------------------------------#
+
+    def publish(self, changes, connection=None):
+        if self.backend is not None and changes:
+            self.backend.publish(encode(self.current_origin(), changes), connection)
+
+    def receive(self, payload):
+        message = json.loads(payload)
+        if message["origin"] == self.current_origin():
+            # this worker's own caches were updated by its session events
+            return
+        for entity, ids in message["changes"].items():
+            self.deliver(entity, None if ids is None else set(ids))
+
+    def receive_everything(self):
+        for entity in list(self.subscribers):
+            self.deliver(entity, None)
+
+    def deliver(self, entity, ids):
+        for callback in self.subscribers.get(entity, ()):
+            try:
+                callback(ids)
+            except Exception:
+                log.exception("invalidation callback for %s failed", entity)
+
+
+bus = InvalidationBus()
+
+# ----------------------------------------------------------------------------#
+# Change tracking.
+# ----------------------------------------------------------------------------#
+
+
+@event.listens_for(Session, "after_flush")
+def publish_changes(session, flush_context):
+    changes = defaultdict(set)
+    for instance in chain(session.new, session.dirty, session.deleted):
+        entity = ENTITIES.get(type(instance))
+        if entity is not None and instance.id is not None:
+            changes[entity].add(instance.id)
+    if not changes or bus.backend is None:
+        return
+    if bus.backend.transactional:
+        # sent with the transaction: delivered on commit, dropped on rollback
+        bus.publish(changes, session.connection())
+    else:
+        pending = session.info.setdefault("invalidations", defaultdict(set))
+        for entity, ids in changes.items():
+            pending[entity] |= ids
+
+
+@event.listens_for(Session, "after_commit")
+def publish_pending_changes(session):
+    changes = session.info.pop("invalidations", None)
+    if changes:
+        bus.publish(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_pending_changes(session):
+    session.info.pop("invalidations", None)
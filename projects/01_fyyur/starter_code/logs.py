@@ -0,0 +1,273 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import time
+import uuid
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+from flask import g, has_request_context, request
+from flask.logging import default_handler
+
+try:
+    import fcntl
+except ImportError:  # Windows: rotation goes unlocked
+    fcntl = None
+
+# ----------------------------------------------------------------------------#
+# Logging.
+#
+# Log calls only put the record on an in-memory queue; a background thread
+# formats each one as a JSON line and writes them, a batch and one flush at
+# a time, so request threads don't wait on the disk. Should the writer fall
+# LOG_QUEUE_SIZE records behind, logging blocks until it catches up.
+#
+# Records logged during a request carry its id, taken from an X-Request-ID
+# header or made up, and sent back in the response.
+#
+# The file rotates at LOG_MAX_BYTES, or on LOG_ROTATE_WHEN (e.g. "midnight")
+# when that is set. Several gunicorn workers can share it: the rotation
+# happens under a lock file, and a worker that finds the file already
+# rotated by another reopens it instead of rotating again.
+# ----------------------------------------------------------------------------#
+
+REQUEST_ID_HEADER = "X-Request-ID"
+REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+# everything a LogRecord has of its own; other attributes came in extra={}
+# (and the request attributes, which have keys of their own)
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message",
+    "asctime",
+    "request_id",
+    "method",
+    "path",
+}
+BATCH_RECORDS = 500
+
+
+class JSONFormatter(logging.Formatter):
+    encoder = json.JSONEncoder(default=str)
+
+    def __init__(self):
+        super().__init__()
+        # records come in order, many to the second: format each second once
+        self._second = None
+        self._stamp = None
+
+    def timestamp(self, created):
+        second = int(created)
+        if second != self._second:
+            self._second, self._stamp = second, time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+        return "{}.{:03d}Z".format(self._stamp, int((created - second) * 1000))
+
+    def format(self, record):
+        entry = {
+            "time": self.timestamp(record.created),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "method": getattr(record, "method", None),
+            "path": getattr(record, "path", None),
+            "pid": record.process,
+            "where": "{}:{}".format(record.pathname, record.lineno),
+        }
+        for key in vars(record).keys() - RECORD_ATTRIBUTES:
+            entry[key] = getattr(record, key)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return self.encoder.encode(entry)
+
+
+class RequestContextFilter(logging.Filter):
+    # runs in the thread that logged, while the request is still known
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get("request_id")
+            record.method = request.method
+            record.path = request.path
+        return True
+
+
+class RecordQueueHandler(QueueHandler):
+    def __init__(self, queue, limit):
+        super().__init__(queue)
+        self.limit = limit
+
+    def enqueue(self, record):
+        # a writer that far behind holds up the caller rather than losing
+        # records or growing the queue without end
+        while self.queue.qsize() >= self.limit:
+            time.sleep(0.001)
+        self.queue.put(record)
+
+    def prepare(self, record):
+        # the stock prepare() copies the record and formats all of it here;
+        # only freeze what can't wait (the message arguments and the
+        # traceback) and leave the JSON to the writer thread
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+class BatchedWrites:
+    # while the listener writes a batch, records are only buffered; the file
+    # is flushed once at the end of it
+    batching = False
+
+    def flush(self):
+        if not self.batching:
+            super().flush()
+
+    def handle_batch(self, records):
+        self.acquire()
+        try:
+            self.batching = True
+            for record in records:
+                self.handle(record)
+        finally:
+            self.batching = False
+            self.release()
+            self.flush()
+
+
+class SharedRotation:
+    def rotated_elsewhere(self):
+        try:
+            return os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def reopen(self):
+        self.stream.close()
+        self.stream = self._open()
+
+    def doRollover(self):
+        if self.stream is None or fcntl is None:
+            return super().doRollover()
+        with open(self.baseFilename + ".lock", "a") as lock:
+            # released when the lock file is closed
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if self.rotated_elsewhere():
+                self.reopen()
+            else:
+                super().doRollover()
+
+
+class SharedRotatingFileHandler(BatchedWrites, SharedRotation, RotatingFileHandler):
+    def shouldRollover(self, record):
+        # the stock check formats the record a second time and seeks, which
+        # flushes; the size on disk (other workers' writes included) is
+        # enough, give or take what is still buffered
+        if self.stream is None:
+            self.stream = self._open()
+        return self.maxBytes > 0 and os.fstat(self.stream.fileno()).st_size >= self.maxBytes
+
+
+class SharedTimedRotatingFileHandler(BatchedWrites, SharedRotation, TimedRotatingFileHandler):
+    def reopen(self):
+        super().reopen()
+        self.rolloverAt = self.computeRollover(int(time.time()))
+
+
+class BatchingListener(QueueListener):
+    def dequeue(self, block):
+        # everything queued up so far, at most BATCH_RECORDS of it
+        first = self.queue.get(block)
+        if first is self._sentinel:
+            return first
+        batch = [first]
+        while len(batch) < BATCH_RECORDS:
+            try:
+                record = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is self._sentinel:
+                # stop() puts nothing after it: end with the next dequeue
+                self.queue.put(record)
+                break
+            batch.append(record)
+        return batch
+
+    def handle(self, records):
+        for handler in self.handlers:
+            if self.respect_handler_level:
+                kept = [record for record in records if record.levelno >= handler.level]
+            else:
+                kept = records
+            if hasattr(handler, "handle_batch"):
+                handler.handle_batch(kept)
+            else:
+                for record in kept:
+                    handler.handle(record)
+
+
+class QueuedLogging:
+    def __init__(self, app=None):
+        self.listener = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        path = app.config.get("LOG_FILE", "error.log")
+        when = app.config.get("LOG_ROTATE_WHEN")
+        backups = app.config.get("LOG_BACKUP_COUNT", 5)
+        if when:
+            self.file_handler = SharedTimedRotatingFileHandler(path, when=when, backupCount=backups, delay=True)
+        else:
+            max_bytes = app.config.get("LOG_MAX_BYTES", 10 * 1024 * 1024)
+            self.file_handler = SharedRotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, delay=True)
+        self.file_handler.setFormatter(JSONFormatter())
+
+        self.queue_handler = RecordQueueHandler(queue.SimpleQueue(), app.config.get("LOG_QUEUE_SIZE", 10000))
+        self.queue_handler.addFilter(RequestContextFilter())
+        app.logger.setLevel(app.config.get("LOG_LEVEL", logging.INFO))
+        # Flask's own handler would still write each record to stderr from
+        # the request thread
+        app.logger.removeHandler(default_handler)
+        app.logger.addHandler(self.queue_handler)
+
+        app.before_request(assign_request_id)
+        app.after_request(send_request_id)
+        self.start()
+        # the writer thread doesn't survive a fork (gunicorn's preload): each
+        # worker starts its own, with a queue and file handle of its own
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self.restart_in_child)
+        atexit.register(self.stop)
+        app.extensions["logs"] = self
+
+    def start(self):
+        self.listener = BatchingListener(self.queue_handler.queue, self.file_handler, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        # writes out whatever is still queued
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def restart_in_child(self):
+        self.queue_handler.queue = queue.SimpleQueue()
+        if self.file_handler.stream is not None:
+            self.file_handler.stream.close()
+            self.file_handler.stream = None
+        self.start()
+
+
+def assign_request_id():
+    supplied = request.headers.get(REQUEST_ID_HEADER, "")
+    g.request_id = supplied if REQUEST_ID.match(supplied) else uuid.uuid4().hex
+
+
+def send_request_id(response):
+    if "request_id" in g:
+        response.headers[REQUEST_ID_HEADER] = g.request_id
+    return response
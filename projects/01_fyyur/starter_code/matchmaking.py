@@ -0,0 +1,477 @@
+import logging
+import multiprocessing
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from forms import VALID_GENRES, VALID_STATES
+from invalidation import bus
+from models import Artist, Venue
+from replicas import primary_reads
+
+# ----------------------------------------------------------------------------#
+# Artist / venue matchmaking.
+#
+# Every artist seeking a venue is scored against every venue seeking
+# talent. Genres are encoded as bit masks (one bit per VALID_GENRES entry)
+# and cities and states as integer codes, so a whole block of artists is
+# scored against all venues with a few array operations:
+#
+#   score = 0.6 * genre overlap (Jaccard) + 0.3 * same city + 0.1 * same state
+#
+# and only pairs sharing at least one genre count as a match. The best
+# TOP_K matches of each artist and each venue are kept in memory and shown
+# on the detail pages. Committed profile changes update them incrementally:
+# the changed profile is rescored against the other side, and the lists it
+# enters or leaves are patched. Profiles other workers change arrive
+# through the invalidation bus and are reloaded on the next lookup; the
+# whole index is still rebuilt every REBUILD_SECONDS in case a
+# notification was missed.
+# ----------------------------------------------------------------------------#
+
+TOP_K = 5
+GENRE_WEIGHT = 0.6
+CITY_WEIGHT = 0.3
+STATE_WEIGHT = 0.1
+REBUILD_SECONDS = 10 * 60
+# rows of one side scored per block: bounds memory at BLOCK_ROWS x other side
+BLOCK_ROWS = 1024
+
+GENRE_BITS = {genre: 1 << bit for bit, genre in enumerate(VALID_GENRES)}
+GENRE_SHIFTS = np.arange(len(VALID_GENRES), dtype=np.uint32)
+STATE_CODES = {state: code for code, state in enumerate(VALID_STATES)}
+
+Profile = namedtuple("Profile", ["name", "genres", "city", "state"])
+Match = namedtuple("Match", ["id", "name", "score"])
+OTHER_SIDE = {"artist": "venue", "venue": "artist"}
+SEEKING = {"artist": (Artist, Artist.seeking_venue), "venue": (Venue, Venue.seeking_talent)}
+
+log = logging.getLogger(__name__)
+
+
+def genre_mask(genres):
+    mask = 0
+    for genre in genres or ():
+        mask |= GENRE_BITS.get(genre, 0)
+    return mask
+
+
+def unpack_genres(masks):
+    # (n,) uint32 masks -> (n, genres) 0/1 matrix, ready for a matrix product
+    return ((masks[:, None] >> GENRE_SHIFTS) & 1).astype(np.float32)
+
+
+def score_block(masks, cities, states, other_masks, other_cities, other_states):
+    # scores every row of one side against every row of the other; the
+    # score is symmetric, so either side can come first
+    genres = unpack_genres(masks)
+    other_genres = unpack_genres(other_masks)
+    shared = genres @ other_genres.T
+    union = genres.sum(axis=1)[:, None] + other_genres.sum(axis=1)[None, :] - shared
+    overlap = np.divide(shared, union, out=np.zeros_like(shared), where=union > 0)
+    same_city = (cities[:, None] == other_cities[None, :]) & (cities[:, None] >= 0)
+    same_state = (states[:, None] == other_states[None, :]) & (states[:, None] >= 0)
+    scores = GENRE_WEIGHT * overlap + CITY_WEIGHT * same_city + STATE_WEIGHT * same_state
+    return np.where(shared > 0, scores, 0).astype(np.float32)
+
+
+def top_k(scores, k):
+    # for each row, the columns of its k best scores, best first, and the scores
+    k = min(k, scores.shape[1])
+    if k == 0:
+        empty = np.zeros((scores.shape[0], 0))
+        return empty.astype(np.int64), empty.astype(np.float32)
+    columns = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    best = np.take_along_axis(scores, columns, axis=1)
+    order = np.argsort(-best, axis=1, kind="stable")
+    return np.take_along_axis(columns, order, axis=1), np.take_along_axis(best, order, axis=1)
+
+
+def score_rows(start, stop, side, other, k):
+    # one block of a full build: the block's own top k, and each column's
+    # top k within the block, to be merged with the other blocks
+    scores = score_block(*(array[start:stop] for array in side), *other)
+    rows, row_scores = top_k(scores, k)
+    columns, column_scores = top_k(scores.T, k)
+    return start, rows, row_scores, columns + start, column_scores
+
+
+def to_matches(ids, names, rows, scores):
+    return [
+        Match(int(ids[row]), names[int(ids[row])], round(float(score), 3))
+        for row, score in zip(rows, scores)
+        if score > 0
+    ]
+
+
+def score_all(profiles, names, k, workers=None):
+    # every artist against every venue, a block of artists at a time ->
+    # {"artist": {id: [Match]}, "venue": {id: [Match]}}
+    artists, venues = profiles["artist"], profiles["venue"]
+    matches = {"artist": {}, "venue": {}}
+    if not len(artists) or not len(venues):
+        return matches
+    blocks = [
+        (start, min(start + BLOCK_ROWS, len(artists)), artists.arrays(), venues.arrays(), k)
+        for start in range(0, len(artists), BLOCK_ROWS)
+    ]
+    if workers and workers > 1 and len(blocks) > 1:
+        # spawned, not forked: the web worker forking has request threads
+        # and open connections
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            results = list(pool.map(score_rows, *zip(*blocks)))
+    else:
+        results = [score_rows(*block) for block in blocks]
+
+    candidates, candidate_scores = [], []
+    for start, rows, row_scores, columns, column_scores in results:
+        for offset in range(len(rows)):
+            matches["artist"][int(artists.ids[start + offset])] = to_matches(
+                venues.ids, names["venue"], rows[offset], row_scores[offset]
+            )
+        candidates.append(columns)
+        candidate_scores.append(column_scores)
+
+    # merge each venue's best artists from every block
+    candidates = np.concatenate(candidates, axis=1)
+    candidate_scores = np.concatenate(candidate_scores, axis=1)
+    best, best_scores = top_k(candidate_scores, k)
+    best = np.take_along_axis(candidates, best, axis=1)
+    for row, venue_id in enumerate(venues.ids):
+        matches["venue"][int(venue_id)] = to_matches(artists.ids, names["artist"], best[row], best_scores[row])
+    return matches
+
+
+class Profiles:
+    # one side of the index as parallel arrays, one row per seeking profile
+
+    def __init__(self, ids=(), masks=(), cities=(), states=()):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.masks = np.asarray(masks, dtype=np.uint32)
+        self.cities = np.asarray(cities, dtype=np.int32)
+        self.states = np.asarray(states, dtype=np.int32)
+        self.rows = {int(id): row for row, id in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def arrays(self, row=None):
+        if row is None:
+            return self.masks, self.cities, self.states
+        return self.masks[row : row + 1], self.cities[row : row + 1], self.states[row : row + 1]
+
+    def remove(self, id):
+        row = self.rows.pop(id, None)
+        if row is None:
+            return
+        keep = np.arange(len(self.ids)) != row
+        self.ids, self.masks, self.cities, self.states = (
+            self.ids[keep],
+            self.masks[keep],
+            self.cities[keep],
+            self.states[keep],
+        )
+        self.rows = {int(id): row for row, id in enumerate(self.ids)}
+
+    def upsert(self, id, mask, city, state):
+        row = self.rows.get(id)
+        if row is None:
+            row = len(self.ids)
+            self.ids = np.append(self.ids, np.int64(id))
+            self.masks = np.append(self.masks, np.uint32(mask))
+            self.cities = np.append(self.cities, np.int32(city))
+            self.states = np.append(self.states, np.int32(state))
+            self.rows[id] = row
+        else:
+            self.masks[row], self.cities[row], self.states[row] = mask, city, state
+        return row
+
+
+class MatchIndex:
+    def __init__(self, k=TOP_K, rebuild_seconds=REBUILD_SECONDS, clock=time.monotonic):
+        self.k = k
+        self.rebuild_seconds = rebuild_seconds
+        self.clock = clock
+        # ids changed by other workers, reloaded on the next lookup
+        self.stale = {"artist": set(), "venue": set()}
+        self.city_codes = {}
+        self.profiles = {"artist": Profiles(), "venue": Profiles()}
+        self.names = {"artist": {}, "venue": {}}
+        self.matches = {"artist": {}, "venue": {}}
+        self._lock = threading.RLock()
+        # one full build at a time
+        self._build_lock = threading.Lock()
+        self._built_at = None
+        self._rebuilding = False
+        # changes committed while a full build reads and scores the profiles
+        self._replay = None
+
+    def _city_code(self, city, state, city_codes=None):
+        city_codes = self.city_codes if city_codes is None else city_codes
+        if not city:
+            return -1
+        key = (city.strip().lower(), state)
+        return city_codes.setdefault(key, len(city_codes))
+
+    def _encode(self, profile, city_codes=None):
+        return (
+            genre_mask(profile.genres),
+            self._city_code(profile.city, profile.state, city_codes),
+            STATE_CODES.get(profile.state, -1),
+        )
+
+    # ------------------------------------------------------------------------#
+    # Full build.
+    # ------------------------------------------------------------------------#
+
+    def rebuild(self, workers=None):
+        with self._build_lock:
+            self._rebuild(workers)
+
+    def _rebuild(self, workers):
+        with self._lock:
+            self._replay = []
+        try:
+            artists = Artist.query.filter(Artist.seeking_venue.is_(True)).with_entities(
+                Artist.id, Artist.name, Artist.genres, Artist.city, Artist.state
+            )
+            venues = Venue.query.filter(Venue.seeking_talent.is_(True)).with_entities(
+                Venue.id, Venue.name, Venue.genres, Venue.city, Venue.state
+            )
+            profiles = {
+                "artist": {row.id: Profile(row.name, row.genres, row.city, row.state) for row in artists},
+                "venue": {row.id: Profile(row.name, row.genres, row.city, row.state) for row in venues},
+            }
+        except BaseException:
+            with self._lock:
+                self._replay = None
+            raise
+        self.load(profiles, workers)
+
+    def rebuild_in_background(self):
+        # the current matches keep being served while the new ones are
+        # scored, in MATCHES_WORKERS processes
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        app = current_app._get_current_object()
+
+        def run():
+            try:
+                with app.app_context():
+                    self.rebuild(workers=app.config.get("MATCHES_WORKERS", 1))
+            except Exception:
+                log.exception("rebuilding the match index failed")
+            finally:
+                self._rebuilding = False
+
+        threading.Thread(target=run, name="matches-rebuild", daemon=True).start()
+
+    def load(self, profiles, workers=None):
+        # profiles: {"artist": {id: Profile}, "venue": {id: Profile}}
+        # everything is built aside and swapped in at the end, so lookups
+        # keep getting the old matches until the new ones are complete
+        city_codes, built, names = {}, {}, {}
+        try:
+            for side, by_id in profiles.items():
+                encoded = [self._encode(profile, city_codes) for profile in by_id.values()]
+                built[side] = Profiles(list(by_id), *zip(*encoded)) if encoded else Profiles()
+                names[side] = {id: profile.name for id, profile in by_id.items()}
+            matches = score_all(built, names, self.k, workers)
+        except BaseException:
+            with self._lock:
+                self._replay = None
+            raise
+        with self._lock:
+            self.city_codes, self.profiles, self.names, self.matches = city_codes, built, names, matches
+            self._built_at = self.clock()
+            replay, self._replay = self._replay, None
+            if replay:
+                self.apply(replay)
+
+    def _matches(self, side, rows, scores):
+        return to_matches(self.profiles[side].ids, self.names[side], rows, scores)
+
+    # ------------------------------------------------------------------------#
+    # Incremental updates.
+    # ------------------------------------------------------------------------#
+
+    def apply(self, changes):
+        # changes: (side, id, Profile or None when the profile is gone or no
+        # longer seeking); ignored until the index has been built
+        with self._lock:
+            if self._replay is not None:
+                self._replay.extend(changes)
+            if self._built_at is None:
+                return
+            for side, id, profile in changes:
+                self._update(side, id, profile)
+
+    def _update(self, side, id, profile):
+        other = OTHER_SIDE[side]
+        others = self.profiles[other]
+        if profile is None:
+            self.profiles[side].remove(id)
+            self.names[side].pop(id, None)
+            self.matches[side].pop(id, None)
+            scores = np.zeros(len(others), dtype=np.float32)
+        else:
+            row = self.profiles[side].upsert(id, *self._encode(profile))
+            self.names[side][id] = profile.name
+            scores = score_block(*self.profiles[side].arrays(row), *others.arrays())[0]
+            rows, best = top_k(scores[None, :], self.k)
+            self.matches[side][id] = self._matches(other, rows[0], best[0])
+
+        # patch the other side's lists this profile enters, leaves or moves in
+        for other_row, other_id in enumerate(others.ids):
+            other_id = int(other_id)
+            current = self.matches[other].get(other_id, [])
+            score = float(scores[other_row])
+            previous = next((match for match in current if match.id == id), None)
+            if previous is None and (score <= 0 or (len(current) >= self.k and score <= current[-1].score)):
+                continue
+            if previous is not None and len(current) >= self.k and score < previous.score:
+                # something outside the list may now rank higher: rescore it
+                self._rescore(other, other_row)
+                continue
+            updated = [match for match in current if match.id != id]
+            if score > 0:
+                updated.append(Match(id, self.names[side][id], round(score, 3)))
+            self.matches[other][other_id] = sorted(updated, key=lambda match: -match.score)[: self.k]
+
+    def _rescore(self, side, row):
+        other = OTHER_SIDE[side]
+        scores = score_block(*self.profiles[side].arrays(row), *self.profiles[other].arrays())
+        rows, best = top_k(scores, self.k)
+        self.matches[side][int(self.profiles[side].ids[row])] = self._matches(other, rows[0], best[0])
+
+    # ------------------------------------------------------------------------#
+    # Lookups.
+    # ------------------------------------------------------------------------#
+
+    def evict(self, side, ids):
+        # called from the invalidation bus; None means any profile may have
+        # changed
+        with self._lock:
+            if ids is None:
+                self._built_at = None
+            else:
+                self.stale[side] |= ids
+
+    def refresh(self):
+        with self._lock:
+            stale, self.stale = self.stale, {"artist": set(), "venue": set()}
+        with primary_reads():
+            changes = [change for side, ids in stale.items() if ids for change in load_profiles(side, ids)]
+        self.apply(changes)
+
+    def _ensure_fresh(self):
+        if self._built_at is None:
+            # nothing to serve yet: build now, and only once
+            with self._build_lock:
+                if self._built_at is None:
+                    self._rebuild(None)
+            return
+        if self.clock() - self._built_at > self.rebuild_seconds:
+            self.rebuild_in_background()
+        if self.stale["artist"] or self.stale["venue"]:
+            self.refresh()
+
+    def for_artist(self, artist_id):
+        self._ensure_fresh()
+        return list(self.matches["artist"].get(artist_id, []))
+
+    def for_venue(self, venue_id):
+        self._ensure_fresh()
+        return list(self.matches["venue"].get(venue_id, []))
+
+
+match_index = MatchIndex()
+bus.subscribe("artist", lambda ids: match_index.evict("artist", ids))
+bus.subscribe("venue", lambda ids: match_index.evict("venue", ids))
+
+# ----------------------------------------------------------------------------#
+# Change tracking.
+# ----------------------------------------------------------------------------#
+
+
+def profile_change(instance, deleted):
+    if isinstance(instance, Artist):
+        side, seeking = "artist", instance.seeking_venue
+    else:
+        side, seeking = "venue", instance.seeking_talent
+    if deleted or not seeking:
+        return side, instance.id, None
+    return side, instance.id, Profile(instance.name, list(instance.genres or ()), instance.city, instance.state)
+
+
+def load_profiles(side, ids):
+    # (side, id, Profile or None) as the database has them now
+    model, seeking = SEEKING[side]
+    rows = model.query.filter(model.id.in_(ids)).with_entities(
+        model.id, model.name, model.genres, model.city, model.state, seeking.label("seeking")
+    )
+    found = {row.id: row for row in rows}
+    return [
+        (side, id, Profile(found[id].name, found[id].genres, found[id].city, found[id].state))
+        if id in found and found[id].seeking
+        else (side, id, None)
+        for id in ids
+    ]
+
+
+@event.listens_for(Session, "after_flush")
+def note_profile_changes(session, flush_context):
+    # the profile is copied now: after the commit the instances are expired
+    # and the session can't load them again
+    changes = [
+        profile_change(instance, instance in session.deleted)
+        for instance in chain(session.new, session.dirty, session.deleted)
+        if isinstance(instance, (Artist, Venue))
+    ]
+    if changes:
+        session.info.setdefault("profile_changes", []).extend(changes)
+
+
+@event.listens_for(Session, "after_commit")
+def update_matches(session):
+    changes = session.info.pop("profile_changes", None)
+    if changes:
+        match_index.apply(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_profile_changes(session):
+    session.info.pop("profile_changes", None)
+
+
+# ----------------------------------------------------------------------------#
+# Commands.
+# ----------------------------------------------------------------------------#
+
+matches_cli = AppGroup("matches", help="Artist / venue matchmaking.")
+
+
+@matches_cli.command("rebuild")
+@click.option("--workers", default=1, help="Score blocks of artists in this many processes.")
+def rebuild_command(workers):
+    """Score every seeking artist against every seeking venue."""
+    started = time.perf_counter()
+    match_index.rebuild(workers=workers)
+    click.echo(
+        "{} artists x {} venues scored in {:.2f}s".format(
+            len(match_index.profiles["artist"]),
+            len(match_index.profiles["venue"]),
+            time.perf_counter() - started,
+        )
+    )
@@ -0,0 +1,50 @@
+"""Show duration, tstzrange slot and double-booking exclusion constraints.
+
+Revision ID: 8f3d2a61c0b4
+Revises: 629535bd439a
+Create Date: 2026-10-19 09:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '8f3d2a61c0b4'
+down_revision = '629535bd439a'
+branch_labels = None
+depends_on = None
+
+# keep in step with models.SHOW_SLOT
+SHOW_SLOT = (
+    "tstzrange(start_time AT TIME ZONE 'UTC', "
+    "(start_time + duration_minutes * interval '1 minute') AT TIME ZONE 'UTC', '[)')"
+)
+
+
+def upgrade():
+    # lets a GiST index combine plain equality (venue_id =) with range overlap
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+
+    op.alter_column('Show', 'start_time', existing_type=sa.DateTime(), nullable=False)
+    op.add_column('Show', sa.Column('duration_minutes', sa.Integer(), server_default='120', nullable=False))
+    op.create_check_constraint('ck_show_duration_positive', 'Show', 'duration_minutes > 0')
+    # generated columns need PostgreSQL 12 or later
+    op.add_column('Show', sa.Column('slot', postgresql.TSTZRANGE(), sa.Computed(SHOW_SLOT, persisted=True)))
+
+    # fails, naming the clashing rows, if existing shows already overlap
+    op.create_exclude_constraint('ex_show_venue_slot', 'Show', ('venue_id', '='), ('slot', '&&'), using='gist')
+    op.create_exclude_constraint('ex_show_artist_slot', 'Show', ('artist_id', '='), ('slot', '&&'), using='gist')
+
+    op.create_index('ix_venue_city_state', 'Venue', ['city', 'state'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_venue_city_state', table_name='Venue')
+    op.drop_constraint('ex_show_artist_slot', 'Show')
+    op.drop_constraint('ex_show_venue_slot', 'Show')
+    op.drop_column('Show', 'slot')
+    op.drop_constraint('ck_show_duration_positive', 'Show')
+    op.drop_column('Show', 'duration_minutes')
+    op.alter_column('Show', 'start_time', existing_type=sa.DateTime(), nullable=True)
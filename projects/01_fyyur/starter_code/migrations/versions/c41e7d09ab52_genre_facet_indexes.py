@@ -0,0 +1,28 @@
+"""GIN indexes on genres and location indexes for faceted browsing.
+
+Revision ID: c41e7d09ab52
+Revises: 8f3d2a61c0b4
+Create Date: 2026-10-19 09:40:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41e7d09ab52'
+down_revision = '8f3d2a61c0b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # serve genres @> ARRAY[...] filters
+    op.create_index('ix_venue_genres', 'Venue', ['genres'], unique=False, postgresql_using='gin')
+    op.create_index('ix_artist_genres', 'Artist', ['genres'], unique=False, postgresql_using='gin')
+    op.create_index('ix_artist_city_state', 'Artist', ['city', 'state'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_artist_city_state', table_name='Artist')
+    op.drop_index('ix_artist_genres', table_name='Artist')
+    op.drop_index('ix_venue_genres', table_name='Venue')
@@ -0,0 +1,29 @@
+"""Latitude and longitude for venues.
+
+Revision ID: d5a8e3f1b927
+Revises: c41e7d09ab52
+Create Date: 2026-10-19 11:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a8e3f1b927'
+down_revision = 'c41e7d09ab52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # filled in for existing venues by `flask nearby geocode`
+    op.add_column('Venue', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('longitude', sa.Float(), nullable=True))
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS ix_venue_geometry')
+    op.execute('DROP INDEX IF EXISTS ix_venue_geography')
+    op.drop_column('Venue', 'longitude')
+    op.drop_column('Venue', 'latitude')
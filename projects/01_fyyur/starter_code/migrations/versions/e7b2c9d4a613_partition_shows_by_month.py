@@ -0,0 +1,143 @@
+"""Partition Show by month of start_time.
+
+Revision ID: e7b2c9d4a613
+Revises: d5a8e3f1b927
+Create Date: 2026-10-19 12:30:00.000000
+
+"""
+import datetime
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b2c9d4a613'
+down_revision = 'd5a8e3f1b927'
+branch_labels = None
+depends_on = None
+
+# keep in step with models.SHOW_SLOT and partitions.py
+SHOW_SLOT = (
+    "tstzrange(start_time AT TIME ZONE 'UTC', "
+    "(start_time + duration_minutes * interval '1 minute') AT TIME ZONE 'UTC', '[)')"
+)
+SHOW_COLUMNS = 'id, start_time, duration_minutes, artist_id, venue_id'
+MONTHS_AHEAD = 24
+
+# Exclusion constraints can't span partitions. The trigger serialises
+# bookings per venue and per artist with advisory locks, then looks for an
+# overlapping show in any partition; under READ COMMITTED each check sees
+# the shows committed by whoever held the lock before. It fails with the
+# same error, and constraint names, as the exclusion constraints it
+# replaces.
+NO_DOUBLE_BOOKING = """
+CREATE FUNCTION show_no_double_booking() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('Show.venue_id'), NEW.venue_id);
+    PERFORM pg_advisory_xact_lock(hashtext('Show.artist_id'), NEW.artist_id);
+    IF EXISTS (
+        SELECT 1 FROM "Show" WHERE venue_id = NEW.venue_id AND slot && NEW.slot AND id <> NEW.id
+    ) THEN
+        RAISE EXCEPTION 'venue % already has a show during %', NEW.venue_id, NEW.slot
+            USING ERRCODE = 'exclusion_violation', CONSTRAINT = 'ex_show_venue_slot', TABLE = 'Show';
+    END IF;
+    IF EXISTS (
+        SELECT 1 FROM "Show" WHERE artist_id = NEW.artist_id AND slot && NEW.slot AND id <> NEW.id
+    ) THEN
+        RAISE EXCEPTION 'artist % already has a show during %', NEW.artist_id, NEW.slot
+            USING ERRCODE = 'exclusion_violation', CONSTRAINT = 'ex_show_artist_slot', TABLE = 'Show';
+    END IF;
+    RETURN NULL;
+END
+$$
+"""
+
+
+def add_months(month, count):
+    months = month.year * 12 + month.month - 1 + count
+    return datetime.date(months // 12, months % 12 + 1, 1)
+
+
+def upgrade():
+    op.execute('ALTER TABLE "Show" RENAME TO "Show_unpartitioned"')
+    op.execute('ALTER INDEX "Show_pkey" RENAME TO "Show_unpartitioned_pkey"')
+    # the ids carry over, and so does the sequence behind them
+    op.execute('ALTER SEQUENCE "Show_id_seq" OWNED BY NONE')
+
+    op.create_table('Show',
+    sa.Column('id', sa.Integer(), server_default=sa.text('nextval(\'"Show_id_seq"\'::regclass)'), nullable=False),
+    sa.Column('start_time', sa.DateTime(), nullable=False),
+    sa.Column('duration_minutes', sa.Integer(), server_default='120', nullable=False),
+    sa.Column('slot', postgresql.TSTZRANGE(), sa.Computed(SHOW_SLOT, persisted=True)),
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.CheckConstraint('duration_minutes > 0', name='ck_show_duration_positive'),
+    sa.ForeignKeyConstraint(['artist_id'], ['Artist.id'], ),
+    sa.ForeignKeyConstraint(['venue_id'], ['Venue.id'], ),
+    sa.PrimaryKeyConstraint('id', 'start_time'),
+    postgresql_partition_by='RANGE (start_time)'
+    )
+    # created on the parent, so every partition gets its own
+    op.create_index('ix_show_venue_slot', 'Show', ['venue_id', 'slot'], unique=False, postgresql_using='gist')
+    op.create_index('ix_show_artist_slot', 'Show', ['artist_id', 'slot'], unique=False, postgresql_using='gist')
+
+    # a partition for every month with shows, and the next MONTHS_AHEAD
+    first, last = op.get_bind().execute(
+        sa.text('SELECT min(start_time), max(start_time) FROM "Show_unpartitioned"')
+    ).first()
+    this_month = datetime.date.today().replace(day=1)
+    month, end = this_month, add_months(this_month, MONTHS_AHEAD)
+    if first is not None:
+        month = min(month, first.date().replace(day=1))
+        end = max(end, last.date().replace(day=1))
+    while month <= end:
+        op.execute(
+            "CREATE TABLE show_y{:04d}m{:02d} PARTITION OF \"Show\" FOR VALUES FROM ('{}') TO ('{}')".format(
+                month.year, month.month, month, add_months(month, 1)
+            )
+        )
+        month = add_months(month, 1)
+    op.execute('CREATE TABLE show_default PARTITION OF "Show" DEFAULT')
+
+    op.execute('INSERT INTO "Show" ({0}) SELECT {0} FROM "Show_unpartitioned"'.format(SHOW_COLUMNS))
+    op.execute('ALTER SEQUENCE "Show_id_seq" OWNED BY "Show".id')
+    op.drop_table('Show_unpartitioned')
+
+    # added after the copy: the existing shows were already checked
+    op.execute(NO_DOUBLE_BOOKING)
+    op.execute(
+        'CREATE TRIGGER show_no_double_booking '
+        'AFTER INSERT OR UPDATE OF start_time, duration_minutes, artist_id, venue_id ON "Show" '
+        'FOR EACH ROW EXECUTE FUNCTION show_no_double_booking()'
+    )
+
+
+def downgrade():
+    # archived months are not restored
+    op.execute('DROP TRIGGER show_no_double_booking ON "Show"')
+    op.execute('DROP FUNCTION show_no_double_booking()')
+    op.execute('ALTER TABLE "Show" RENAME TO "Show_partitioned"')
+    op.execute('ALTER INDEX "Show_pkey" RENAME TO "Show_partitioned_pkey"')
+    op.execute('ALTER SEQUENCE "Show_id_seq" OWNED BY NONE')
+
+    op.create_table('Show',
+    sa.Column('id', sa.Integer(), server_default=sa.text('nextval(\'"Show_id_seq"\'::regclass)'), nullable=False),
+    sa.Column('start_time', sa.DateTime(), nullable=False),
+    sa.Column('duration_minutes', sa.Integer(), server_default='120', nullable=False),
+    sa.Column('slot', postgresql.TSTZRANGE(), sa.Computed(SHOW_SLOT, persisted=True)),
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.CheckConstraint('duration_minutes > 0', name='ck_show_duration_positive'),
+    sa.ForeignKeyConstraint(['artist_id'], ['Artist.id'], ),
+    sa.ForeignKeyConstraint(['venue_id'], ['Venue.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute('INSERT INTO "Show" ({0}) SELECT {0} FROM "Show_partitioned"'.format(SHOW_COLUMNS))
+    op.execute('ALTER SEQUENCE "Show_id_seq" OWNED BY "Show".id')
+    # dropping the parent drops its partitions and their indexes
+    op.drop_table('Show_partitioned')
+
+    op.create_exclude_constraint('ex_show_venue_slot', 'Show', ('venue_id', '='), ('slot', '&&'), using='gist')
+    op.create_exclude_constraint('ex_show_artist_slot', 'Show', ('artist_id', '='), ('slot', '&&'), using='gist')
@@ -1,6 +1,21 @@
-from flask_sqlalchemy import SQLAlchemy
+import datetime
 
-db = SQLAlchemy()
+from psycopg2.extras import DateTimeTZRange
+from sqlalchemy.dialects.postgresql import TSTZRANGE
+
+from replicas import RoutingSQLAlchemy
+
+# reads in GET requests may go to a replica, see replicas.py
+db = RoutingSQLAlchemy()
+
+# Show.slot is [start, start + duration) as a tstzrange. start_time has no
+# time zone and is read as UTC. The interval is added before the conversion
+# so the expression stays immutable, as a generated column requires.
+SHOW_SLOT = (
+    "tstzrange(start_time AT TIME ZONE 'UTC', "
+    "(start_time + duration_minutes * interval '1 minute') AT TIME ZONE 'UTC', '[)')"
+)
+DEFAULT_SHOW_MINUTES = 120
 
 
 class Venue(db.Model):
@@ -18,13 +33,36 @@ class Venue(db.Model):
     seeking_description = db.Column(db.String(500))
     website = db.Column(db.String(120))
     genres = db.Column(db.ARRAY(db.String(120)), nullable=False)
+    # filled in by the geocoder, see nearby.py
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
 
     # TODO: COMPLETE implement any missing fields, as a database migration using Flask-Migrate
-    shows = db.relationship("Show", backref="venue", lazy="joined")
+    # loaded on demand: Show is partitioned and pages read it through
+    # Show.upcoming_and_past, which only touches the partitions it needs
+    shows = db.relationship("Show", backref="venue", lazy=True)
+
+    __table_args__ = (
+        db.Index("ix_venue_city_state", "city", "state"),
+        db.Index("ix_venue_genres", "genres", postgresql_using="gin"),
+    )
 
     def __repr__(self):
         return f"{self.name} in {self.city}, {self.state}"
 
+    @classmethod
+    def free_between(cls, city, state, start, end):
+        # venues in the city with no show overlapping [start, end); each
+        # venue is one probe of the (venue_id, slot) GiST index
+        window = DateTimeTZRange(start, end, "[)")
+        booked = db.session.query(Show.id).filter(Show.venue_id == cls.id, Show.slot.overlaps(window))
+        return (
+            cls.query.options(db.lazyload(cls.shows))
+            .filter(cls.city == city, cls.state == state, ~booked.exists())
+            .order_by(cls.name)
+            .all()
+        )
+
 
 class Artist(db.Model):
     __tablename__ = "Artist"
@@ -42,14 +80,72 @@ class Artist(db.Model):
     website = db.Column(db.String(120))
     shows = db.relationship("Show", backref="artist", lazy=True)
 
+    __table_args__ = (
+        db.Index("ix_artist_city_state", "city", "state"),
+        db.Index("ix_artist_genres", "genres", postgresql_using="gin"),
+    )
+
     def __repr__(self):
         return f"{self.name} from {self.city}, {self.state}"
 
+    def free_periods(self, start, end):
+        # the gaps in [start, end) between this artist's shows; only shows
+        # overlapping the window are read, through the (artist_id, slot) index
+        window = DateTimeTZRange(start, end, "[)")
+        booked = (
+            db.session.query(Show.slot)
+            .filter(Show.artist_id == self.id, Show.slot.overlaps(window))
+            .order_by(Show.slot)
+        )
+        free = []
+        cursor = start
+        for (slot,) in booked:
+            if slot.lower > cursor:
+                free.append((cursor, slot.lower))
+            cursor = max(cursor, slot.upper)
+        if cursor < end:
+            free.append((cursor, end))
+        return free
+
 
 class Show(db.Model):
     __tablename__ = "Show"
 
-    id = db.Column(db.Integer, primary_key=True)
-    start_time = db.Column(db.DateTime)
+    # the primary key includes start_time because Show is partitioned by it;
+    # id alone still identifies a show
+    id = db.Column(db.Integer, autoincrement=True, nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False)
+    duration_minutes = db.Column(
+        db.Integer, nullable=False, default=DEFAULT_SHOW_MINUTES, server_default=str(DEFAULT_SHOW_MINUTES)
+    )
+    slot = db.Column(TSTZRANGE, db.Computed(SHOW_SLOT, persisted=True))
     artist_id = db.Column(db.Integer, db.ForeignKey("Artist.id"), nullable=False)
     venue_id = db.Column(db.Integer, db.ForeignKey("Venue.id"), nullable=False)
+
+    # Show is range partitioned by month of start_time, see partitions.py.
+    # Exclusion constraints can't span partitions, so double bookings are
+    # rejected by the show_no_double_booking trigger, which probes these
+    # GiST indexes and fails with the ex_show_venue_slot or
+    # ex_show_artist_slot constraint name. The indexes also serve the
+    # availability queries.
+    __table_args__ = (
+        db.PrimaryKeyConstraint(id, start_time),
+        db.CheckConstraint("duration_minutes > 0", name="ck_show_duration_positive"),
+        db.Index("ix_show_venue_slot", venue_id, slot, postgresql_using="gist"),
+        db.Index("ix_show_artist_slot", artist_id, slot, postgresql_using="gist"),
+        {"postgresql_partition_by": "RANGE (start_time)"},
+    )
+    __mapper_args__ = {"primary_key": [id]}
+
+    @classmethod
+    def upcoming_and_past(cls, query=None):
+        # two queries rather than one over every show: each bounds
+        # start_time on its side of now, so Postgres prunes the partitions
+        # on the other side
+        now = datetime.datetime.now()
+        if query is None:
+            query = cls.query
+        query = query.options(db.joinedload(cls.artist), db.joinedload(cls.venue))
+        upcoming = query.filter(cls.start_time > now).order_by(cls.start_time).all()
+        past = query.filter(cls.start_time < now).order_by(cls.start_time.desc()).all()
+        return upcoming, past
@@ -0,0 +1,440 @@
+import csv
+import logging
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+from itertools import chain
+
+import click
+from flask import current_app, has_app_context
+from flask.cli import AppGroup
+from sqlalchemy import event, func, inspect, or_, text
+from sqlalchemy.orm import Session
+from werkzeug.utils import import_string
+
+from invalidation import bus
+from models import db, Venue
+from replicas import primary_reads
+
+# ----------------------------------------------------------------------------#
+# Nearby venues.
+#
+# Venues get a latitude and longitude from a pluggable geocoder when they
+# are created or their address, city or state changes. The default geocoder
+# needs no network: it looks the city up in data/us_cities.csv and places
+# the venue at the city centre.
+#
+# Radius and bounding-box queries are answered from an in-memory grid of
+# CELL_DEGREES square cells: only the cells overlapping the query box are
+# read, then candidates are checked with the haversine distance. Committed
+# venue changes move single entries between cells; venues other workers
+# change arrive through the invalidation bus and are reloaded on the next
+# query. The whole grid is still reloaded from the primary every
+# REBUILD_SECONDS, in the background, in case a notification was missed.
+# With NEARBY_BACKEND = "postgis" the same queries go to PostGIS instead,
+# through the indexes created by `flask nearby postgis`.
+# ----------------------------------------------------------------------------#
+
+EARTH_RADIUS_MILES = 3958.8
+METERS_PER_MILE = 1609.344
+# about 7 miles north-south: a 10 mile radius reads a handful of cells
+CELL_DEGREES = 0.1
+REBUILD_SECONDS = 10 * 60
+DEFAULT_MILES = 10
+
+log = logging.getLogger(__name__)
+
+CITY_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "us_cities.csv")
+LOCATION_FIELDS = ("address", "city", "state")
+
+
+def haversine_miles(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_box(lat, lng, miles):
+    # the smallest latitude/longitude box holding the circle; its width
+    # is 360 degrees once the circle reaches a pole
+    angle = miles / EARTH_RADIUS_MILES
+    dlat = math.degrees(angle)
+    south, north = lat - dlat, lat + dlat
+    if south <= -90 or north >= 90 or angle >= math.pi / 2:
+        return max(south, -90.0), -180.0, min(north, 90.0), 180.0
+    dlng = math.degrees(math.asin(min(1.0, math.sin(angle) / math.cos(math.radians(lat)))))
+    return south, lng - dlng, north, lng + dlng
+
+
+# ----------------------------------------------------------------------------#
+# Geocoders: callables taking (address, city, state) and returning
+# (latitude, longitude), or None when the location is unknown.
+# ----------------------------------------------------------------------------#
+
+
+class CityTableGeocoder:
+    def __init__(self, path=CITY_TABLE):
+        with open(path, newline="") as f:
+            self.table = {
+                (row["city"].lower(), row["state"]): (float(row["latitude"]), float(row["longitude"]))
+                for row in csv.DictReader(f)
+            }
+
+    def __call__(self, address, city, state):
+        return self.table.get(((city or "").strip().lower(), state))
+
+
+class StaticGeocoder:
+    # fixed locations for tests and local development, keyed by address
+    # or by (city, state)
+    def __init__(self, locations):
+        self.locations = locations
+
+    def __call__(self, address, city, state):
+        return self.locations.get(address) or self.locations.get((city, state))
+
+
+# ----------------------------------------------------------------------------#
+# Grid index.
+# ----------------------------------------------------------------------------#
+
+
+class VenueGrid:
+    def __init__(self, cell_degrees=CELL_DEGREES, rebuild_seconds=REBUILD_SECONDS, clock=time.monotonic):
+        self.cell_degrees = cell_degrees
+        self.columns = int(round(360 / cell_degrees))
+        self.rebuild_seconds = rebuild_seconds
+        self.clock = clock
+        self.positions = {}
+        self.cells = {}
+        self.stale = set()
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+        self._built_at = None
+        self._rebuilding = False
+        # bumped by evict(None), so a build that started before it doesn't
+        # count as fresh
+        self._evictions = 0
+        # changes committed while a full build reads the positions
+        self._replay = None
+
+    def _row(self, lat):
+        return int((lat + 90) // self.cell_degrees)
+
+    def _column(self, lng):
+        # modulo wraps the antimeridian: longitude 180 shares cells with -180
+        return int((lng + 180) // self.cell_degrees) % self.columns
+
+    def _cell(self, position):
+        return self._row(position[0]), self._column(position[1])
+
+    def rebuild(self):
+        with self._build_lock:
+            self._rebuild()
+
+    def _rebuild(self):
+        with self._lock:
+            # evictions from before the query are answered by it; later ones
+            # stay stale
+            covered, evictions = set(self.stale), self._evictions
+            self._replay = []
+        try:
+            with primary_reads():
+                rows = Venue.query.filter(Venue.latitude.isnot(None), Venue.longitude.isnot(None)).with_entities(
+                    Venue.id, Venue.latitude, Venue.longitude
+                )
+                positions = {row.id: (row.latitude, row.longitude) for row in rows}
+        except BaseException:
+            with self._lock:
+                self._replay = None
+            raise
+        self.load(positions, covered, evictions)
+
+    def rebuild_in_background(self):
+        # queries keep being answered from the current grid meanwhile
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        app = current_app._get_current_object()
+
+        def run():
+            try:
+                with app.app_context():
+                    self.rebuild()
+            except Exception:
+                log.exception("rebuilding the venue grid failed")
+            finally:
+                self._rebuilding = False
+
+        threading.Thread(target=run, name="nearby-rebuild", daemon=True).start()
+
+    def load(self, positions, covered=(), evictions=None):
+        # positions: {venue id: (latitude, longitude)}; covered: the stale
+        # ids these positions are fresh for
+        cells = defaultdict(set)
+        for id, position in positions.items():
+            cells[self._cell(position)].add(id)
+        with self._lock:
+            self.positions, self.cells = dict(positions), dict(cells)
+            self.stale -= set(covered)
+            if evictions is None or evictions == self._evictions:
+                self._built_at = self.clock()
+            replay, self._replay = self._replay, None
+            if replay:
+                self.apply(replay)
+
+    def apply(self, changes):
+        # changes: (venue id, (latitude, longitude) or None when the venue
+        # was deleted or has no location)
+        with self._lock:
+            if self._replay is not None:
+                self._replay.extend(changes)
+            if self._built_at is None:
+                # nothing to patch: the first query loads everything
+                return
+            for id, position in changes:
+                old = self.positions.pop(id, None)
+                if old is not None:
+                    cell = self._cell(old)
+                    self.cells[cell].discard(id)
+                    if not self.cells[cell]:
+                        del self.cells[cell]
+                if position is not None:
+                    self.positions[id] = position
+                    self.cells.setdefault(self._cell(position), set()).add(id)
+
+    def evict(self, ids):
+        # called from the invalidation bus; None means any venue may have
+        # changed
+        with self._lock:
+            if ids is None:
+                self._built_at = None
+                self._evictions += 1
+            else:
+                self.stale |= ids
+
+    def refresh(self):
+        with self._lock:
+            stale, self.stale = self.stale, set()
+        with primary_reads():
+            rows = Venue.query.filter(Venue.id.in_(stale)).with_entities(Venue.id, Venue.latitude, Venue.longitude)
+            found = {row.id: (row.latitude, row.longitude) for row in rows if None not in (row.latitude, row.longitude)}
+        self.apply([(id, found.get(id)) for id in stale])
+
+    def _ensure_fresh(self):
+        if self._built_at is None:
+            # nothing to serve yet: build now, and only once
+            with self._build_lock:
+                if self._built_at is None:
+                    self._rebuild()
+            return
+        if self.clock() - self._built_at > self.rebuild_seconds:
+            self.rebuild_in_background()
+        if self.stale:
+            self.refresh()
+
+    def _candidates(self, south, west, north, east):
+        # ids in the cells overlapping the box; west > east crosses the
+        # antimeridian
+        rows = range(self._row(max(south, -90.0)), self._row(min(north, 90.0)) + 1)
+        if east < west:
+            east += 360
+        first = int((west + 180) // self.cell_degrees)
+        last = int((east + 180) // self.cell_degrees)
+        columns = {column % self.columns for column in range(first, min(last, first + self.columns - 1) + 1)}
+        if len(rows) * len(columns) > len(self.cells):
+            # a box wider than the occupied area: scan the occupied cells
+            cells = (ids for (row, column), ids in self.cells.items() if row in rows and column in columns)
+        else:
+            cells = (self.cells.get((row, column), ()) for row in rows for column in columns)
+        return chain.from_iterable(cells)
+
+    def within(self, lat, lng, miles):
+        self._ensure_fresh()
+        found = []
+        with self._lock:
+            for id in self._candidates(*radius_box(lat, lng, miles)):
+                distance = haversine_miles(lat, lng, *self.positions[id])
+                if distance <= miles:
+                    found.append((id, distance))
+        return sorted(found, key=lambda item: item[1])
+
+    def in_box(self, south, west, north, east):
+        self._ensure_fresh()
+        with self._lock:
+            found = []
+            for id in self._candidates(south, west, north, east):
+                lat, lng = self.positions[id]
+                inside_lng = west <= lng <= east if west <= east else lng >= west or lng <= east
+                if south <= lat <= north and inside_lng:
+                    found.append(id)
+        return sorted(found)
+
+
+venue_grid = VenueGrid()
+bus.subscribe("venue", venue_grid.evict)
+
+# ----------------------------------------------------------------------------#
+# PostGIS.
+# ----------------------------------------------------------------------------#
+
+
+def venue_geometry():
+    return func.ST_SetSRID(func.ST_MakePoint(Venue.longitude, Venue.latitude), 4326)
+
+
+def venue_geography():
+    return func.geography(venue_geometry())
+
+
+POSTGIS_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS ix_venue_geography ON "Venue" '
+    "USING gist (geography(ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)))",
+    'CREATE INDEX IF NOT EXISTS ix_venue_geometry ON "Venue" '
+    "USING gist (ST_SetSRID(ST_MakePoint(longitude, latitude), 4326))",
+]
+
+
+class PostgisVenues:
+    def within(self, lat, lng, miles):
+        point = func.geography(func.ST_SetSRID(func.ST_MakePoint(lng, lat), 4326))
+        distance = func.ST_Distance(venue_geography(), point)
+        rows = (
+            db.session.query(Venue.id, distance)
+            .filter(func.ST_DWithin(venue_geography(), point, miles * METERS_PER_MILE))
+            .order_by(distance)
+        )
+        return [(id, meters / METERS_PER_MILE) for id, meters in rows]
+
+    def in_box(self, south, west, north, east):
+        def envelope(west, east):
+            return venue_geometry().op("&&")(func.ST_MakeEnvelope(west, south, east, north, 4326))
+
+        if west <= east:
+            inside = envelope(west, east)
+        else:
+            inside = or_(envelope(west, 180), envelope(-180, east))
+        return [id for id, in db.session.query(Venue.id).filter(inside).order_by(Venue.id)]
+
+
+# ----------------------------------------------------------------------------#
+# Extension.
+# ----------------------------------------------------------------------------#
+
+
+class Nearby:
+    def __init__(self, app=None):
+        self.geocoder = None
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # GEOCODER is a geocoder, or an import path to one or to a class
+        # making one
+        geocoder = app.config.get("GEOCODER", "nearby:CityTableGeocoder")
+        if isinstance(geocoder, str):
+            geocoder = import_string(geocoder)
+        self.geocoder = geocoder() if isinstance(geocoder, type) else geocoder
+        self.backend = PostgisVenues() if app.config.get("NEARBY_BACKEND") == "postgis" else venue_grid
+        app.cli.add_command(nearby_cli)
+        app.extensions["nearby"] = self
+
+    def geocode(self, address, city, state):
+        return self.geocoder(address, city, state)
+
+    def within(self, lat, lng, miles):
+        return self.backend.within(lat, lng, miles)
+
+    def in_box(self, south, west, north, east):
+        return self.backend.in_box(south, west, north, east)
+
+
+# ----------------------------------------------------------------------------#
+# Change tracking.
+# ----------------------------------------------------------------------------#
+
+
+def needs_geocoding(venue):
+    state = inspect(venue)
+    if state.attrs.latitude.history.has_changes() or state.attrs.longitude.history.has_changes():
+        # coordinates were set explicitly
+        return False
+    if state.pending:
+        return True
+    return any(state.attrs[field].history.has_changes() for field in LOCATION_FIELDS)
+
+
+@event.listens_for(Session, "before_flush")
+def geocode_venues(session, flush_context, instances):
+    if not has_app_context() or "nearby" not in current_app.extensions:
+        return
+    nearby = current_app.extensions["nearby"]
+    for instance in chain(session.new, session.dirty):
+        if isinstance(instance, Venue) and needs_geocoding(instance):
+            location = nearby.geocode(instance.address, instance.city, instance.state)
+            instance.latitude, instance.longitude = location or (None, None)
+
+
+@event.listens_for(Session, "after_flush")
+def note_venue_locations(session, flush_context):
+    changes = []
+    for instance in chain(session.new, session.dirty, session.deleted):
+        if isinstance(instance, Venue):
+            position = (instance.latitude, instance.longitude)
+            located = instance not in session.deleted and None not in position
+            changes.append((instance.id, position if located else None))
+    if changes:
+        session.info.setdefault("venue_locations", []).extend(changes)
+
+
+@event.listens_for(Session, "after_commit")
+def update_venue_grid(session):
+    changes = session.info.pop("venue_locations", None)
+    if changes:
+        venue_grid.apply(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_venue_locations(session):
+    session.info.pop("venue_locations", None)
+
+
+# ----------------------------------------------------------------------------#
+# Commands.
+# ----------------------------------------------------------------------------#
+
+nearby_cli = AppGroup("nearby", help="Nearby venue search.")
+
+
+@nearby_cli.command("geocode")
+@click.option("--all", "everything", is_flag=True, help="Geocode venues that already have a location too.")
+def geocode_command(everything):
+    """Fill in venue locations with the configured geocoder."""
+    nearby = current_app.extensions["nearby"]
+    query = Venue.query.options(db.lazyload(Venue.shows))
+    if not everything:
+        query = query.filter(or_(Venue.latitude.is_(None), Venue.longitude.is_(None)))
+    located = missing = 0
+    for venue in query:
+        location = nearby.geocode(venue.address, venue.city, venue.state)
+        venue.latitude, venue.longitude = location or (None, None)
+        if location:
+            located += 1
+        else:
+            missing += 1
+    db.session.commit()
+    click.echo("{} venues located, {} not found".format(located, missing))
+
+
+@nearby_cli.command("postgis")
+def postgis_command():
+    """Create the PostGIS extension and the venue location indexes."""
+    with db.engine.begin() as connection:
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS postgis"))
+        for statement in POSTGIS_INDEXES:
+            connection.execute(text(statement))
+    click.echo('Indexes created; set NEARBY_BACKEND = "postgis" to use them.')
@@ -0,0 +1,172 @@
+import datetime
+import gzip
+import json
+import os
+import re
+import tempfile
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import text
+
+from models import db
+
+# ----------------------------------------------------------------------------#
+# Show partitions.
+#
+# Show is range partitioned by start_time, one partition per month
+# (show_y2035m04 holds April 2035), plus show_default for anything outside
+# them. `flask shows partitions` creates the months ahead; run it monthly.
+# If show_default already holds shows for a month being created, they are
+# moved into the new partition.
+#
+# `flask shows archive` detaches the months older than --keep-months,
+# exports each to instance/archive/<partition>.ndjson.gz, one show per
+# line, and drops the table once the export holds every row. A detached
+# partition left behind by an interrupted run is exported on the next one.
+# ----------------------------------------------------------------------------#
+
+MONTHS_AHEAD = 24
+KEEP_MONTHS = 12
+PARTITION_NAME = re.compile(r"^show_y(\d{4})m(\d{2})$")
+SHOW_COLUMNS = "id, start_time, duration_minutes, artist_id, venue_id"
+
+ATTACHED_PARTITIONS = text(
+    "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+    "WHERE i.inhparent = '\"Show\"'::regclass"
+)
+DETACHED_PARTITIONS = text(
+    "SELECT relname FROM pg_class "
+    "WHERE relkind = 'r' AND NOT relispartition AND relname ~ '^show_y[0-9]{4}m[0-9]{2}$'"
+)
+ARCHIVE_QUERY = (
+    "SELECT s.id, s.start_time, s.duration_minutes, s.artist_id, a.name AS artist_name, "
+    "s.venue_id, v.name AS venue_name "
+    'FROM {} s LEFT JOIN "Artist" a ON a.id = s.artist_id LEFT JOIN "Venue" v ON v.id = s.venue_id '
+    "ORDER BY s.start_time, s.id"
+)
+
+
+def month_start(day):
+    return datetime.date(day.year, day.month, 1)
+
+
+def add_months(month, count):
+    months = month.year * 12 + month.month - 1 + count
+    return datetime.date(months // 12, months % 12 + 1, 1)
+
+
+def partition_name(month):
+    return "show_y{:04d}m{:02d}".format(month.year, month.month)
+
+
+def partitions(connection, attached=True):
+    # {first day of the month: table name}
+    found = {}
+    for (name,) in connection.execute(ATTACHED_PARTITIONS if attached else DETACHED_PARTITIONS):
+        match = PARTITION_NAME.match(name)
+        if match:
+            found[datetime.date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return found
+
+
+def create_partition(connection, month):
+    # returns how many shows moved out of show_default
+    name = partition_name(month)
+    bounds = {"lower": month, "upper": add_months(month, 1)}
+    in_range = "start_time >= :lower AND start_time < :upper"
+    create = text(
+        "CREATE TABLE {} PARTITION OF \"Show\" FOR VALUES FROM ('{}') TO ('{}')".format(
+            name, bounds["lower"], bounds["upper"]
+        )
+    )
+    stranded = connection.execute(text("SELECT count(*) FROM show_default WHERE " + in_range), bounds).scalar()
+    if not stranded:
+        connection.execute(create)
+        return 0
+
+    # Postgres won't add a partition for rows the default partition holds:
+    # take the default out while they move
+    connection.execute(text('ALTER TABLE "Show" DETACH PARTITION show_default'))
+    connection.execute(create)
+    connection.execute(
+        text(
+            'INSERT INTO "Show" ({0}) SELECT {0} FROM show_default WHERE {1}'.format(SHOW_COLUMNS, in_range)
+        ),
+        bounds,
+    )
+    connection.execute(text("DELETE FROM show_default WHERE " + in_range), bounds)
+    connection.execute(text('ALTER TABLE "Show" ATTACH PARTITION show_default DEFAULT'))
+    return stranded
+
+
+def export_partition(engine, name, path):
+    # streams the table into a gzipped NDJSON file; returns the row count
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+    written = 0
+    try:
+        with os.fdopen(descriptor, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as f:
+            with engine.connect() as connection:
+                rows = connection.execution_options(stream_results=True).execute(text(ARCHIVE_QUERY.format(name)))
+                for row in rows:
+                    record = dict(row)
+                    record["start_time"] = record["start_time"].isoformat()
+                    f.write(json.dumps(record) + "\n")
+                    written += 1
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+    return written
+
+
+# ----------------------------------------------------------------------------#
+# Commands.
+# ----------------------------------------------------------------------------#
+
+shows_cli = AppGroup("shows", help="Show partitions and archival.")
+
+
+@shows_cli.command("partitions")
+@click.option("--ahead", default=MONTHS_AHEAD, show_default=True, help="Months after this one to create.")
+def partitions_command(ahead):
+    """Create the monthly Show partitions for the coming months."""
+    first = month_start(datetime.date.today())
+    with db.get_engine().begin() as connection:
+        existing = partitions(connection)
+        for offset in range(ahead + 1):
+            month = add_months(first, offset)
+            if month not in existing:
+                moved = create_partition(connection, month)
+                click.echo("created {} ({} shows moved from show_default)".format(partition_name(month), moved))
+
+
+@shows_cli.command("archive")
+@click.option("--keep-months", default=KEEP_MONTHS, show_default=True, help="Months of past shows to keep.")
+@click.option("--output", type=click.Path(file_okay=False), help="Archive directory [default: instance/archive].")
+def archive_command(keep_months, output):
+    """Detach old Show partitions and export them as gzipped NDJSON."""
+    output = output or os.path.join(current_app.instance_path, "archive")
+    cutoff = add_months(month_start(datetime.date.today()), -keep_months)
+    engine = db.get_engine()
+
+    with engine.begin() as connection:
+        for month, name in sorted(partitions(connection).items()):
+            if add_months(month, 1) <= cutoff:
+                connection.execute(text('ALTER TABLE "Show" DETACH PARTITION {}'.format(name)))
+
+    with engine.connect() as connection:
+        detached = partitions(connection, attached=False)
+    for month, name in sorted(detached.items()):
+        path = os.path.join(output, name + ".ndjson.gz")
+        written = export_partition(engine, name, path)
+        with engine.begin() as connection:
+            count = connection.execute(text("SELECT count(*) FROM {}".format(name))).scalar()
+            if count != written:
+                raise click.ClickException(
+                    "{} has {} shows but {} were exported; the table was kept".format(name, count, written)
+                )
+            connection.execute(text("DROP TABLE {}".format(name)))
+        click.echo("archived {} shows from {} to {}".format(written, name, path))
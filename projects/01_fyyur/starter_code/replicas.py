@@ -0,0 +1,243 @@
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, has_request_context, request
+from flask import session as client_session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import event, orm, text
+from sqlalchemy.exc import SQLAlchemyError
+
+# ----------------------------------------------------------------------------#
+# Read replicas.
+#
+# GET and HEAD requests read from the replicas in SQLALCHEMY_REPLICA_URIS,
+# taking turns between them; everything else, and every flush, goes to the
+# primary. Once a request has written, the rest of it reads from the primary
+# too, and so do the same client's next requests until a replica has
+# replayed the write (its WAL position is kept in the session cookie). That
+# covers the redirect to the new venue after creating it.
+#
+# Every LAG_CHECK_SECONDS the replicas' replay positions are read. A replica
+# that can't be reached, or is more than SQLALCHEMY_REPLICA_MAX_LAG seconds
+# behind, is skipped until the next check; with none left, reads go to the
+# primary. Databases other than Postgres are never treated as lagging, so
+# tests can point the primary and a replica at two local databases.
+# ----------------------------------------------------------------------------#
+
+READ_METHODS = {"GET", "HEAD"}
+LAG_CHECK_SECONDS = 5
+DEFAULT_MAX_LAG = 10
+SESSION_KEY = "primary_position"
+
+
+def parse_lsn(value):
+    # a Postgres WAL position such as "16/B374D848"
+    high, low = value.split("/")
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+class Replica:
+    def __init__(self, bind):
+        self.bind = bind
+        self.healthy = True
+        self.lag = 0.0
+        # replayed WAL position; None when the database isn't replicating
+        self.position = None
+
+
+class ReplicaRouter:
+    def __init__(self, app=None, db=None, clock=time.monotonic):
+        self.db = db
+        self.clock = clock
+        self.replicas = []
+        self._turns = itertools.count()
+        self._lock = threading.Lock()
+        self._checked_at = None
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        self.db = db
+        # each replica becomes a Flask-SQLAlchemy bind, so its engine and
+        # pool are managed (and disposed after a fork) like the primary's
+        binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+        self.replicas = []
+        for number, uri in enumerate(app.config.get("SQLALCHEMY_REPLICA_URIS") or ()):
+            bind = "replica_{}".format(number)
+            binds[bind] = uri
+            self.replicas.append(Replica(bind))
+        app.config["SQLALCHEMY_BINDS"] = binds
+        self.max_lag = app.config.get("SQLALCHEMY_REPLICA_MAX_LAG", DEFAULT_MAX_LAG)
+        app.extensions["replicas"] = self
+
+    # ------------------------------------------------------------------------#
+    # Routing.
+    # ------------------------------------------------------------------------#
+
+    def bind_for_request(self):
+        # the replica bind this request reads from, or None for the primary
+        if not self.replicas or not has_request_context() or request.method not in READ_METHODS:
+            return None
+        if g.get("use_primary") or g.get("wrote"):
+            return None
+        if "replica_bind" not in g:
+            g.replica_bind = self.choose(client_session.get(SESSION_KEY))
+        return g.replica_bind
+
+    def choose(self, required=None):
+        # required: the client's last write, as a primary position the
+        # replica must have replayed or, without one, a time to wait for
+        self.check_lag()
+        usable = [replica for replica in self.replicas if replica.healthy and replica.lag <= self.max_lag]
+        if required and "position" in required:
+            usable = [
+                replica for replica in usable if replica.position is None or replica.position >= required["position"]
+            ]
+        elif required and time.time() < required["until"]:
+            usable = []
+        if not usable:
+            return None
+        return usable[next(self._turns) % len(usable)].bind
+
+    # ------------------------------------------------------------------------#
+    # Lag.
+    # ------------------------------------------------------------------------#
+
+    def check_lag(self, force=False):
+        checked_at = self._checked_at
+        if not force and checked_at is not None and self.clock() - checked_at < LAG_CHECK_SECONDS:
+            return
+        # one thread checks, the others route on what was last seen
+        if not self._lock.acquire(blocking=force):
+            return
+        try:
+            try:
+                primary = current_position(self.db.get_engine())
+            except SQLAlchemyError:
+                # the replicas can still serve reads, judged by their own
+                # replay timestamps
+                primary = None
+            for replica in self.replicas:
+                try:
+                    replica.position, replica.lag = replay_state(self.db.get_engine(bind=replica.bind), primary)
+                    replica.healthy = True
+                except SQLAlchemyError:
+                    replica.healthy = False
+            self._checked_at = self.clock()
+        finally:
+            self._lock.release()
+
+    def remember_write(self):
+        # after a commit: keep this client on the primary until a replica
+        # has caught up with it
+        if not self.replicas or not has_request_context():
+            return
+        try:
+            position = current_position(self.db.get_engine())
+        except SQLAlchemyError:
+            position = None
+        if position is not None:
+            client_session[SESSION_KEY] = {"position": position}
+        else:
+            client_session[SESSION_KEY] = {"until": time.time() + self.max_lag}
+
+
+def current_position(engine):
+    if engine.dialect.name != "postgresql":
+        return None
+    with engine.connect() as connection:
+        return parse_lsn(connection.execute(text("SELECT pg_current_wal_lsn()::text")).scalar())
+
+
+def replay_state(engine, primary):
+    # (replayed position, seconds behind the primary)
+    with engine.connect() as connection:
+        if engine.dialect.name != "postgresql":
+            connection.execute(text("SELECT 1"))
+            return None, 0.0
+        replayed, behind = connection.execute(
+            text(
+                "SELECT pg_last_wal_replay_lsn()::text, "
+                "extract(epoch FROM now() - pg_last_xact_replay_timestamp())"
+            )
+        ).first()
+    if replayed is None:
+        # not a streaming replica
+        return None, 0.0
+    position = parse_lsn(replayed)
+    # an idle primary leaves the last replayed transaction getting older:
+    # a replica that has replayed everything isn't behind
+    if primary is not None and position >= primary:
+        return position, 0.0
+    return position, float(behind or 0.0)
+
+
+@contextmanager
+def primary_reads():
+    # for reloading what another worker has just committed: its
+    # notification arrives when the primary commits, possibly before a
+    # replica has replayed the change
+    if not has_request_context():
+        yield
+        return
+    previous = g.get("use_primary", False)
+    g.use_primary = True
+    try:
+        yield
+    finally:
+        g.use_primary = previous
+
+
+def use_primary(view):
+    # for GET views that must see the latest data, e.g. edit forms
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.use_primary = True
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+# ----------------------------------------------------------------------------#
+# Session.
+# ----------------------------------------------------------------------------#
+
+
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+        router = self.app.extensions.get("replicas")
+        if router is not None and not self._flushing:
+            info = getattr(getattr(mapper, "persist_selectable", None), "info", {})
+            if info.get("bind_key") is None:
+                bind = router.bind_for_request()
+                if bind is not None:
+                    return router.db.get_engine(self.app, bind=bind)
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def note_write(session, flush_context):
+    if has_request_context():
+        g.wrote = True
+    session.info["wrote"] = True
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def remember_committed_write(session):
+    if session.info.pop("wrote", False):
+        router = session.app.extensions.get("replicas")
+        if router is not None:
+            router.remember_write()
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def forget_write(session):
+    session.info.pop("wrote", None)
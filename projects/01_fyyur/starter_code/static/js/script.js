@@ -2,3 +2,34 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// Search boxes with data-typeahead suggest names from /typeahead as you
+// type; data-typeahead="venue" or "artist", or empty for both.
+document.addEventListener('DOMContentLoaded', function () {
+  document.querySelectorAll('input[data-typeahead]').forEach(function (input) {
+    var list = document.getElementById(input.getAttribute('list'));
+    var kind = input.dataset.typeahead;
+    var timer = null;
+    var latest = 0;
+
+    input.addEventListener('input', function () {
+      clearTimeout(timer);
+      timer = setTimeout(function () {
+        var asked = ++latest;
+        var url = '/typeahead?q=' + encodeURIComponent(input.value) + (kind ? '&kind=' + kind : '');
+        fetch(url, { credentials: 'same-origin' })
+          .then(function (response) { return response.ok ? response.json() : {}; })
+          .then(function (found) {
+            if (asked !== latest) { return; }
+            var names = (found.venues || []).concat(found.artists || []);
+            list.innerHTML = '';
+            names.forEach(function (item) {
+              var option = document.createElement('option');
+              option.value = item.name;
+              list.appendChild(option);
+            });
+          });
+      }, 80);
+    });
+  });
+});
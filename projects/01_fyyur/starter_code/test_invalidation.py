@@ -0,0 +1,164 @@
+import os
+import tempfile
+import time
+import unittest
+
+from flask import Flask
+from sqlalchemy import event
+
+from facets import facet_cache
+from invalidation import InvalidationBus, MemoryBackend, bus
+from matchmaking import match_index
+from models import db, Venue
+from nearby import venue_grid
+from replicas import ReplicaRouter
+from typeahead import typeahead
+
+# Venue without the Postgres-only types, enough to commit a rename in SQLite
+VENUE_TABLE = """
+CREATE TABLE "Venue" (
+    id INTEGER PRIMARY KEY, name VARCHAR NOT NULL UNIQUE, city VARCHAR NOT NULL, state VARCHAR NOT NULL,
+    address VARCHAR NOT NULL, phone VARCHAR, image_link VARCHAR, facebook_link VARCHAR, seeking_talent BOOLEAN,
+    seeking_description VARCHAR, website VARCHAR, genres VARCHAR NOT NULL, latitude FLOAT, longitude FLOAT
+)
+"""
+INSERT_VENUE = """
+INSERT INTO "Venue" (id, name, city, state, address, seeking_talent, genres, latitude, longitude)
+VALUES (1, 'The Musical Hop', 'San Francisco', 'CA', '1015 Folsom Street', 1, '{Jazz}', 37.77, -122.41)
+"""
+
+
+class InvalidationTestCase(unittest.TestCase):
+    """Two buses on one MemoryBackend stand in for two workers. The module's
+    bus is the one this worker's session events publish through; the other
+    one delivers to the same caches, as the other worker's copy would."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.app = app = Flask(__name__)
+        app.config.update(
+            SQLALCHEMY_DATABASE_URI="sqlite:///" + os.path.join(self.directory.name, "primary.db"),
+            SQLALCHEMY_REPLICA_URIS=["sqlite:///" + os.path.join(self.directory.name, "replica.db")],
+            SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        )
+        ReplicaRouter(app, db)
+        db.init_app(app)
+        self.context = app.app_context()
+        self.context.push()
+        self.primary = db.get_engine(app)
+        self.replica = db.get_engine(app, bind="replica_0")
+        for engine in (self.primary, self.replica):
+            engine.execute(VENUE_TABLE)
+            engine.execute(INSERT_VENUE)
+
+        self.saved_backend = bus.backend
+        bus.backend = MemoryBackend()
+        bus.backend.start(bus)
+        self.other_worker = InvalidationBus(bus.backend)
+        self.other_worker.subscribers = bus.subscribers
+        self.forget_evictions()
+
+    def tearDown(self):
+        db.session.remove()
+        bus.backend = self.saved_backend
+        self.forget_evictions()
+        venue_grid._built_at = None
+        typeahead.indexes["venue"]._built_at = None
+        self.primary.dispose()
+        self.replica.dispose()
+        self.context.pop()
+        self.directory.cleanup()
+
+    def forget_evictions(self):
+        venue_grid.stale = set()
+        match_index.stale = {"artist": set(), "venue": set()}
+        typeahead.indexes["venue"].stale = set()
+
+    def rename_venue(self):
+        venue = Venue.query.get(1)
+        venue.name = "The Musical Hop Annex"
+        db.session.commit()
+
+    def test_commit_evicts_in_the_other_worker(self):
+        generation = facet_cache._generations["venues"]
+        bus.backend.start(self.other_worker)
+
+        self.rename_venue()
+
+        self.assertEqual(venue_grid.stale, {1})
+        self.assertEqual(match_index.stale["venue"], {1})
+        self.assertEqual(typeahead.indexes["venue"].stale, {1})
+        # once by this worker's own commit, once through the bus
+        self.assertEqual(facet_cache._generations["venues"], generation + 2)
+
+    def test_own_commits_are_not_delivered_back(self):
+        self.rename_venue()
+
+        self.assertEqual(venue_grid.stale, set())
+        self.assertEqual(match_index.stale["venue"], set())
+
+    def test_evicted_ids_are_reloaded_from_the_primary(self):
+        venue_grid.load({1: (37.77, -122.41)})
+        # committed on the primary, not yet replayed on the replica
+        self.primary.execute('UPDATE "Venue" SET latitude = 40.71, longitude = -74.0 WHERE id = 1')
+        venue_grid.evict({1})
+
+        with self.app.test_request_context("/venues/nearby"):
+            found = venue_grid.within(40.71, -74.0, 1)
+
+        self.assertEqual([id for id, distance in found], [1])
+
+    def test_first_build_reads_the_primary_and_keeps_evictions_made_meanwhile(self):
+        self.primary.execute('UPDATE "Venue" SET latitude = 40.71, longitude = -74.0 WHERE id = 1')
+
+        def evict_during_the_query(*args):
+            venue_grid.evict({2})
+
+        event.listen(self.primary, "before_cursor_execute", evict_during_the_query)
+        venue_grid.evict({1})
+        try:
+            with self.app.test_request_context("/venues/nearby"):
+                found = venue_grid.within(40.71, -74.0, 1)
+        finally:
+            event.remove(self.primary, "before_cursor_execute", evict_during_the_query)
+
+        self.assertEqual([id for id, distance in found], [1])
+        self.assertEqual(venue_grid.stale, {2})
+
+    def test_expired_grid_is_rebuilt_in_the_background(self):
+        venue_grid.load({1: (37.77, -122.41)})
+        venue_grid._built_at -= venue_grid.rebuild_seconds + 1
+        self.primary.execute('UPDATE "Venue" SET latitude = 40.71, longitude = -74.0 WHERE id = 1')
+
+        with self.app.test_request_context("/venues/nearby"):
+            # answered from the current grid while the new one loads
+            self.assertEqual([id for id, distance in venue_grid.within(37.77, -122.41, 1)], [1])
+            venue_grid.rebuild_in_background()
+        deadline = time.monotonic() + 5
+        while venue_grid._rebuilding and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(venue_grid.positions, {1: (40.71, -74.0)})
+
+    def test_evicted_names_are_reloaded_from_the_primary(self):
+        names = typeahead.indexes["venue"]
+        names.load({1: "The Musical Hop"})
+        self.primary.execute("""UPDATE "Venue" SET name = 'The Dueling Pianos Bar' WHERE id = 1""")
+        names.evict({1})
+
+        with self.app.test_request_context("/venues/search"):
+            names.refresh()
+
+        self.assertEqual(names.names, {1: "The Dueling Pianos Bar"})
+
+    def test_facets_are_counted_on_the_primary_while_replicas_may_lag(self):
+        facet_cache.invalidate("venues")
+        invalidated_at = facet_cache._invalidated_at["venues"]
+
+        self.assertTrue(facet_cache._replicas_may_lag("venues", invalidated_at + 1))
+        self.assertFalse(facet_cache._replicas_may_lag("venues", invalidated_at + 60))
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from flask import Flask
+from sqlalchemy.exc import OperationalError
+
+from replicas import SESSION_KEY, ReplicaRouter, RoutingSQLAlchemy
+
+db = RoutingSQLAlchemy()
+
+
+class Note(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    text = db.Column(db.String, nullable=False)
+
+
+def unreachable(*args, **kwargs):
+    raise OperationalError("SELECT 1", {}, Exception("connection refused"))
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    """Routes reads between two SQLite files, one standing in for the primary
+    and one for a replica; each holds a note saying which it is."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.app = app = Flask(__name__)
+        app.config.update(
+            SECRET_KEY="test",
+            SQLALCHEMY_DATABASE_URI="sqlite:///" + os.path.join(self.directory.name, "primary.db"),
+            SQLALCHEMY_REPLICA_URIS=["sqlite:///" + os.path.join(self.directory.name, "replica.db")],
+            SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        )
+        self.router = ReplicaRouter(app, db)
+        db.init_app(app)
+
+        with app.app_context():
+            for bind, text in ((None, "primary"), ("replica_0", "replica")):
+                engine = db.get_engine(app, bind=bind)
+                db.Model.metadata.create_all(engine)
+                engine.execute(Note.__table__.insert(), text=text)
+
+        @app.route("/read", methods=["GET", "POST"])
+        def read():
+            return db.session.query(Note.text).order_by(Note.id).first()[0]
+
+        @app.route("/write", methods=["GET", "POST"])
+        def write():
+            db.session.add(Note(text="written"))
+            db.session.flush()
+            seen = db.session.query(Note.text).order_by(Note.id).first()[0]
+            db.session.commit()
+            return seen
+
+        @app.teardown_request
+        def remove_session(exception=None):
+            db.session.remove()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.get_engine(self.app).dispose()
+            db.get_engine(self.app, bind="replica_0").dispose()
+        self.directory.cleanup()
+
+    def test_get_reads_from_the_replica(self):
+        self.assertEqual(self.client.get("/read").data, b"replica")
+
+    def test_post_reads_from_the_primary(self):
+        self.assertEqual(self.client.post("/read").data, b"primary")
+
+    def test_reads_after_a_write_in_the_same_request_go_to_the_primary(self):
+        self.assertEqual(self.client.get("/write").data, b"primary")
+
+    def test_writer_reads_from_the_primary_until_the_replica_may_have_caught_up(self):
+        self.client.post("/write")
+        with self.client.session_transaction() as session:
+            # SQLite has no WAL position: the client waits out the max lag
+            self.assertIn("until", session[SESSION_KEY])
+        self.assertEqual(self.client.get("/read").data, b"primary")
+
+        with self.client.session_transaction() as session:
+            session[SESSION_KEY] = {"until": time.time() - 1}
+        self.assertEqual(self.client.get("/read").data, b"replica")
+
+    def test_unreachable_replica_is_skipped(self):
+        with mock.patch("replicas.replay_state", unreachable):
+            self.assertEqual(self.client.get("/read").data, b"primary")
+        self.assertFalse(self.router.replicas[0].healthy)
+
+    def test_unreachable_primary_leaves_the_replicas_serving(self):
+        with mock.patch("replicas.current_position", unreachable):
+            self.assertEqual(self.client.get("/read").data, b"replica")
+            checked_at = self.router._checked_at
+            self.assertIsNotNone(checked_at)
+            # not retried on every request
+            self.client.get("/read")
+            self.assertEqual(self.router._checked_at, checked_at)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,361 @@
+import logging
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from heapq import merge
+from itertools import chain, takewhile
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from invalidation import bus
+from models import Artist, Venue
+from replicas import primary_reads
+
+# ----------------------------------------------------------------------------#
+# Typeahead.
+#
+# Venue and artist names are kept in memory as sorted keys: each name folded
+# (lower case, no accents or punctuation), and again from each later word on,
+# so "mus" finds "Park Square Live Music & Coffee". A prefix is then two
+# bisections, and suggestions come out in order: names starting with the
+# prefix first, then names with a word starting with it.
+#
+# Committed changes go into a small sorted delta, and replaced or deleted
+# names are hidden, until MERGE_AT keys have built up and a background
+# thread merges them into the main keys. Names other workers change arrive
+# through the invalidation bus and are reloaded on the next query. In case
+# a notification was missed, everything is reloaded every REBUILD_SECONDS,
+# in the background while the current keys keep answering.
+#
+# Each client's last prefix is remembered, with where its matches lie in the
+# main keys. While the client keeps typing, each longer prefix is only
+# searched for within those bounds.
+# ----------------------------------------------------------------------------#
+
+# merging or reloading a million names stalls the worker for a moment
+# (the old keys are freed, the new ones checked once by the garbage
+# collector), so neither happens often
+MERGE_AT = 10000
+REBUILD_SECONDS = 60 * 60
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+# names past this many words aren't found by their later words
+MAX_WORDS = 8
+# clients whose last prefix is remembered, per worker
+MAX_SESSIONS = 10000
+WORD = re.compile(r"\w+")
+# sorts after any key that starts with the prefix before it
+HIGHEST = "\U0010ffff"
+
+log = logging.getLogger(__name__)
+
+
+def fold(text):
+    # "Guns N' Pétals" -> "guns n petals"
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+    return " ".join(WORD.findall(text))
+
+
+def query_key(text):
+    # a trailing space asks for the next word: "guns " finds "guns n petals"
+    # but not "gunsmith"
+    key = fold(text)
+    return key + " " if key and text[-1:].isspace() else key
+
+
+def name_keys(name):
+    # (the whole folded name, the rest of it from each later word)
+    words = fold(name).split(" ")[:MAX_WORDS]
+    if words == [""]:
+        return None, []
+    return " ".join(words), [" ".join(words[start:]) for start in range(1, len(words))]
+
+
+class SortedKeys:
+    def __init__(self, pairs=()):
+        # pairs: (key, id), sorted. A tuple of strings and an array aren't
+        # containers the garbage collector keeps walking: a list of a
+        # million keys would be scanned, one cache miss per key, on every
+        # full collection.
+        pairs = list(pairs)
+        self.keys = tuple(key for key, _ in pairs)
+        self.ids = array("q", (id for _, id in pairs))
+
+    def bounds(self, prefix, lo=0, hi=None):
+        hi = len(self.keys) if hi is None else hi
+        return bisect_left(self.keys, prefix, lo, hi), bisect_left(self.keys, prefix + HIGHEST, lo, hi)
+
+    def pairs(self, lo=0, hi=None, hidden=()):
+        hi = len(self.keys) if hi is None else hi
+        return ((self.keys[at], self.ids[at]) for at in range(lo, hi) if self.ids[at] not in hidden)
+
+    def merged(self, added, hidden):
+        return SortedKeys(list(merge(self.pairs(hidden=hidden), added)))
+
+
+class NameIndex:
+    def __init__(self, model, merge_at=MERGE_AT, rebuild_seconds=REBUILD_SECONDS, clock=time.monotonic):
+        self.model = model
+        self.merge_at = merge_at
+        self.rebuild_seconds = rebuild_seconds
+        self.clock = clock
+        self.names = {}
+        self.starts = SortedKeys()
+        self.words = SortedKeys()
+        # changes since the last merge: sorted (key, id) pairs, the ids they
+        # belong to, and ids whose entries in the main keys no longer count
+        self.added_starts = []
+        self.added_words = []
+        self.added_ids = set()
+        self.hidden = set()
+        # bumped whenever the main keys are replaced, which moves the bounds
+        self.version = 0
+        self.stale = set()
+        self._lock = threading.RLock()
+        self._built_at = None
+        self._rebuilding = False
+        # changes committed while a rebuild reads the names
+        self._replay = None
+        # ids changed while a merge builds the new keys
+        self._changed = None
+
+    def rebuild(self):
+        with self._lock:
+            self._replay = []
+        try:
+            names = dict(self.model.query.with_entities(self.model.id, self.model.name))
+        except BaseException:
+            with self._lock:
+                self._replay = None
+            raise
+        self.load(names)
+
+    def rebuild_in_background(self):
+        # the current keys keep answering while the new ones are built
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        app = current_app._get_current_object()
+
+        def run():
+            try:
+                with app.app_context():
+                    self.rebuild()
+            except Exception:
+                log.exception("rebuilding the %s typeahead failed", self.model.__name__)
+            finally:
+                self._rebuilding = False
+
+        threading.Thread(target=run, name="typeahead-rebuild", daemon=True).start()
+
+    def load(self, names):
+        # names: {id: name}
+        starts, words = [], []
+        for id, name in names.items():
+            start, later = name_keys(name or "")
+            if start is not None:
+                starts.append((start, id))
+                words.extend((key, id) for key in later)
+        starts.sort()
+        words.sort()
+        with self._lock:
+            self.names = {id: name for id, name in names.items() if name}
+            self.starts, self.words = SortedKeys(starts), SortedKeys(words)
+            self.added_starts, self.added_words, self.added_ids, self.hidden = [], [], set(), set()
+            self.version += 1
+            self._built_at = self.clock()
+            replay, self._replay = self._replay, None
+            if replay:
+                self.apply(replay)
+
+    def apply(self, changes):
+        # changes: (id, name, or None when deleted)
+        with self._lock:
+            if self._replay is not None:
+                self._replay.extend(changes)
+            if self._built_at is None:
+                # nothing to patch: the first query loads everything
+                return
+            for id, name in changes:
+                if self.names.get(id) == name:
+                    continue
+                if self._changed is not None:
+                    self._changed.add(id)
+                self._remove(id)
+                if name:
+                    self._add(id, name)
+            pending = len(self.added_starts) + len(self.added_words) + len(self.hidden)
+            if self._changed is None and pending > self.merge_at:
+                self._changed = set()
+                threading.Thread(target=self.merge, name="typeahead-merge", daemon=True).start()
+
+    def _remove(self, id):
+        if self.names.pop(id, None) is None:
+            return
+        self.hidden.add(id)
+        if id in self.added_ids:
+            self.added_ids.discard(id)
+            self.added_starts = [pair for pair in self.added_starts if pair[1] != id]
+            self.added_words = [pair for pair in self.added_words if pair[1] != id]
+
+    def _add(self, id, name):
+        start, later = name_keys(name)
+        if start is None:
+            return
+        self.names[id] = name
+        self.added_ids.add(id)
+        insort(self.added_starts, (start, id))
+        for key in later:
+            insort(self.added_words, (key, id))
+
+    def merge(self):
+        # builds the merged keys from a copy, without holding the lock, then
+        # swaps them in; what changed meanwhile goes back into the delta
+        with self._lock:
+            if self._changed is None:
+                self._changed = set()
+            starts, words = self.starts, self.words
+            added_starts, added_words, hidden = list(self.added_starts), list(self.added_words), set(self.hidden)
+        try:
+            merged_starts, merged_words = starts.merged(added_starts, hidden), words.merged(added_words, hidden)
+            with self._lock:
+                if self.starts is not starts:
+                    # reloaded in the meantime
+                    return
+                changed = self._changed
+                self.starts, self.words = merged_starts, merged_words
+                self.added_starts, self.added_words, self.added_ids, self.hidden = [], [], set(), set()
+                self.version += 1
+                for id in changed:
+                    name = self.names.pop(id, None)
+                    self.hidden.add(id)
+                    if name:
+                        self._add(id, name)
+        finally:
+            with self._lock:
+                self._changed = None
+
+    def evict(self, ids):
+        # called from the invalidation bus; None means any name may have
+        # changed
+        with self._lock:
+            if ids is None:
+                self._built_at = None
+            else:
+                self.stale |= ids
+
+    def refresh(self):
+        with self._lock:
+            stale, self.stale = self.stale, set()
+        with primary_reads():
+            query = self.model.query.filter(self.model.id.in_(stale))
+            found = dict(query.with_entities(self.model.id, self.model.name))
+        self.apply([(id, found.get(id)) for id in stale])
+
+    def ensure_fresh(self):
+        built_at = self._built_at
+        if built_at is None:
+            self.rebuild()
+            return
+        if self.clock() - built_at > self.rebuild_seconds:
+            self.rebuild_in_background()
+        if self.stale:
+            self.refresh()
+
+    def search(self, prefix, limit=DEFAULT_LIMIT, within=None):
+        # -> ([(id, name)], where the matches lie); within: what an earlier
+        # search for a shorter prefix of this one returned
+        found = {}
+        with self._lock:
+            if within is not None and within[0] == self.version:
+                starts, words = within[1]
+            else:
+                starts = words = (0, None)
+            bounds = (self.starts.bounds(prefix, *starts), self.words.bounds(prefix, *words))
+            for keys, added, (lo, hi) in (
+                (self.starts, self.added_starts, bounds[0]),
+                (self.words, self.added_words, bounds[1]),
+            ):
+                recent = takewhile(lambda pair: pair[0].startswith(prefix), added[bisect_left(added, (prefix,)) :])
+                for key, id in merge(keys.pairs(lo, hi, self.hidden), recent):
+                    if id not in found:
+                        found[id] = self.names[id]
+                        if len(found) >= limit:
+                            return list(found.items()), (self.version, bounds)
+            return list(found.items()), (self.version, bounds)
+
+
+class Typeahead:
+    def __init__(self, max_sessions=MAX_SESSIONS, **options):
+        self.indexes = {"venue": NameIndex(Venue, **options), "artist": NameIndex(Artist, **options)}
+        self.max_sessions = max_sessions
+        # client: {kind: (prefix, what the index's search returned for it)}
+        self.sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def suggest(self, kind, text, client=None, limit=DEFAULT_LIMIT):
+        index = self.indexes[kind]
+        prefix = query_key(text)
+        if not prefix:
+            return []
+        index.ensure_fresh()
+        within = None
+        if client:
+            with self._lock:
+                previous = self.sessions.get(client, {}).get(kind)
+            if previous is not None and prefix.startswith(previous[0]):
+                within = previous[1]
+        found, where = index.search(prefix, limit, within)
+        if client:
+            with self._lock:
+                self.sessions.setdefault(client, {})[kind] = (prefix, where)
+                self.sessions.move_to_end(client)
+                while len(self.sessions) > self.max_sessions:
+                    self.sessions.popitem(last=False)
+        return found
+
+
+typeahead = Typeahead()
+bus.subscribe("venue", typeahead.indexes["venue"].evict)
+bus.subscribe("artist", typeahead.indexes["artist"].evict)
+
+# ----------------------------------------------------------------------------#
+# Change tracking.
+# ----------------------------------------------------------------------------#
+
+KINDS = {Venue: "venue", Artist: "artist"}
+
+
+@event.listens_for(Session, "after_flush")
+def note_name_changes(session, flush_context):
+    changes = []
+    for instance in chain(session.new, session.dirty, session.deleted):
+        kind = KINDS.get(type(instance))
+        if kind is not None:
+            changes.append((kind, instance.id, None if instance in session.deleted else instance.name))
+    if changes:
+        session.info.setdefault("typeahead_names", []).extend(changes)
+
+
+@event.listens_for(Session, "after_commit")
+def update_typeahead(session):
+    changes = session.info.pop("typeahead_names", None)
+    if not changes:
+        return
+    for kind, index in typeahead.indexes.items():
+        mine = [(id, name) for changed_kind, id, name in changes if changed_kind == kind]
+        if mine:
+            index.apply(mine)
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_name_changes(session):
+    session.info.pop("typeahead_names", None)
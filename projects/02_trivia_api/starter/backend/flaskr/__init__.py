@@ -1,45 +1,112 @@
-import os
-from flask import Flask, request, abort, jsonify
-from flask_sqlalchemy import SQLAlchemy
+import io
+from flask import Flask, request, abort, jsonify, Response, stream_with_context
 from flask_cors import CORS
-import random
 
-from models import setup_db, Question, Category
+from models import setup_db, Question, category_registry
+from question_packs import read_pack, import_questions, export_questions, register_commands
 
 QUESTIONS_PER_PAGE = 10
 
+def paginate_questions(request, selection):
+  page = request.args.get('page', 1, type=int)
+  start = (page - 1) * QUESTIONS_PER_PAGE
+  end = start + QUESTIONS_PER_PAGE
+
+  return [question.format() for question in selection[start:end]]
+
 def create_app(test_config=None):
   # create and configure the app
   app = Flask(__name__)
-  setup_db(app)
-  
+  if test_config is None:
+    setup_db(app)
+  else:
+    setup_db(app, test_config['database_path'])
+  # warm the category registry so the first page view does not pay for it
+  category_registry.load()
+
+  register_commands(app)
+
+  CORS(app, resources={r"/*": {"origins": "*"}}, expose_headers=['ETag'])
+
+  @app.after_request
+  def after_request(response):
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,If-None-Match')
+    response.headers.add('Access-Control-Allow-Methods', 'GET,POST,PATCH,DELETE,OPTIONS')
+    return response
+
   '''
-  @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
+  GET /categories
+    served from the in-process category registry, never from the database.
+    the response carries an ETag; a client sending a matching If-None-Match
+    gets an empty 304 back.
   '''
+  @app.route('/categories')
+  def retrieve_categories():
+    response = jsonify({
+      'success': True,
+      'categories': category_registry.all()
+    })
+    response.set_etag(category_registry.etag())
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
   '''
-  @TODO: Use the after_request decorator to set Access-Control-Allow
+  GET /questions?page=<page>
+    ten questions per page, along with the total number of questions
+    and the category map from the registry.
   '''
+  @app.route('/questions')
+  def retrieve_questions():
+    selection = Question.query.order_by(Question.id).all()
+    current_questions = paginate_questions(request, selection)
+
+    if len(current_questions) == 0:
+      abort(404)
+
+    return jsonify({
+      'success': True,
+      'questions': current_questions,
+      'total_questions': len(selection),
+      'current_category': None,
+      'categories': category_registry.all()
+    })
 
   '''
-  @TODO: 
-  Create an endpoint to handle GET requests 
-  for all available categories.
+  POST /questions/import
+    streams a question pack into the bank. the body is read as CSV when
+    sent as text/csv and as JSON (an array or one object per line) otherwise.
+    rows are validated and de-duplicated, then inserted in batches.
+    a pack that breaks off partway, e.g. a JSON array with a broken element,
+    keeps the batches before the break: the response says how many were
+    inserted, with complete set to false and the reason in errors.
   '''
+  @app.route('/questions/import', methods=['POST'])
+  def import_question_pack():
+    pack_format = 'csv' if request.mimetype == 'text/csv' else 'json'
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8')
 
+    try:
+      summary = import_questions(read_pack(stream, pack_format))
+    except ValueError:
+      abort(400)
 
-  '''
-  @TODO: 
-  Create an endpoint to handle GET requests for questions, 
-  including pagination (every 10 questions). 
-  This endpoint should return a list of questions, 
-  number of total questions, current category, categories. 
+    if summary['rejected'] and not summary['inserted'] and not summary['duplicates']:
+      return jsonify({'success': False, 'error': 422, 'message': 'unprocessable', **summary}), 422
 
-  TEST: At this point, when you start the application
-  you should see questions and categories generated,
-  ten questions per page and pagination at the bottom of the screen for three pages.
-  Clicking on the page numbers should update the questions. 
+    return jsonify({'success': True, **summary})
+
+  '''
+  GET /questions/export?format=<json|csv>
+    streams every question out as a pack /questions/import can read back
   '''
+  @app.route('/questions/export')
+  def export_question_pack():
+    pack_format = request.args.get('format', 'json')
+    if pack_format not in ('json', 'csv'):
+      abort(400)
+
+    mimetype = 'text/csv' if pack_format == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(export_questions(pack_format)), mimetype=mimetype)
 
   '''
   @TODO: 
@@ -72,13 +139,24 @@ def create_app(test_config=None):
   '''
 
   '''
-  @TODO: 
-  Create a GET endpoint to get questions based on category. 
-
-  TEST: In the "List" tab / main screen, clicking on one of the 
-  categories in the left column will cause only questions of that 
-  category to be shown. 
+  GET /categories/<category_id>/questions
+    every question in the given category; unknown categories are
+    rejected from the registry without touching the database.
   '''
+  @app.route('/categories/<int:category_id>/questions')
+  def retrieve_questions_by_category(category_id):
+    if category_registry.get(category_id) is None:
+      abort(404)
+
+    selection = Question.query.filter(
+      Question.category == str(category_id)).order_by(Question.id).all()
+
+    return jsonify({
+      'success': True,
+      'questions': [question.format() for question in selection],
+      'total_questions': len(selection),
+      'current_category': category_id
+    })
 
 
   '''
@@ -93,12 +171,30 @@ def create_app(test_config=None):
   and shown whether they were correct or not. 
   '''
 
-  '''
-  @TODO: 
-  Create error handlers for all expected errors 
-  including 404 and 422. 
-  '''
-  
+  @app.errorhandler(404)
+  def not_found(error):
+    return jsonify({
+      'success': False,
+      'error': 404,
+      'message': 'resource not found'
+    }), 404
+
+  @app.errorhandler(422)
+  def unprocessable(error):
+    return jsonify({
+      'success': False,
+      'error': 422,
+      'message': 'unprocessable'
+    }), 422
+
+  @app.errorhandler(400)
+  def bad_request(error):
+    return jsonify({
+      'success': False,
+      'error': 400,
+      'message': 'bad request'
+    }), 400
+
   return app
 
     
\ No newline at end of file
@@ -1,5 +1,9 @@
-import os
-from sqlalchemy import Column, String, Integer, create_engine
+import threading
+import hashlib
+import time
+from itertools import chain
+from sqlalchemy import Column, String, Integer, event
+from sqlalchemy.orm import Session
 from flask_sqlalchemy import SQLAlchemy
 import json
 
@@ -18,6 +22,9 @@ def setup_db(app, database_path=database_path):
     db.app = app
     db.init_app(app)
     db.create_all()
+    seed_category_version()
+    # the database may have changed underneath us, drop anything cached
+    category_registry.invalidate()
 
 '''
 Question
@@ -71,8 +78,142 @@ class Category(db.Model):
   def __init__(self, type):
     self.type = type
 
+  def insert(self):
+    db.session.add(self)
+    db.session.commit()
+
+  def update(self):
+    db.session.commit()
+
+  def delete(self):
+    db.session.delete(self)
+    db.session.commit()
+
   def format(self):
     return {
       'id': self.id,
       'type': self.type
-    }
\ No newline at end of file
+    }
+
+'''
+CategoryVersion
+    a single row counting the changes to the categories table, bumped in
+    the same transaction as each change, so every worker can tell with one
+    primary key lookup whether its registry is current
+'''
+class CategoryVersion(db.Model):
+  __tablename__ = 'category_version'
+
+  id = Column(Integer, primary_key=True)
+  version = Column(Integer, nullable=False)
+
+def seed_category_version():
+  if db.session.query(CategoryVersion.id).filter(CategoryVersion.id == 1).scalar() is None:
+    db.session.add(CategoryVersion(id=1, version=0))
+  db.session.commit()
+
+def shared_category_version():
+  return db.session.query(CategoryVersion.version).filter(CategoryVersion.id == 1).scalar()
+
+'''
+CategoryRegistry
+    in-process copy of the categories table
+    categories almost never change, so they are read once and then served
+    from memory. every committed (or rolled back) change to a Category in
+    this process bumps `version`, which makes the next read reload the
+    table. changes made by other workers are seen through CategoryVersion,
+    checked at most every `check_seconds`, so a page view rarely pays for
+    even that one lookup.
+'''
+class CategoryRegistry:
+
+  CHECK_SECONDS = 2
+
+  def __init__(self, check_seconds=CHECK_SECONDS, clock=time.monotonic):
+    self.check_seconds = check_seconds
+    self.clock = clock
+    self.version = 0
+    self._loaded_version = None
+    self._shared_version = None
+    self._checked_at = None
+    self._categories = {}
+    self._etag = None
+    self._lock = threading.Lock()
+
+  def invalidate(self):
+    with self._lock:
+      self.version += 1
+
+  def load(self):
+    with self._lock:
+      version = self.version
+    # read first, so the categories are at least as new as the version
+    shared_version = shared_category_version()
+    categories = {
+      category.id: category.type
+      for category in Category.query.order_by(Category.id).all()
+    }
+    body = json.dumps(categories, sort_keys=True).encode('utf-8')
+    etag = hashlib.sha1(body).hexdigest()
+    with self._lock:
+      self._categories = categories
+      self._etag = etag
+      self._loaded_version = version
+      self._shared_version = shared_version
+      self._checked_at = self.clock()
+
+  def _ensure_loaded(self):
+    if self._loaded_version != self.version:
+      self.load()
+      return
+    now = self.clock()
+    if now - self._checked_at >= self.check_seconds:
+      self._checked_at = now
+      if shared_category_version() != self._shared_version:
+        self.load()
+
+  def all(self):
+    '''
+    returns a copy of the {id: type} map of every category, so callers
+    can't change the shared one
+    '''
+    self._ensure_loaded()
+    return dict(self._categories)
+
+  def get(self, category_id):
+    self._ensure_loaded()
+    return self._categories.get(category_id)
+
+  def etag(self):
+    '''
+    returns a strong validator for the current category map
+    '''
+    self._ensure_loaded()
+    return self._etag
+
+
+category_registry = CategoryRegistry()
+
+
+def _note_category_changes(session, flush_context):
+  # flushed is not committed: remember the change until the transaction
+  # ends, and bump the shared version in the same transaction
+  if any(isinstance(instance, Category)
+         for instance in chain(session.new, session.dirty, session.deleted)):
+    session.info['categories_changed'] = True
+    session.connection().execute(
+      CategoryVersion.__table__.update().values(version=CategoryVersion.version + 1))
+
+def _category_changes_committed(session):
+  if session.info.pop('categories_changed', False):
+    category_registry.invalidate()
+
+def _category_changes_rolled_back(session):
+  # a reload between the flush and the rollback may have cached the
+  # discarded rows
+  if session.info.pop('categories_changed', False):
+    category_registry.invalidate()
+
+event.listen(Session, 'after_flush', _note_category_changes)
+event.listen(Session, 'after_commit', _category_changes_committed)
+event.listen(Session, 'after_rollback', _category_changes_rolled_back)
@@ -0,0 +1,305 @@
+import csv
+import io
+import json
+import re
+
+import click
+
+from models import db, Question, category_registry
+
+PACK_FIELDS = ['question', 'answer', 'category', 'difficulty']
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 5
+BATCH_SIZE = 1000
+# only the first few problems are reported back, a bad 50k pack should
+# not produce a 50k line response
+MAX_REPORTED_ERRORS = 100
+# a JSON array pack is decoded this many characters at a time
+ARRAY_CHUNK_SIZE = 64 * 1024
+# an array element this long without decoding is taken to be broken
+MAX_ARRAY_ELEMENT_SIZE = 1024 * 1024
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+'''
+normalize_question(text)
+    the key used to spot duplicate questions: case-folded with
+    runs of whitespace collapsed
+'''
+def normalize_question(text):
+  return ' '.join(text.casefold().split())
+
+'''
+read_pack(stream, pack_format)
+    yields one dict per question from a text stream, reading it as it goes
+    'json' accepts either a JSON array or one JSON object per line,
+    'csv' expects a header row naming the PACK_FIELDS
+    a leading byte order mark and blank lines are skipped
+    a line that is not valid JSON, or a CSV line that cannot be parsed, is
+    yielded as a MalformedEntry, so it is rejected like any other bad row
+    and the rest of the pack still imports. when the pack cannot be read
+    any further (a broken JSON array, bytes that are not UTF-8) the last
+    entry is a fatal MalformedEntry and reading stops there
+'''
+def read_pack(stream, pack_format='json'):
+  if pack_format not in ('json', 'csv'):
+    raise ValueError('unknown question pack format: {}'.format(pack_format))
+
+  try:
+    line_number, first_line = 1, stream.readline()
+    if first_line.startswith('\ufeff'):
+      first_line = first_line[1:]
+
+    if pack_format == 'csv':
+      yield from _csv_rows(_chain_lines(first_line, stream))
+      return
+
+    while first_line and not first_line.strip():
+      line_number, first_line = line_number + 1, stream.readline()
+    if first_line.lstrip().startswith('['):
+      yield from _array_items(stream, first_line.lstrip())
+      return
+
+    for line_number, line in enumerate(_chain_lines(first_line, stream), start=line_number):
+      if not line.strip():
+        continue
+      try:
+        yield json.loads(line)
+      except ValueError as error:
+        yield MalformedEntry('line {} is not valid JSON and was skipped: {}'.format(line_number, error))
+  except ValueError as error:
+    yield MalformedEntry('the rest of the pack could not be read: {}'.format(error), fatal=True)
+
+def _chain_lines(first_line, stream):
+  yield first_line
+  yield from stream
+
+def _csv_rows(lines):
+  reader = csv.DictReader(lines)
+  while True:
+    try:
+      row = next(reader)
+    except StopIteration:
+      return
+    except csv.Error as error:
+      # the reader has consumed the bad line and carries on after it
+      yield MalformedEntry('not valid CSV and was skipped: {}'.format(error))
+      continue
+    yield row
+
+'''
+_array_items(stream, text)
+    yields the elements of a JSON array one at a time, reading the stream
+    ARRAY_CHUNK_SIZE characters at a time after text, which starts at the
+    opening bracket. only the element being decoded is held in memory.
+    raises ValueError when the array is malformed
+'''
+def _array_items(stream, text):
+  decoder = json.JSONDecoder()
+  buffer, position, exhausted = text, 1, False
+  # 'first': an element or ']', 'item': an element, 'next': ',' or ']'
+  expecting = 'first'
+  number = 0
+
+  while True:
+    position = _WHITESPACE.match(buffer, position).end()
+    if position == len(buffer) and not exhausted:
+      buffer, position, exhausted = _read_more(stream, buffer, position)
+      continue
+    char = buffer[position:position + 1]
+    if not char:
+      raise ValueError('the JSON array is not closed')
+
+    if expecting == 'next' or (expecting == 'first' and char == ']'):
+      if char == ']':
+        return
+      if char != ',':
+        raise ValueError('expected "," or "]" after element {} of the JSON array'.format(number))
+      position, expecting = position + 1, 'item'
+      continue
+
+    try:
+      item, end = decoder.raw_decode(buffer, position)
+    except ValueError as error:
+      item, end = error, None
+    # a value running to the end of what has been read may continue in the
+    # next chunk, e.g. a number cut in two
+    if end is None or (end == len(buffer) and not exhausted):
+      if exhausted or len(buffer) - position > MAX_ARRAY_ELEMENT_SIZE:
+        raise ValueError('element {} of the JSON array is not valid JSON: {}'.format(number + 1, item))
+      buffer, position, exhausted = _read_more(stream, buffer, position)
+      continue
+
+    number += 1
+    yield item
+    position, expecting = end, 'next'
+
+def _read_more(stream, buffer, position):
+  chunk = stream.read(ARRAY_CHUNK_SIZE)
+  return buffer[position:] + chunk, 0, not chunk
+
+class MalformedEntry:
+
+  def __init__(self, message, fatal=False):
+    self.message = message
+    self.fatal = fatal
+
+'''
+validate_row(row, categories)
+    returns (mapping, error) for one pack entry
+    categories is the set of known category ids, so validation
+    never goes back to the database
+'''
+def validate_row(row, categories):
+  if isinstance(row, MalformedEntry):
+    return None, row.message
+  if not isinstance(row, dict):
+    return None, 'entry is not an object'
+
+  question = row.get('question') or ''
+  answer = row.get('answer') or ''
+  if not isinstance(question, str) or not isinstance(answer, str):
+    return None, 'question and answer must be text'
+  question, answer = question.strip(), answer.strip()
+  if not question or not answer:
+    return None, 'question and answer are required'
+
+  try:
+    difficulty = int(row.get('difficulty'))
+  except (TypeError, ValueError):
+    return None, 'difficulty must be an integer'
+  if not MIN_DIFFICULTY <= difficulty <= MAX_DIFFICULTY:
+    return None, 'difficulty must be between {} and {}'.format(MIN_DIFFICULTY, MAX_DIFFICULTY)
+
+  try:
+    category = int(row.get('category'))
+  except (TypeError, ValueError):
+    return None, 'category must be a category id'
+  if category not in categories:
+    return None, 'unknown category {}'.format(category)
+
+  return {
+    'question': question,
+    'answer': answer,
+    'category': str(category),
+    'difficulty': difficulty
+  }, None
+
+'''
+import_questions(rows, batch_size)
+    validates, de-duplicates and inserts question pack entries
+    rows are inserted with bulk_insert_mappings and committed once per
+    batch_size rows. duplicates are found against an in-memory set of the
+    normalized text of every question already in the bank and in the pack.
+    returns a summary of inserted, duplicate and rejected rows. when the
+    pack could not be read to the end, complete is False; the batches
+    committed before that point stay in the bank and are counted in inserted
+'''
+def import_questions(rows, batch_size=BATCH_SIZE):
+  categories = set(category_registry.all())
+  seen = {
+    normalize_question(text)
+    for (text,) in db.session.query(Question.question)
+    if text
+  }
+  summary = {'inserted': 0, 'duplicates': 0, 'rejected': 0, 'errors': [], 'complete': True}
+  batch = []
+
+  for number, row in enumerate(rows, start=1):
+    mapping, error = validate_row(row, categories)
+    if error:
+      summary['rejected'] += 1
+      if len(summary['errors']) < MAX_REPORTED_ERRORS or getattr(row, 'fatal', False):
+        summary['errors'].append({'row': number, 'message': error})
+      if getattr(row, 'fatal', False):
+        summary['complete'] = False
+        break
+      continue
+
+    key = normalize_question(mapping['question'])
+    if key in seen:
+      summary['duplicates'] += 1
+      continue
+    seen.add(key)
+
+    batch.append(mapping)
+    if len(batch) >= batch_size:
+      _insert_batch(batch)
+      summary['inserted'] += len(batch)
+      batch = []
+
+  if batch:
+    _insert_batch(batch)
+    summary['inserted'] += len(batch)
+
+  return summary
+
+def _insert_batch(batch):
+  try:
+    db.session.bulk_insert_mappings(Question, batch)
+    db.session.commit()
+  except Exception:
+    db.session.rollback()
+    raise
+
+'''
+export_questions(pack_format, batch_size)
+    yields the whole question bank as chunks of text in a format
+    read_pack understands ('json' is written one object per line)
+'''
+def export_questions(pack_format='json', batch_size=BATCH_SIZE):
+  if pack_format not in ('json', 'csv'):
+    raise ValueError('unknown question pack format: {}'.format(pack_format))
+
+  query = db.session.query(
+    Question.question, Question.answer, Question.category, Question.difficulty
+  ).order_by(Question.id).yield_per(batch_size)
+
+  if pack_format == 'json':
+    for row in query:
+      yield json.dumps(dict(zip(PACK_FIELDS, row))) + '\n'
+    return
+
+  buffer = io.StringIO()
+  writer = csv.writer(buffer)
+  writer.writerow(PACK_FIELDS)
+  for row in query:
+    writer.writerow(row)
+    if buffer.tell() > 64 * 1024:
+      yield buffer.getvalue()
+      buffer.seek(0)
+      buffer.truncate()
+  yield buffer.getvalue()
+
+'''
+register_commands(app)
+    flask import-questions <pack> / flask export-questions <pack>
+'''
+def register_commands(app):
+
+  @app.cli.command('import-questions')
+  @click.argument('pack', type=click.File('r', encoding='utf-8'))
+  @click.option('--format', 'pack_format', type=click.Choice(['json', 'csv']), default=None,
+                help='Pack format, guessed from the file extension when omitted.')
+  @click.option('--batch-size', default=BATCH_SIZE, show_default=True)
+  def import_questions_command(pack, pack_format, batch_size):
+    '''Load a JSON or CSV question pack into the question bank.'''
+    pack_format = pack_format or _format_from_name(pack.name)
+    summary = import_questions(read_pack(pack, pack_format), batch_size)
+    for error in summary['errors']:
+      click.echo('row {row}: {message}'.format(**error), err=True)
+    click.echo('{inserted} inserted, {duplicates} duplicates, {rejected} rejected'.format(**summary))
+    if not summary['complete']:
+      click.echo('The pack could not be read to the end, the rows after the last error were not imported.', err=True)
+
+  @app.cli.command('export-questions')
+  @click.argument('pack', type=click.File('w', encoding='utf-8'))
+  @click.option('--format', 'pack_format', type=click.Choice(['json', 'csv']), default=None,
+                help='Pack format, guessed from the file extension when omitted.')
+  def export_questions_command(pack, pack_format):
+    '''Write the question bank out as a JSON or CSV question pack.'''
+    pack_format = pack_format or _format_from_name(pack.name)
+    for chunk in export_questions(pack_format):
+      pack.write(chunk)
+
+def _format_from_name(name):
+  return 'csv' if name.lower().endswith('.csv') else 'json'
@@ -1,39 +1,318 @@
+import io
 import os
+import re
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import scoped_session
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from models import Question, Category, CategoryRegistry, category_registry, db
+
+SEED_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'trivia.psql')
+COPY_BLOCK = re.compile(r'^COPY public\.(\w+) \(([^)]*)\) FROM stdin;\n(.*?)^\\\.$', re.M | re.S)
+
+
+def worker_database_name():
+    """Each pytest-xdist worker (PYTEST_XDIST_WORKER=gw0, gw1, ...) gets its own database"""
+    worker = os.environ.get('PYTEST_XDIST_WORKER')
+    return 'trivia_test_{}'.format(worker) if worker else 'trivia_test'
+
+
+def database_path_for(database_name):
+    return "postgres://{}/{}".format('localhost:5432', database_name)
+
+
+def create_database_if_missing(database_name):
+    engine = create_engine(database_path_for('postgres'), isolation_level='AUTOCOMMIT')
+    with engine.connect() as connection:
+        exists = connection.execute(
+            text('SELECT 1 FROM pg_database WHERE datname = :name'), name=database_name).scalar()
+        if not exists:
+            connection.execute('CREATE DATABASE "{}"'.format(database_name))
+    engine.dispose()
+
+
+def load_seed_data():
+    """Replaces the tables' contents with the rows in trivia.psql, using one COPY per table"""
+    with open(SEED_FILE, encoding='utf-8') as seed_file:
+        blocks = COPY_BLOCK.findall(seed_file.read())
+
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute('TRUNCATE questions, categories RESTART IDENTITY')
+        for table, columns, rows in blocks:
+            cursor.copy_expert('COPY {} ({}) FROM STDIN'.format(table, columns), io.StringIO(rows))
+            cursor.execute(
+                "SELECT setval(pg_get_serial_sequence('{0}', 'id'), (SELECT max(id) FROM {0}))".format(table))
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def setUpModule():
+    """Creates the schema and loads the seed data once for the whole test run"""
+    global app
+    database_name = worker_database_name()
+    create_database_if_missing(database_name)
+    app = create_app({'database_path': database_path_for(database_name)})
+    with app.app_context():
+        load_seed_data()
+        category_registry.invalidate()
 
 
 class TriviaTestCase(unittest.TestCase):
-    """This class represents the trivia test case"""
+    """This class represents the trivia test case
+
+    Every test runs inside a transaction that is rolled back in tearDown.
+    The app's session works inside a SAVEPOINT that is restarted whenever
+    the code under test commits or rolls back, so commit() and rollback()
+    behave normally while nothing reaches the seed data.
+    """
 
     def setUp(self):
-        """Define test variables and initialize app."""
-        self.app = create_app()
+        """Define test variables and open the per-test transaction."""
+        self.app = app
         self.client = self.app.test_client
-        self.database_name = "trivia_test"
-        self.database_path = "postgres://{}/{}".format('localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
-
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
-    
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        self.connection = db.engine.connect()
+        self.transaction = self.connection.begin()
+        make_session = db.create_session({'bind': self.connection, 'binds': {}})
+
+        def restart_savepoint(session, transaction):
+            if transaction.nested and not transaction._parent.nested:
+                session.expire_all()
+                session.begin_nested()
+
+        def session_factory():
+            session = make_session()
+            session.begin_nested()
+            event.listen(session, 'after_transaction_end', restart_savepoint)
+            return session
+
+        self.app_session = db.session
+        db.session = scoped_session(session_factory)
+
     def tearDown(self):
         """Executed after reach test"""
-        pass
+        db.session.remove()
+        db.session = self.app_session
+        self.transaction.rollback()
+        self.connection.close()
+        self.app_context.pop()
+        # the registry may have cached categories the rollback just discarded
+        category_registry.invalidate()
 
     """
     TODO
     Write at least one test for each test for successful operation and for expected errors.
     """
 
+    def count_statements(self, fn):
+        """Runs fn and returns the SQL statements it sent to the database"""
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        engine = db.get_engine()
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            fn()
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+        return statements
+
+    def test_get_categories(self):
+        res = self.client().get('/categories')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(len(data['categories']))
+        self.assertTrue(res.headers.get('ETag'))
+
+    def test_get_categories_not_modified(self):
+        etag = self.client().get('/categories').headers['ETag']
+        res = self.client().get('/categories', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+    def test_categories_etag_changes_with_categories(self):
+        etag = self.client().get('/categories').headers['ETag']
+        Category(type='Music').insert()
+        res = self.client().get('/categories', headers={'If-None-Match': etag})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('Music', data['categories'].values())
+
+    def test_rolled_back_category_is_not_served(self):
+        db.session.add(Category(type='Uncommitted'))
+        db.session.flush()
+        # e.g. another request's reload, made before the rollback
+        category_registry.load()
+        self.assertIn('Uncommitted', category_registry.all().values())
+
+        db.session.rollback()
+        res = self.client().get('/categories')
+        data = json.loads(res.data)
+
+        self.assertNotIn('Uncommitted', data['categories'].values())
+
+    def test_category_change_in_another_worker_is_picked_up(self):
+        now = [0.0]
+        other_worker = CategoryRegistry(check_seconds=2, clock=lambda: now[0])
+        self.assertNotIn('Music', other_worker.all().values())
+
+        Category(type='Music').insert()
+        # served from memory until the next check
+        self.assertNotIn('Music', other_worker.all().values())
+        now[0] += 2
+        self.assertIn('Music', other_worker.all().values())
+
+    def test_changing_the_returned_categories_leaves_the_registry_alone(self):
+        category_registry.all()[1000] = 'Scribbled'
+
+        self.assertNotIn(1000, category_registry.all())
+
+    def test_get_paginated_questions(self):
+        res = self.client().get('/questions')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['total_questions'])
+        self.assertTrue(len(data['questions']) <= 10)
+        self.assertTrue(len(data['categories']))
+
+    def test_404_sent_requesting_beyond_valid_page(self):
+        res = self.client().get('/questions?page=1000')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'resource not found')
+
+    def test_get_questions_by_category(self):
+        res = self.client().get('/categories/1/questions')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['current_category'], 1)
+        self.assertTrue(all(str(q['category']) == '1' for q in data['questions']))
+
+    def test_404_sent_for_unknown_category(self):
+        res = self.client().get('/categories/1000/questions')
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_page_view_does_not_read_categories_table(self):
+        """A list page view (questions + categories) only queries questions"""
+        def page_view():
+            self.client().get('/questions?page=1')
+            self.client().get('/categories')
+
+        category_registry.all()
+        statements = self.count_statements(page_view)
+
+        self.assertFalse([s for s in statements if 'FROM categories' in s])
+        self.assertEqual(len(statements), 1)
+
+    def test_import_question_pack(self):
+        pack = (
+            'question,answer,category,difficulty\n'
+            'Which pack test question is this?,The first,1,2\n'
+            '  which PACK test question   is this?,A duplicate,1,2\n'
+            'Too hard?,Yes,1,9\n'
+            'Unknown category?,Yes,1000,1\n'
+        )
+        res = self.client().post('/questions/import', data=pack, content_type='text/csv')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(data['duplicates'], 1)
+        self.assertEqual(data['rejected'], 2)
+        self.assertEqual([e['row'] for e in data['errors']], [3, 4])
+        self.assertEqual(Question.query.filter(
+            Question.question == 'Which pack test question is this?').count(), 1)
+
+    def test_import_reports_malformed_lines(self):
+        pack = (
+            '{"question": "Is this line fine?", "answer": "Yes", "category": 1, "difficulty": 1}\n'
+            '{"question": "Is this one cut short?", \n'
+            '{"question": 123, "answer": "A number", "category": 1, "difficulty": 1}\n'
+            '{"question": "Is the last line imported?", "answer": "Yes", "category": 1, "difficulty": 1}\n'
+        )
+        res = self.client().post('/questions/import', data=pack, content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 2)
+        self.assertEqual(data['rejected'], 2)
+        self.assertEqual([e['row'] for e in data['errors']], [2, 3])
+        self.assertIn('line 2', data['errors'][0]['message'])
+
+    def test_import_json_array_after_a_byte_order_mark(self):
+        pack = '\ufeff\n' + json.dumps([
+            {'question': 'Is the array after the BOM read?', 'answer': 'Yes', 'category': 1, 'difficulty': 1},
+            {'question': 'Is its second element read?', 'answer': 'Yes', 'category': 1, 'difficulty': 1},
+        ])
+        res = self.client().post('/questions/import', data=pack.encode('utf-8'), content_type='application/json')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 2)
+        self.assertTrue(data['complete'])
+
+    def test_import_reports_a_pack_that_breaks_off(self):
+        pack = (
+            '[{"question": "Is the element before the break kept?", "answer": "Yes", "category": 1, "difficulty": 1},'
+            ' {"question": "Is this one cut short?", '
+        )
+        res = self.client().post('/questions/import', data=pack, content_type='application/json')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 1)
+        self.assertFalse(data['complete'])
+        self.assertEqual(data['errors'][0]['row'], 2)
+
+    def test_import_skips_unreadable_csv_lines(self):
+        pack = (
+            'question,answer,category,difficulty\n'
+            '"' + 'x' * 200000 + '",Too long,1,1\n'
+            'Is the line after the long one read?,Yes,1,1\n'
+        )
+        res = self.client().post('/questions/import', data=pack, content_type='text/csv')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual([e['row'] for e in data['errors']], [1])
+
+    def test_422_import_with_only_invalid_rows(self):
+        pack = json.dumps([{'question': 'Q', 'answer': 'A', 'category': 1, 'difficulty': 0}])
+        res = self.client().post('/questions/import', data=pack, content_type='application/json')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['inserted'], 0)
+
+    def test_export_question_pack(self):
+        res = self.client().get('/questions/export?format=csv')
+        lines = res.data.decode('utf-8').splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(lines[0], 'question,answer,category,difficulty')
+        self.assertEqual(len(lines) - 1, json.loads(self.client().get('/questions').data)['total_questions'])
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
@@ -0,0 +1,46 @@
+'''
+Compares check_permissions' precompiled frozenset lookups with scanning
+the payload's permissions list, for tokens carrying many scopes.
+
+    python -m benchmarks.bench_permissions    (from the backend directory)
+'''
+import timeit
+
+from src.auth.permissions import VerifiedPayload, AllOf, AnyOf, granted_permissions
+
+SCOPE_COUNTS = [10, 100, 500]
+NUMBER = 100000
+
+
+def list_scan_all(required, payload):
+    return all(permission in payload['permissions'] for permission in required)
+
+
+def list_scan_any(required, payload):
+    return any(permission in payload['permissions'] for permission in required)
+
+
+def main():
+    print('{:>7} {:>16} {:>16} {:>16} {:>16}'.format(
+        'scopes', 'list all (us)', 'set all (us)', 'list any (us)', 'set any (us)'))
+    for count in SCOPE_COUNTS:
+        scopes = ['scope:{}'.format(i) for i in range(count)]
+        # the worst case for a scan: the wanted scopes sit at the end
+        required = scopes[-2:]
+        payload = {'permissions': scopes}
+        verified = VerifiedPayload(payload)
+        all_of = AllOf(*required)
+        any_of = AnyOf('missing:scope', required[-1])
+
+        timings = [
+            timeit.timeit(lambda: list_scan_all(required, payload), number=NUMBER),
+            timeit.timeit(lambda: all_of.satisfied_by(granted_permissions(verified)), number=NUMBER),
+            timeit.timeit(lambda: list_scan_any(['missing:scope', required[-1]], payload), number=NUMBER),
+            timeit.timeit(lambda: any_of.satisfied_by(granted_permissions(verified)), number=NUMBER),
+        ]
+        print('{:>7} {:>16.3f} {:>16.3f} {:>16.3f} {:>16.3f}'.format(
+            count, *(1e6 * t / NUMBER for t in timings)))
+
+
+if __name__ == '__main__':
+    main()
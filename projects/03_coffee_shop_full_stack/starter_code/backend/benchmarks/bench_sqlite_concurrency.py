@@ -0,0 +1,93 @@
+'''
+Mixed read/write load against a SQLite file database, once with the
+default engine setup_db used to create and once with the WAL profile
+from src/database/models.py. Reports operations per second and how many
+operations failed with "database is locked".
+
+    python -m benchmarks.bench_sqlite_concurrency    (from the backend directory)
+'''
+import json
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from src.database.models import SQLITE_PRAGMAS, apply_sqlite_pragmas, sqlite_engine_options
+
+READERS = 8
+WRITERS = 4
+DURATION = 5
+RECIPE = json.dumps([{'name': 'Water', 'color': 'blue', 'parts': 1}])
+
+
+def make_engine(path, tuned):
+    url = 'sqlite:///{}'.format(path)
+    if not tuned:
+        return create_engine(url)
+    engine = create_engine(url, **sqlite_engine_options())
+    apply_sqlite_pragmas(engine, SQLITE_PRAGMAS)
+    return engine
+
+
+def run(tuned):
+    directory = tempfile.mkdtemp()
+    engine = make_engine(os.path.join(directory, 'bench.db'), tuned)
+    with engine.begin() as connection:
+        connection.execute(text('CREATE TABLE drink (id INTEGER PRIMARY KEY, title VARCHAR(80) UNIQUE, recipe TEXT NOT NULL)'))
+        for i in range(50):
+            connection.execute(text('INSERT INTO drink (title, recipe) VALUES (:t, :r)'), t='drink {}'.format(i), r=RECIPE)
+
+    counts = {'reads': 0, 'writes': 0, 'locked': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + DURATION
+
+    def count(key):
+        with lock:
+            counts[key] += 1
+
+    def reader():
+        while time.monotonic() < deadline:
+            try:
+                with engine.connect() as connection:
+                    connection.execute(text('SELECT id, title, recipe FROM drink')).fetchall()
+                count('reads')
+            except OperationalError:
+                count('locked')
+
+    def writer(number):
+        i = 0
+        while time.monotonic() < deadline:
+            i += 1
+            try:
+                with engine.begin() as connection:
+                    connection.execute(text('INSERT INTO drink (title, recipe) VALUES (:t, :r)'),
+                                       t='writer {} drink {}'.format(number, i), r=RECIPE)
+                    connection.execute(text('UPDATE drink SET recipe = :r WHERE id = 1'), r=RECIPE)
+                count('writes')
+            except OperationalError:
+                count('locked')
+
+    threads = [threading.Thread(target=reader) for _ in range(READERS)]
+    threads += [threading.Thread(target=writer, args=(n,)) for n in range(WRITERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+    return counts
+
+
+def main():
+    print('{} readers, {} writers, {}s per profile'.format(READERS, WRITERS, DURATION))
+    print('{:>8} {:>12} {:>12} {:>8}'.format('profile', 'reads/s', 'writes/s', 'locked'))
+    for name, tuned in (('default', False), ('wal', True)):
+        counts = run(tuned)
+        print('{:>8} {:>12.0f} {:>12.0f} {:>8}'.format(
+            name, counts['reads'] / DURATION, counts['writes'] / DURATION, counts['locked']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+'''
+Measures coffee shop startup in a fresh interpreter: the cold import of
+src.api, create_app() and the first GET /drinks (which opens the first
+database connection and builds the menu snapshot).
+
+    python -m benchmarks.bench_startup    (from the backend directory)
+'''
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+RUNS = 5
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+from src import api
+imported = time.perf_counter()
+app = api.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + sys.argv[1]})
+with app.app_context():
+    api.db.create_all()
+created = time.perf_counter()
+response = app.test_client().get('/drinks')
+assert response.status_code == 200
+served = time.perf_counter()
+print(json.dumps({
+    'import': imported - started,
+    'create_app': created - imported,
+    'first_request': served - created,
+}))
+"""
+
+
+def main():
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    totals = {}
+    for _ in range(RUNS):
+        with tempfile.TemporaryDirectory() as directory:
+            output = subprocess.run(
+                [sys.executable, '-c', PROBE, os.path.join(directory, 'bench.db')],
+                cwd=backend, check=True, capture_output=True, text=True).stdout
+        for phase, seconds in json.loads(output).items():
+            totals[phase] = totals.get(phase, 0) + seconds
+
+    print('average of {} cold starts'.format(RUNS))
+    for phase, seconds in totals.items():
+        print('{:>14} {:>8.1f} ms'.format(phase, 1000 * seconds / RUNS))
+
+
+if __name__ == '__main__':
+    main()
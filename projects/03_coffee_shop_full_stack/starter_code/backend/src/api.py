@@ -1,85 +1,168 @@
 import os
-from flask import Flask, request, jsonify, abort
+import click
+from flask import Flask, Blueprint, current_app, request, jsonify, abort, Response
 from sqlalchemy import exc
 import json
 from flask_cors import CORS
 
-from .database.models import db_drop_and_create_all, setup_db, Drink
+from .database.models import db_drop_and_create_all, setup_db, Drink, db
 from .auth.auth import AuthError, requires_auth
+from .menu import MenuSnapshot
 
-app = Flask(__name__)
-setup_db(app)
-CORS(app)
+drinks = Blueprint('drinks', __name__)
 
 '''
-@TODO uncomment the following line to initialize the datbase
-!! NOTE THIS WILL DROP ALL RECORDS AND START YOUR DB FROM SCRATCH
-!! NOTE THIS MUST BE UNCOMMENTED ON FIRST RUN
+create_app(config)
+    builds and configures the coffee shop app
+    importing this module does no I/O: the database engine is only created
+    here and only connects on the first request that needs it
+    @INPUTS
+        config: optional mapping of config values, e.g.
+            {'SQLALCHEMY_DATABASE_URI': 'sqlite:////tmp/test.db', 'SQLITE_PRAGMAS': {...}}
+
+    the schema is created explicitly with `flask init-db`
+    !! NOTE THIS WILL DROP ALL RECORDS AND START YOUR DB FROM SCRATCH
+    !! NOTE THIS MUST BE RUN ON FIRST RUN
 '''
-# db_drop_and_create_all()
+def create_app(config=None):
+    app = Flask(__name__)
+    if config:
+        app.config.from_mapping(config)
+    setup_db(app)
+    CORS(app)
+
+    app.extensions['menu'] = MenuSnapshot()
+    app.register_blueprint(drinks)
+
+    @app.cli.command('init-db')
+    @click.confirmation_option(prompt='This drops every drink. Continue?')
+    def init_db():
+        '''Drop and recreate the database tables.'''
+        db_drop_and_create_all()
+        click.echo('Initialized the database.')
+
+    return app
+
 
 ## ROUTES
+
 '''
-@TODO implement endpoint
-    GET /drinks
-        it should be a public endpoint
-        it should contain only the drink.short() data representation
-    returns status code 200 and json {"success": True, "drinks": drinks} where drinks is the list of drinks
-        or appropriate status code indicating reason for failure
+menu_response(variant)
+    serves the pre-serialized menu snapshot with its ETag
+    a request whose If-None-Match matches gets an empty 304
 '''
+def menu_response(variant):
+    body, etag = current_app.extensions['menu'].get(variant)
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 
 '''
-@TODO implement endpoint
-    GET /drinks-detail
-        it should require the 'get:drinks-detail' permission
-        it should contain the drink.long() data representation
+GET /drinks
+    public endpoint, drink.short() data representation
     returns status code 200 and json {"success": True, "drinks": drinks} where drinks is the list of drinks
-        or appropriate status code indicating reason for failure
 '''
+@drinks.route('/drinks')
+def get_drinks():
+    return menu_response('short')
 
 
 '''
-@TODO implement endpoint
-    POST /drinks
-        it should create a new row in the drinks table
-        it should require the 'post:drinks' permission
-        it should contain the drink.long() data representation
-    returns status code 200 and json {"success": True, "drinks": drink} where drink an array containing only the newly created drink
-        or appropriate status code indicating reason for failure
+GET /drinks-detail
+    requires the 'get:drinks-detail' permission, drink.long() data representation
+    returns status code 200 and json {"success": True, "drinks": drinks} where drinks is the list of drinks
 '''
+@drinks.route('/drinks-detail')
+@requires_auth('get:drinks-detail')
+def get_drinks_detail(payload):
+    return menu_response('long')
 
 
 '''
-@TODO implement endpoint
-    PATCH /drinks/<id>
-        where <id> is the existing model id
-        it should respond with a 404 error if <id> is not found
-        it should update the corresponding row for <id>
-        it should require the 'patch:drinks' permission
-        it should contain the drink.long() data representation
-    returns status code 200 and json {"success": True, "drinks": drink} where drink an array containing only the updated drink
-        or appropriate status code indicating reason for failure
+POST /drinks
+    creates a new row in the drinks table
+    requires the 'post:drinks' permission
+    returns status code 200 and json {"success": True, "drinks": drink} where drink an array containing only the newly created drink
+        or 422 if the title or recipe is missing, the recipe is malformed or the title is taken
 '''
+@drinks.route('/drinks', methods=['POST'])
+@requires_auth('post:drinks')
+def create_drink(payload):
+    body = request.get_json(silent=True) or {}
+    if not body.get('title') or not body.get('recipe'):
+        abort(422)
+
+    try:
+        drink = Drink(title=body['title'], recipe=body['recipe'])
+        drink.insert()
+    except (exc.SQLAlchemyError, ValueError, KeyError, TypeError):
+        db.session.rollback()
+        abort(422)
+
+    current_app.extensions['menu'].rebuild()
+    return jsonify({'success': True, 'drinks': [drink.long()]})
 
 
 '''
-@TODO implement endpoint
-    DELETE /drinks/<id>
-        where <id> is the existing model id
-        it should respond with a 404 error if <id> is not found
-        it should delete the corresponding row for <id>
-        it should require the 'delete:drinks' permission
+PATCH /drinks/<id>
+    updates the title and/or recipe of drink <id>
+    requires the 'patch:drinks' permission
+    returns status code 200 and json {"success": True, "drinks": drink} where drink an array containing only the updated drink
+        or 404 if <id> is not found, or 422 if the recipe is malformed
+'''
+@drinks.route('/drinks/<int:drink_id>', methods=['PATCH'])
+@requires_auth('patch:drinks')
+def update_drink(payload, drink_id):
+    drink = Drink.query.filter(Drink.id == drink_id).one_or_none()
+    if drink is None:
+        abort(404)
+
+    body = request.get_json(silent=True) or {}
+    try:
+        if 'title' in body:
+            drink.title = body['title']
+        if 'recipe' in body:
+            drink.recipe = body['recipe']
+        drink.update()
+    except (exc.SQLAlchemyError, ValueError, KeyError, TypeError):
+        db.session.rollback()
+        abort(422)
+
+    current_app.extensions['menu'].rebuild()
+    return jsonify({'success': True, 'drinks': [drink.long()]})
+
+
+'''
+DELETE /drinks/<id>
+    deletes drink <id>
+    requires the 'delete:drinks' permission
     returns status code 200 and json {"success": True, "delete": id} where id is the id of the deleted record
-        or appropriate status code indicating reason for failure
+        or 404 if <id> is not found
 '''
+@drinks.route('/drinks/<int:drink_id>', methods=['DELETE'])
+@requires_auth('delete:drinks')
+def delete_drink(payload, drink_id):
+    drink = Drink.query.filter(Drink.id == drink_id).one_or_none()
+    if drink is None:
+        abort(404)
+
+    try:
+        drink.delete()
+    except exc.SQLAlchemyError:
+        db.session.rollback()
+        abort(422)
+
+    current_app.extensions['menu'].rebuild()
+    return jsonify({'success': True, 'delete': drink_id})
 
 
 ## Error Handling
 '''
 Example error handling for unprocessable entity
 '''
-@app.errorhandler(422)
+@drinks.app_errorhandler(422)
 def unprocessable(error):
     return jsonify({
                     "success": False, 
@@ -87,24 +170,20 @@ def unprocessable(error):
                     "message": "unprocessable"
                     }), 422
 
-'''
-@TODO implement error handlers using the @app.errorhandler(error) decorator
-    each error handler should return (with approprate messages):
-             jsonify({
+
+@drinks.app_errorhandler(404)
+def not_found(error):
+    return jsonify({
                     "success": False, 
                     "error": 404,
                     "message": "resource not found"
                     }), 404
 
-'''
-
-'''
-@TODO implement error handler for 404
-    error handler should conform to general task above 
-'''
 
-
-'''
-@TODO implement error handler for AuthError
-    error handler should conform to general task above 
-'''
+@drinks.app_errorhandler(AuthError)
+def auth_error(error):
+    return jsonify({
+                    "success": False, 
+                    "error": error.status_code,
+                    "message": error.error['description']
+                    }), error.status_code
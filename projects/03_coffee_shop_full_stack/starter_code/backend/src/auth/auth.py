@@ -1,13 +1,27 @@
 import json
+import os
 from flask import request, _request_ctx_stack
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
 
+from .jwks import JWKSCache
+from .permissions import VerifiedPayload, AllOf, AnyOf, as_requirement, granted_permissions
+from .token_cache import VerifiedTokenCache
+
+# AllOf and AnyOf are re-exported for views: @requires_auth(AllOf(...))
+__all__ = [
+    'AuthError', 'AllOf', 'AnyOf', 'requires_auth', 'check_permissions',
+    'verify_decode_jwt', 'get_verified_payload', 'get_token_auth_header'
+]
 
 AUTH0_DOMAIN = 'udacity-fsnd.auth0.com'
 ALGORITHMS = ['RS256']
 API_AUDIENCE = 'dev'
+# point JWKS_URL at a local stand-in server to run without Auth0
+JWKS_URL = os.environ.get('JWKS_URL', f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+
+jwks_cache = JWKSCache(JWKS_URL)
+token_cache = VerifiedTokenCache()
 
 ## AuthError Exception
 '''
@@ -23,7 +37,7 @@ class AuthError(Exception):
 ## Auth Header
 
 '''
-@TODO implement get_token_auth_header() method
+get_token_auth_header()
     it should attempt to get the header from the request
         it should raise an AuthError if no header is present
     it should attempt to split bearer and the token
@@ -31,10 +45,36 @@ class AuthError(Exception):
     return the token part of the header
 '''
 def get_token_auth_header():
-   raise Exception('Not Implemented')
+    auth = request.headers.get('Authorization', None)
+    if not auth:
+        raise AuthError({
+            'code': 'authorization_header_missing',
+            'description': 'Authorization header is expected.'
+        }, 401)
+
+    parts = auth.split()
+    if parts[0].lower() != 'bearer':
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Authorization header must start with "Bearer".'
+        }, 401)
+
+    elif len(parts) == 1:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Token not found.'
+        }, 401)
+
+    elif len(parts) > 2:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Authorization header must be bearer token.'
+        }, 401)
+
+    return parts[1]
 
 '''
-@TODO implement check_permissions(permission, payload) method
+check_permissions(permission, payload)
     @INPUTS
         permission: string permission (i.e. 'post:drink')
         payload: decoded jwt payload
@@ -43,12 +83,29 @@ def get_token_auth_header():
         !!NOTE check your RBAC settings in Auth0
     it should raise an AuthError if the requested permission string is not in the payload permissions array
     return true otherwise
+
+    permission may also be an AllOf/AnyOf requirement. payloads returned by
+    verify_decode_jwt carry their permissions as a frozenset, so each
+    required permission costs one set lookup however many scopes the token has
 '''
 def check_permissions(permission, payload):
-    raise Exception('Not Implemented')
+    granted = granted_permissions(payload)
+    if granted is None:
+        raise AuthError({
+            'code': 'invalid_claims',
+            'description': 'Permissions not included in JWT.'
+        }, 400)
+
+    if not as_requirement(permission).satisfied_by(granted):
+        raise AuthError({
+            'code': 'unauthorized',
+            'description': 'Permission not found.'
+        }, 403)
+
+    return True
 
 '''
-@TODO implement verify_decode_jwt(token) method
+verify_decode_jwt(token)
     @INPUTS
         token: a json web token (string)
 
@@ -58,28 +115,99 @@ def check_permissions(permission, payload):
     it should validate the claims
     return the decoded payload
 
+    the signing keys come from jwks_cache, so the JWKS is only fetched
+    when the cached copy expires or an unknown kid shows up
+
     !!NOTE urlopen has a common certificate error described here: https://stackoverflow.com/questions/50236117/scraping-ssl-certificate-verify-failed-error-for-http-en-wikipedia-org
 '''
 def verify_decode_jwt(token):
-    raise Exception('Not Implemented')
+    try:
+        unverified_header = jwt.get_unverified_header(token)
+    except jwt.JWTError:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Unable to parse authentication token.'
+        }, 401)
+
+    if 'kid' not in unverified_header:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Authorization malformed.'
+        }, 401)
+
+    rsa_key = jwks_cache.get_key(unverified_header['kid'])
+    if not rsa_key:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Unable to find the appropriate key.'
+        }, 401)
+
+    try:
+        return VerifiedPayload(jwt.decode(
+            token,
+            rsa_key,
+            algorithms=ALGORITHMS,
+            audience=API_AUDIENCE,
+            issuer='https://' + AUTH0_DOMAIN + '/'
+        ))
+
+    except jwt.ExpiredSignatureError:
+        raise AuthError({
+            'code': 'token_expired',
+            'description': 'Token expired.'
+        }, 401)
+
+    except jwt.JWTClaimsError:
+        raise AuthError({
+            'code': 'invalid_claims',
+            'description': 'Incorrect claims. Please, check the audience and issuer.'
+        }, 401)
+
+    except Exception:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Unable to parse authentication token.'
+        }, 400)
 
 '''
-@TODO implement @requires_auth(permission) decorator method
+get_verified_payload(token)
     @INPUTS
-        permission: string permission (i.e. 'post:drink')
+        token: a json web token (string)
+
+    returns the payload from token_cache when this token has already been
+    verified and has not expired, otherwise runs verify_decode_jwt and
+    caches the result until the token's exp
+'''
+def get_verified_payload(token):
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = token_cache.verify(token, verify_decode_jwt)
+    return payload
+
+'''
+@requires_auth(permission) decorator
+    @INPUTS
+        permission: string permission (i.e. 'post:drink'), or a combination
+            such as AllOf('patch:drinks', 'get:drinks-detail') or
+            AnyOf('post:drinks', 'patch:drinks')
 
     it should use the get_token_auth_header method to get the token
     it should use the verify_decode_jwt method to decode the jwt
     it should use the check_permissions method validate claims and check the requested permission
     return the decorator which passes the decoded payload to the decorated method
+
+    the signature is only verified the first time a token is seen, see
+    get_verified_payload. permissions are still checked on every call.
 '''
 def requires_auth(permission=''):
+    requirement = as_requirement(permission)
+
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
             token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            payload = get_verified_payload(token)
+            check_permissions(requirement, payload)
             return f(payload, *args, **kwargs)
 
         return wrapper
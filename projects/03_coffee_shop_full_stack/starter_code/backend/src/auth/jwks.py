@@ -0,0 +1,161 @@
+import json
+import logging
+import re
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+logger = logging.getLogger(__name__)
+
+# used when the JWKS response carries no usable Cache-Control max-age
+DEFAULT_MAX_AGE = 600
+# an unknown kid may force a refetch at most this often (seconds)
+MIN_FORCED_REFRESH_INTERVAL = 30
+FETCH_TIMEOUT = 5
+
+MAX_AGE = re.compile(r'(?:^|,)\s*max-age\s*=\s*"?(\d+)"?', re.I)
+
+'''
+JWKSCache
+    an in-process cache of the signing keys published at a JWKS url
+
+    keys are held by kid for as long as the response's Cache-Control
+    max-age allows. once that runs out the stale keys keep being served
+    while a background thread revalidates them (sending If-None-Match
+    when the server gave us an ETag). an unknown kid triggers an immediate
+    refetch, but only once per min_forced_refresh_interval, so a flood of
+    tokens with made up kids cannot hammer the identity provider. the
+    first fetch counts as such a refetch, and concurrent first requests
+    wait for a single fetch.
+    if a fetch fails the last good keys are kept.
+
+    EXAMPLE
+        jwks = JWKSCache('https://udacity-fsnd.auth0.com/.well-known/jwks.json')
+        rsa_key = jwks.get_key(unverified_header['kid'])
+'''
+class JWKSCache:
+
+    def __init__(self, url, default_max_age=DEFAULT_MAX_AGE,
+                 min_forced_refresh_interval=MIN_FORCED_REFRESH_INTERVAL,
+                 timeout=FETCH_TIMEOUT, clock=time.monotonic):
+        self.url = url
+        self.default_max_age = default_max_age
+        self.min_forced_refresh_interval = min_forced_refresh_interval
+        self.timeout = timeout
+        self.clock = clock
+
+        self._keys = {}
+        self._etag = None
+        self._expires_at = None
+        self._last_forced_refresh = None
+        self._lock = threading.Lock()
+        self._first_fetch_lock = threading.Lock()
+        self._refreshing = False
+
+    '''
+    get_key(kid)
+        returns the rsa key dict for kid, or None if the JWKS does not
+        have it (even after a permitted forced refresh)
+    '''
+    def get_key(self, kid):
+        if self._expires_at is None:
+            self._first_fetch()
+        elif self.clock() >= self._expires_at:
+            self._refresh_in_background()
+
+        key = self._keys.get(kid)
+        if key is None and self._may_force_refresh():
+            self.refresh()
+            key = self._keys.get(kid)
+        return key
+
+    '''
+    refresh()
+        fetches the JWKS now; on failure the current keys are kept
+        and the failure is logged
+    '''
+    def refresh(self):
+        try:
+            self._fetch()
+        except Exception as error:
+            logger.warning('Unable to refresh JWKS from %s, serving cached keys: %s', self.url, error)
+            with self._lock:
+                # try again after a short pause rather than on every request
+                self._expires_at = self.clock() + self.min_forced_refresh_interval
+
+    def _first_fetch(self):
+        with self._first_fetch_lock:
+            if self._expires_at is not None:
+                # another request fetched them while this one waited
+                return
+            with self._lock:
+                # the keys are as fresh as a forced refresh would get them
+                self._last_forced_refresh = self.clock()
+            self.refresh()
+
+    def _fetch(self):
+        request = Request(self.url)
+        if self._etag and self._keys:
+            request.add_header('If-None-Match', self._etag)
+
+        try:
+            with urlopen(request, timeout=self.timeout) as response:
+                headers = response.headers
+                jwks = json.loads(response.read())
+        except HTTPError as error:
+            if error.code != 304:
+                raise
+            with self._lock:
+                self._expires_at = self.clock() + self._max_age(error.headers)
+            return
+
+        # only RSA signing keys can verify our RS256 tokens; anything else
+        # the provider publishes (EC keys, encryption keys) is left out
+        keys = {
+            key['kid']: {
+                'kty': key['kty'],
+                'kid': key['kid'],
+                'use': key.get('use', 'sig'),
+                'n': key['n'],
+                'e': key['e']
+            }
+            for key in jwks.get('keys', [])
+            if key.get('kid') and key.get('kty') == 'RSA' and key.get('use', 'sig') == 'sig'
+            and key.get('n') and key.get('e')
+        }
+        with self._lock:
+            self._keys = keys
+            self._etag = headers.get('ETag')
+            self._expires_at = self.clock() + self._max_age(headers)
+
+    def _max_age(self, headers):
+        cache_control = headers.get('Cache-Control', '') if headers else ''
+        if 'no-cache' in cache_control or 'no-store' in cache_control:
+            return 0
+        match = MAX_AGE.search(cache_control)
+        return int(match.group(1)) if match else self.default_max_age
+
+    def _may_force_refresh(self):
+        now = self.clock()
+        with self._lock:
+            if (self._last_forced_refresh is not None and
+                    now - self._last_forced_refresh < self.min_forced_refresh_interval):
+                return False
+            self._last_forced_refresh = now
+            return True
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, name='jwks-refresh', daemon=True).start()
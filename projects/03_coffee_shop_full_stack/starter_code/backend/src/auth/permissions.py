@@ -0,0 +1,72 @@
+'''
+VerifiedPayload
+    a decoded jwt payload with its permissions claim precompiled into a
+    frozenset. it is still a plain dict to the route handlers, but
+    check_permissions can test it without scanning the permissions list.
+'''
+class VerifiedPayload(dict):
+
+    def __init__(self, payload):
+        super().__init__(payload)
+        permissions = payload.get('permissions')
+        self.permission_set = frozenset(permissions) if isinstance(permissions, list) else None
+
+
+'''
+granted_permissions(payload)
+    returns the payload's permissions as a frozenset, or None when the
+    payload has no permissions claim. only payloads that did not come
+    through VerifiedPayload pay for building the set.
+'''
+def granted_permissions(payload):
+    if isinstance(payload, VerifiedPayload):
+        return payload.permission_set
+    permissions = payload.get('permissions')
+    return frozenset(permissions) if isinstance(permissions, list) else None
+
+
+'''
+AllOf / AnyOf
+    permission requirements for requires_auth, built once when a route
+    is decorated. they take permission strings or other requirements.
+    each permission is a single hash lookup against the granted set.
+
+    EXAMPLE
+        @requires_auth(AllOf('patch:drinks', AnyOf('get:drinks-detail', 'post:drinks')))
+'''
+class _Requirement:
+
+    def __init__(self, *requirements):
+        self.permissions = frozenset(r for r in requirements if isinstance(r, str))
+        self.requirements = tuple(r for r in requirements if not isinstance(r, str))
+
+    def __repr__(self):
+        parts = sorted(self.permissions) + [repr(r) for r in self.requirements]
+        return '{}({})'.format(type(self).__name__, ', '.join(map(str, parts)))
+
+
+class AllOf(_Requirement):
+
+    def satisfied_by(self, granted):
+        return (self.permissions.issubset(granted) and
+                all(r.satisfied_by(granted) for r in self.requirements))
+
+
+class AnyOf(_Requirement):
+
+    def satisfied_by(self, granted):
+        return (not self.permissions.isdisjoint(granted) or
+                any(r.satisfied_by(granted) for r in self.requirements))
+
+
+'''
+as_requirement(permission)
+    turns the argument of requires_auth into a requirement; a plain string
+    is a single required permission and an empty string requires nothing
+'''
+def as_requirement(permission):
+    if isinstance(permission, _Requirement):
+        return permission
+    if not permission:
+        return AllOf()
+    return AllOf(permission)
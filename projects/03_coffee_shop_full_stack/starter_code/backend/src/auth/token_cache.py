@@ -0,0 +1,118 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+MAX_TOKENS = 1024
+# stats() is logged every this many lookups
+LOG_EVERY = 1000
+
+logger = logging.getLogger(__name__)
+
+'''
+VerifiedTokenCache
+    a bounded LRU of payloads whose signature has already been verified
+
+    entries are keyed by a sha256 of the raw token, so the tokens themselves
+    are never held in memory, and are dropped once the token's exp has
+    passed. the least recently used entry is evicted when the cache is full.
+    the cached payload dicts are shared between requests and must not be
+    modified.
+
+    hits, misses and the time spent in verification are counted; stats()
+    returns them along with the hit rate, and they are logged at INFO every
+    log_every lookups.
+
+    EXAMPLE
+        payload = token_cache.get(token)
+        if payload is None:
+            payload = token_cache.verify(token, verify_decode_jwt)
+'''
+class VerifiedTokenCache:
+
+    def __init__(self, max_tokens=MAX_TOKENS, clock=time.time, log_every=LOG_EVERY):
+        self.max_tokens = max_tokens
+        self.clock = clock
+        self.log_every = log_every
+        self._payloads = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.verifications = 0
+        self.verification_seconds = 0.0
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def get(self, token):
+        key = self._key(token)
+        payload = None
+        with self._lock:
+            entry = self._payloads.get(key)
+            if entry is not None:
+                if self.clock() < entry[1]:
+                    self._payloads.move_to_end(key)
+                    payload = entry[0]
+                else:
+                    del self._payloads[key]
+            if payload is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            report = self.log_every and (self.hits + self.misses) % self.log_every == 0
+        if report:
+            self.log_stats()
+        return payload
+
+    '''
+    verify(token, verify_decode_jwt)
+        runs the full verification, times it and caches the payload
+        until its exp. tokens without an exp are never cached.
+    '''
+    def verify(self, token, verify_decode_jwt):
+        started = time.perf_counter()
+        try:
+            payload = verify_decode_jwt(token)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.verifications += 1
+                self.verification_seconds += elapsed
+
+        expires_at = payload.get('exp')
+        if isinstance(expires_at, (int, float)):
+            key = self._key(token)
+            with self._lock:
+                self._payloads[key] = (payload, expires_at)
+                self._payloads.move_to_end(key)
+                while len(self._payloads) > self.max_tokens:
+                    self._payloads.popitem(last=False)
+        return payload
+
+    def clear(self):
+        with self._lock:
+            self._payloads.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._payloads),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'verifications': self.verifications,
+                'average_verification_ms': (
+                    1000 * self.verification_seconds / self.verifications
+                    if self.verifications else 0.0
+                )
+            }
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(
+            'Verified token cache: %d tokens, %d hits, %d misses, hit rate %.1f%%, %d verifications averaging %.1f ms',
+            stats['size'], stats['hits'], stats['misses'], 100 * stats['hit_rate'],
+            stats['verifications'], stats['average_verification_ms'])
@@ -1,5 +1,9 @@
 import os
-from sqlalchemy import Column, String, Integer
+import time
+from itertools import chain
+from sqlalchemy import Column, String, Integer, JSON, event
+from sqlalchemy.orm import Session, validates
+from sqlalchemy.pool import QueuePool
 from flask_sqlalchemy import SQLAlchemy
 import json
 
@@ -9,15 +13,76 @@ database_path = "sqlite:///{}".format(os.path.join(project_dir, database_filenam
 
 db = SQLAlchemy()
 
+'''
+SQLITE_PRAGMAS
+    applied to every new SQLite connection
+    WAL lets readers carry on while a write commits, NORMAL synchronous is
+    durable under WAL except on power loss, busy_timeout (ms) makes a
+    writer wait for the lock instead of failing with "database is locked"
+    and mmap_size (bytes) lets reads come straight from the page cache.
+    override any of them with app.config['SQLITE_PRAGMAS']; a value of None
+    leaves that pragma at the SQLite default
+'''
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+# connections are kept open so the pragmas and page cache are not paid for on every request
+SQLITE_POOL_SIZE = 5
+SQLITE_MAX_OVERFLOW = 10
+
+'''
+sqlite_engine_options()
+    engine options for a pooled SQLite file database shared between threads
+'''
+def sqlite_engine_options(pool_size=SQLITE_POOL_SIZE, max_overflow=SQLITE_MAX_OVERFLOW):
+    return {
+        'poolclass': QueuePool,
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'connect_args': {'check_same_thread': False},
+    }
+
+'''
+apply_sqlite_pragmas(engine, pragmas)
+    runs the given pragmas on each new connection the engine opens
+'''
+def apply_sqlite_pragmas(engine, pragmas=SQLITE_PRAGMAS):
+    statements = [
+        'PRAGMA {}={}'.format(name, value)
+        for name, value in pragmas.items()
+        if value is not None
+    ]
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.close()
+
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    the database defaults to database_path unless the app config already names one
+    SQLite databases get the pooled, WAL mode profile above
+    nothing connects here; the first query made in an app context does
 '''
 def setup_db(app):
-    app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+    app.config.setdefault("SQLALCHEMY_DATABASE_URI", database_path)
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-    db.app = app
+    uri = app.config["SQLALCHEMY_DATABASE_URI"]
+    is_sqlite = uri.startswith('sqlite:') and ':memory:' not in uri
+    if is_sqlite:
+        app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", sqlite_engine_options())
     db.init_app(app)
+    if is_sqlite:
+        pragmas = dict(SQLITE_PRAGMAS, **app.config.get('SQLITE_PRAGMAS', {}))
+        apply_sqlite_pragmas(db.get_engine(app), pragmas)
 
 '''
 db_drop_and_create_all()
@@ -28,6 +93,7 @@ db_drop_and_create_all()
 def db_drop_and_create_all():
     db.drop_all()
     db.create_all()
+    _ready_engines.discard(db.engine)
 
 '''
 Drink
@@ -38,21 +104,60 @@ class Drink(db.Model):
     id = Column(Integer().with_variant(Integer, "sqlite"), primary_key=True)
     # String Title
     title = Column(String(80), unique=True)
-    # the ingredients blob - this stores a lazy json blob
+    # the ingredients - stored as native JSON, so it is parsed once when the row is loaded
     # the required datatype is [{'color': string, 'name':string, 'parts':number}]
-    recipe =  Column(String(180), nullable=False)
+    # existing VARCHAR recipe columns hold the same JSON text and load unchanged
+    recipe = Column(JSON, nullable=False)
+
+    '''
+    validate_recipe()
+        runs whenever recipe is set
+        accepts the recipe list, a single ingredient dict or a JSON string of either
+        and drops the cached short recipe
+        raises ValueError unless every ingredient has a string name and color
+        and numeric parts, so short() and long() can always render it
+    '''
+    @validates('recipe')
+    def validate_recipe(self, key, recipe):
+        if isinstance(recipe, str):
+            recipe = json.loads(recipe)
+        if isinstance(recipe, dict):
+            recipe = [recipe]
+        if not isinstance(recipe, list) or not recipe:
+            raise ValueError('recipe must be a non-empty list of ingredients')
+        for ingredient in recipe:
+            if not (isinstance(ingredient, dict)
+                    and isinstance(ingredient.get('name'), str)
+                    and isinstance(ingredient.get('color'), str)
+                    and isinstance(ingredient.get('parts'), (int, float))
+                    and not isinstance(ingredient.get('parts'), bool)):
+                raise ValueError('each ingredient needs a string name and color and numeric parts')
+        self._short_recipe = None
+        return recipe
+
+    '''
+    short_recipe()
+        the recipe without ingredient names, built once per recipe value
+        the cache is keyed on the recipe list itself, so reloading the row
+        from the database (a new list) rebuilds it as well
+    '''
+    def short_recipe(self):
+        recipe = self.recipe
+        cached = getattr(self, '_short_recipe', None)
+        if cached is None or cached[0] is not recipe:
+            cached = (recipe, [{'color': r['color'], 'parts': r['parts']} for r in recipe])
+            self._short_recipe = cached
+        return cached[1]
 
     '''
     short()
         short form representation of the Drink model
     '''
     def short(self):
-        print(json.loads(self.recipe))
-        short_recipe = [{'color': r['color'], 'parts': r['parts']} for r in json.loads(self.recipe)]
         return {
             'id': self.id,
             'title': self.title,
-            'recipe': short_recipe
+            'recipe': self.short_recipe()
         }
 
     '''
@@ -63,7 +168,7 @@ class Drink(db.Model):
         return {
             'id': self.id,
             'title': self.title,
-            'recipe': json.loads(self.recipe)
+            'recipe': self.recipe
         }
 
     '''
@@ -104,4 +209,59 @@ class Drink(db.Model):
         db.session.commit()
 
     def __repr__(self):
-        return json.dumps(self.short())
\ No newline at end of file
+        return json.dumps(self.short())
+
+
+'''
+MenuVersion
+    a single row counting the writes to the drink table
+    it is bumped in the same transaction as each write, so every process
+    serving the menu can tell with one primary key lookup whether the copy
+    it built is still current
+'''
+class MenuVersion(db.Model):
+    __tablename__ = 'menu_version'
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False)
+
+
+# engines whose menu_version table is known to exist
+_ready_engines = set()
+
+'''
+ensure_menu_version(connection)
+    creates and seeds the menu_version row once per engine, for databases
+    made before it existed
+    the seed is the current time, so a recreated database does not hand out
+    ETags a client may still hold from before
+'''
+def ensure_menu_version(connection):
+    if connection.engine in _ready_engines:
+        return
+    table = MenuVersion.__table__
+    table.create(connection, checkfirst=True)
+    if connection.execute(table.select()).first() is None:
+        connection.execute(table.insert(), id=1, version=int(time.time()))
+    _ready_engines.add(connection.engine)
+
+'''
+current_menu_version()
+    the shared menu version, read through the request's session
+'''
+def current_menu_version():
+    ensure_menu_version(db.session.connection())
+    return db.session.query(MenuVersion.version).filter(MenuVersion.id == 1).scalar()
+
+'''
+bump_menu_version()
+    runs after every flush; a flush that adds, changes or deletes a drink
+    bumps the menu version in the same transaction, so the bump commits or
+    rolls back with the write
+'''
+@event.listens_for(Session, 'after_flush')
+def bump_menu_version(session, flush_context):
+    if not any(isinstance(instance, Drink) for instance in chain(session.new, session.dirty, session.deleted)):
+        return
+    connection = session.connection()
+    ensure_menu_version(connection)
+    connection.execute(MenuVersion.__table__.update().values(version=MenuVersion.version + 1))
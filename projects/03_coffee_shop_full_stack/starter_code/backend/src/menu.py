@@ -0,0 +1,79 @@
+import json
+import logging
+import threading
+
+from .database.models import Drink, current_menu_version
+
+logger = logging.getLogger(__name__)
+
+'''
+MenuSnapshot
+    the drink menu pre-serialized as the JSON bytes GET /drinks and
+    GET /drinks-detail send, with one ETag per variant
+
+    every write to the drink table bumps the shared menu version in its own
+    transaction (see MenuVersion). each get() reads that version, one
+    primary key lookup, and rebuilds the snapshot when it has moved on, so a
+    write made by another worker is served here from the next request. the
+    ETags are made from the version, so every worker hands out the same
+    ETag for the same menu.
+
+    the version is read before the drinks, so a snapshot is never older
+    than the version it is labelled with. a rebuild swaps in a complete new
+    snapshot in one assignment, so readers never see a half built menu.
+    the write endpoints call rebuild() after they commit, so the next read
+    here finds it ready.
+
+    a drink whose stored recipe cannot be rendered (a row written before
+    recipes were validated) is logged and left off the menu rather than
+    failing the whole menu.
+'''
+class MenuSnapshot:
+
+    def __init__(self):
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def rebuild(self, version=None):
+        if version is None:
+            version = current_menu_version()
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot['version'] == version:
+                # another request rebuilt it while this one waited
+                return snapshot
+            short, long = [], []
+            for drink in Drink.query.order_by(Drink.id).all():
+                try:
+                    rendered = drink.short(), drink.long()
+                except (KeyError, TypeError) as error:
+                    logger.warning('Leaving drink %s off the menu, its recipe is malformed: %r', drink.id, error)
+                    continue
+                short.append(rendered[0])
+                long.append(rendered[1])
+            snapshot = {
+                'version': version,
+                'short': self._encode(short, 'short-{}'.format(version)),
+                'long': self._encode(long, 'long-{}'.format(version))
+            }
+            self._snapshot = snapshot
+        return snapshot
+
+    '''
+    get(variant)
+        returns (body, etag) for 'short' or 'long'
+    '''
+    def get(self, variant):
+        version = current_menu_version()
+        snapshot = self._snapshot
+        if snapshot is None or snapshot['version'] != version:
+            snapshot = self.rebuild(version)
+        return snapshot[variant]
+
+    @staticmethod
+    def _encode(drinks, etag):
+        body = json.dumps({'success': True, 'drinks': drinks}, separators=(',', ':')).encode('utf-8')
+        return body, etag
@@ -0,0 +1,177 @@
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.auth.jwks import JWKSCache
+
+MAX_AGE = 600
+
+
+def rsa_key(kid):
+    return {'kid': kid, 'kty': 'RSA', 'use': 'sig', 'n': 'n-' + kid, 'e': 'AQAB'}
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class JWKSServer(ThreadingHTTPServer):
+    """A local stand-in for the identity provider's JWKS endpoint"""
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), JWKSHandler)
+        self.keys = [rsa_key('first')]
+        self.status = 200
+        self.requests = []
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/.well-known/jwks.json'.format(self.server_port)
+
+    def etag(self):
+        return '"{}"'.format(','.join(key['kid'] for key in self.keys))
+
+
+class JWKSHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.headers.get('If-None-Match'))
+        if server.status != 200:
+            self.send_response(server.status)
+            self.end_headers()
+            return
+        if self.headers.get('If-None-Match') == server.etag():
+            self.send_response(304)
+            self.send_header('Cache-Control', 'max-age={}'.format(MAX_AGE))
+            self.end_headers()
+            return
+        body = json.dumps({'keys': server.keys}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Cache-Control', 'public, max-age={}'.format(MAX_AGE))
+        self.send_header('ETag', server.etag())
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class JWKSCacheTestCase(unittest.TestCase):
+    """JWKSCache against a JWKS served over local HTTP, with a fake clock"""
+
+    def setUp(self):
+        self.server = JWKSServer()
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.clock = FakeClock()
+        self.cache = JWKSCache(self.server.url, min_forced_refresh_interval=30, timeout=2, clock=self.clock)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def wait_for_requests(self, count, timeout=5):
+        deadline = time.monotonic() + timeout
+        while len(self.server.requests) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # let the background refresh finish storing what it fetched
+        while self.cache._refreshing and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_keys_are_cached_for_max_age(self):
+        self.assertEqual(self.cache.get_key('first')['n'], 'n-first')
+        for _ in range(10):
+            self.cache.get_key('first')
+
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_only_rsa_signing_keys_are_kept(self):
+        self.server.keys = [
+            rsa_key('first'),
+            {'kid': 'no-use', 'kty': 'RSA', 'n': 'n-no-use', 'e': 'AQAB'},
+            {'kid': 'ec', 'kty': 'EC', 'use': 'sig', 'crv': 'P-256', 'x': 'x', 'y': 'y'},
+            {'kid': 'enc', 'kty': 'RSA', 'use': 'enc', 'n': 'n-enc', 'e': 'AQAB'},
+        ]
+
+        self.assertIsNotNone(self.cache.get_key('first'))
+        self.assertIsNotNone(self.cache.get_key('no-use'))
+        self.assertEqual(set(self.cache._keys), {'first', 'no-use'})
+
+    def test_expired_keys_are_revalidated_in_the_background(self):
+        self.cache.get_key('first')
+        self.clock.now += MAX_AGE + 1
+
+        # served from the stale keys straight away
+        self.assertIsNotNone(self.cache.get_key('first'))
+        self.wait_for_requests(2)
+
+        self.assertEqual(self.server.requests, [None, self.server.etag()])
+        self.assertEqual(self.cache._expires_at, self.clock.now + MAX_AGE)
+        self.assertIsNotNone(self.cache.get_key('first'))
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_rotated_key_is_fetched_on_first_use(self):
+        self.cache.get_key('first')
+        self.server.keys = [rsa_key('second')]
+        self.clock.now += 31
+
+        self.assertEqual(self.cache.get_key('second')['n'], 'n-second')
+        self.assertIsNone(self.cache.get_key('first'))
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_unknown_kids_force_a_refresh_at_most_once_per_interval(self):
+        self.cache.get_key('first')
+        self.clock.now += 31
+        self.cache.get_key('made-up')
+        self.cache.get_key('also-made-up')
+        self.assertEqual(len(self.server.requests), 2)
+
+        self.clock.now += 31
+        self.cache.get_key('made-up')
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_unknown_kid_on_a_cold_cache_fetches_once(self):
+        self.assertIsNone(self.cache.get_key('made-up'))
+
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_concurrent_first_requests_share_one_fetch(self):
+        threads = [threading.Thread(target=self.cache.get_key, args=('first',)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_failed_refresh_keeps_the_stale_keys(self):
+        self.cache.get_key('first')
+        self.server.status = 503
+        self.clock.now += MAX_AGE + 1
+
+        with self.assertLogs('src.auth.jwks', 'WARNING'):
+            self.cache.refresh()
+
+        self.assertEqual(self.cache.get_key('first')['n'], 'n-first')
+        # retried after a short pause, not on every request
+        self.assertEqual(self.cache._expires_at, self.clock.now + 30)
+
+    def test_first_fetch_failing_leaves_no_keys(self):
+        self.server.status = 500
+
+        with self.assertLogs('src.auth.jwks', 'WARNING'):
+            self.assertIsNone(self.cache.get_key('first'))
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
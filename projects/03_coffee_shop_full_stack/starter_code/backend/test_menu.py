@@ -0,0 +1,80 @@
+import json
+import os
+import tempfile
+import unittest
+
+from src.api import create_app
+from src.database.models import Drink, db
+
+RECIPE = [{'name': 'espresso', 'color': 'brown', 'parts': 1}]
+
+
+class MenuSnapshotTestCase(unittest.TestCase):
+    """Two apps on one SQLite file stand in for two workers"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        config = {'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(self.directory.name, 'test.db')}
+        self.writer = create_app(config)
+        self.reader = create_app(config)
+        with self.writer.app_context():
+            db.create_all()
+            Drink(title='Espresso', recipe=RECIPE).insert()
+
+    def tearDown(self):
+        for app in (self.writer, self.reader):
+            with app.app_context():
+                db.session.remove()
+                db.get_engine(app).dispose()
+        self.directory.cleanup()
+
+    def write(self, fn):
+        with self.writer.app_context():
+            fn()
+            db.session.remove()
+
+    def titles(self, response):
+        return [drink['title'] for drink in json.loads(response.data)['drinks']]
+
+    def test_unchanged_menu_is_not_modified(self):
+        client = self.reader.test_client()
+        etag = client.get('/drinks').headers['ETag']
+
+        response = client.get('/drinks', headers={'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_write_in_another_worker_is_served_with_a_new_etag(self):
+        client = self.reader.test_client()
+        first = client.get('/drinks')
+        self.assertEqual(self.titles(first), ['Espresso'])
+
+        self.write(lambda: Drink(title='Flat White', recipe=RECIPE).insert())
+        response = client.get('/drinks', headers={'If-None-Match': first.headers['ETag']})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.titles(response), ['Espresso', 'Flat White'])
+        self.assertNotEqual(response.headers['ETag'], first.headers['ETag'])
+
+    def test_workers_agree_on_the_etag(self):
+        self.assertEqual(
+            self.reader.test_client().get('/drinks').headers['ETag'],
+            self.writer.test_client().get('/drinks').headers['ETag'])
+
+    def test_rolled_back_write_keeps_the_etag(self):
+        client = self.reader.test_client()
+        etag = client.get('/drinks').headers['ETag']
+
+        def rolled_back():
+            db.session.add(Drink(title='Mocha', recipe=RECIPE))
+            db.session.flush()
+            db.session.rollback()
+
+        self.write(rolled_back)
+
+        self.assertEqual(client.get('/drinks', headers={'If-None-Match': etag}).status_code, 304)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
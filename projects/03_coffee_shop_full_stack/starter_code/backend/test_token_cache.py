@@ -0,0 +1,87 @@
+import unittest
+
+from src.auth.token_cache import VerifiedTokenCache
+
+NOW = 1000.0
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = NOW
+
+    def __call__(self):
+        return self.now
+
+
+def fake_verify(token):
+    # stands in for verify_decode_jwt: tokens look like 'subject.exp'
+    subject, exp = token.split('.', 1)
+    return {'sub': subject, 'exp': float(exp)}
+
+
+class VerifiedTokenCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = VerifiedTokenCache(max_tokens=2, clock=self.clock, log_every=0)
+
+    def token(self, subject, lifetime=3600):
+        return '{}.{}'.format(subject, NOW + lifetime)
+
+    def test_verified_payload_is_served_until_exp(self):
+        token = self.token('alice', lifetime=60)
+        self.assertIsNone(self.cache.get(token))
+        self.cache.verify(token, fake_verify)
+
+        self.clock.now += 59
+        self.assertEqual(self.cache.get(token)['sub'], 'alice')
+        self.clock.now += 1
+        self.assertIsNone(self.cache.get(token))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_least_recently_used_token_is_evicted(self):
+        alice, bob, carol = self.token('alice'), self.token('bob'), self.token('carol')
+        self.cache.verify(alice, fake_verify)
+        self.cache.verify(bob, fake_verify)
+        self.cache.get(alice)
+
+        self.cache.verify(carol, fake_verify)
+
+        self.assertIsNone(self.cache.get(bob))
+        self.assertIsNotNone(self.cache.get(alice))
+        self.assertIsNotNone(self.cache.get(carol))
+
+    def test_tokens_without_exp_are_not_cached(self):
+        self.cache.verify('no-exp', lambda token: {'sub': 'alice'})
+
+        self.assertIsNone(self.cache.get('no-exp'))
+
+    def test_stats_count_hits_misses_and_verifications(self):
+        token = self.token('alice')
+        self.cache.get(token)
+        self.cache.verify(token, fake_verify)
+        for _ in range(3):
+            self.cache.get(token)
+
+        stats = self.cache.stats()
+        self.assertEqual((stats['size'], stats['hits'], stats['misses']), (1, 3, 1))
+        self.assertEqual(stats['hit_rate'], 0.75)
+        self.assertEqual(stats['verifications'], 1)
+        self.assertGreaterEqual(stats['average_verification_ms'], 0)
+
+    def test_stats_are_logged_every_log_every_lookups(self):
+        self.cache.log_every = 2
+        token = self.token('alice')
+        self.cache.get(token)
+
+        with self.assertLogs('src.auth.token_cache', 'INFO') as logs:
+            self.cache.get(token)
+
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('hit rate 0.0%', logs.output[0])
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
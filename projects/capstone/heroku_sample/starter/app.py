@@ -1,11 +1,14 @@
 import os
 from flask import Flask
+from flask_cors import CORS
 from models import setup_db
 
 def create_app(test_config=None):
 
     app = Flask(__name__)
-    setup_db(app)
+    if test_config:
+        app.config.from_mapping(test_config)
+    setup_db(app, app.config.get('SQLALCHEMY_DATABASE_URI'))
     CORS(app)
 
     @app.route('/')
@@ -21,7 +24,5 @@ def create_app(test_config=None):
 
     return app
 
-app = create_app()
-
 if __name__ == '__main__':
-    app.run()
\ No newline at end of file
+    create_app().run()
@@ -0,0 +1,71 @@
+'''
+Measures heroku_sample startup in a fresh interpreter: the cold import of
+app, create_app(), the first request that touches no database, and the
+first query (which is when the database connection is opened).
+
+The old boot path ran db.create_all() inside every create_app(); its cost
+is measured last, against the already migrated database, for comparison.
+
+Uses DATABASE_URL when it is set, otherwise a throwaway SQLite file. The
+schema is put in place with `flask db upgrade` before timing, the same
+explicit step the Procfile's release phase runs.
+
+    python -m benchmarks.bench_startup    (from the starter directory)
+'''
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+RUNS = 5
+
+PROBE = """
+import json, os, time
+os.environ.setdefault('EXCITED', 'true')
+started = time.perf_counter()
+import app as heroku_app
+imported = time.perf_counter()
+app = heroku_app.create_app()
+created = time.perf_counter()
+response = app.test_client().get('/')
+assert response.status_code == 200
+served = time.perf_counter()
+from models import db, Person
+with app.app_context():
+    Person.query.count()
+    queried = time.perf_counter()
+    db.create_all()
+    reflected = time.perf_counter()
+print(json.dumps({
+    'import': imported - started,
+    'create_app': created - imported,
+    'first_request': served - created,
+    'first_query': queried - served,
+    'create_all': reflected - queried,
+}))
+"""
+
+
+def main():
+    starter = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    totals = {}
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ)
+        env.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(directory, 'bench.db'))
+        subprocess.run([sys.executable, '-m', 'flask', 'db', 'upgrade'],
+                       cwd=starter, env=env, check=True, capture_output=True)
+        for _ in range(RUNS):
+            output = subprocess.run(
+                [sys.executable, '-c', PROBE],
+                cwd=starter, env=env, check=True, capture_output=True, text=True).stdout
+            for phase, seconds in json.loads(output).items():
+                totals[phase] = totals.get(phase, 0) + seconds
+
+    print('average of {} cold starts'.format(RUNS))
+    for phase, seconds in totals.items():
+        print('{:>14} {:>8.1f} ms'.format(phase, 1000 * seconds / RUNS))
+
+
+if __name__ == '__main__':
+    main()
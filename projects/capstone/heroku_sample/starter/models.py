@@ -1,21 +1,26 @@
-from sqlalchemy import Column, String, create_engine
+import os
+from sqlalchemy import Column, String, Integer
 from flask_sqlalchemy import SQLAlchemy
-import json
-
-database_path = os.environ['DATABASE_URL']
+from flask_migrate import Migrate
 
 db = SQLAlchemy()
+migrate = Migrate()
 
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+
+    DATABASE_URL is read here rather than at import time, and nothing
+    connects to the database until the first query. tables are not created
+    either: the schema belongs to the migrations, which are applied as a
+    separate step with `flask db upgrade` (the Procfile's release phase on
+    heroku).
 '''
-def setup_db(app, database_path=database_path):
-    app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+def setup_db(app, database_path=None):
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_path or os.environ['DATABASE_URL']
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-    db.app = app
     db.init_app(app)
-    db.create_all()
+    migrate.init_app(app, db)
 
 
 '''
@@ -37,4 +42,4 @@ class Person(db.Model):
     return {
       'id': self.id,
       'name': self.name,
-      'catchphrase': self.catchphrase}
\ No newline at end of file
+      'catchphrase': self.catchphrase}
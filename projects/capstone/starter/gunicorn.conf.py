@@ -0,0 +1,21 @@
+# gunicorn settings for `gunicorn app:APP` (see Procfile), read from the
+# working directory. Heroku sets PORT and WEB_CONCURRENCY.
+
+import multiprocessing
+import os
+
+bind = '0.0.0.0:{}'.format(os.environ.get('PORT', '5000'))
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+
+# below the idle timeout of Heroku's router, so it doesn't reuse a
+# connection gunicorn is closing
+keepalive = 5
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+
+# restart workers now and then, staggered, so slow leaks can't build up
+max_requests = 1000
+max_requests_jitter = 100
+
+accesslog = '-'